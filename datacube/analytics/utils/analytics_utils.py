@@ -29,12 +29,21 @@ from __future__ import absolute_import
 from __future__ import print_function
 import math
 import csv
+import dask.array as da
 import numpy as np
 from scipy import ndimage
 from scipy.io import netcdf
 from osgeo import gdal, osr
 import xarray
 
+# Known good pixel values, and the amount of dilation to apply, in get_pqa_mask
+GOOD_PIXEL_MASKS = [32767, 16383, 2457]
+PQA_DILATION = 3
+
+# Whether each value of a (dilated) pqa array is good. Dilation can carry values past 16 bits.
+_GOOD_PIXELS = np.zeros(1 << 17, dtype=bool)
+_GOOD_PIXELS[GOOD_PIXEL_MASKS] = True
+
 
 def plot(array_result):
     '''
@@ -129,13 +138,15 @@ def get_pqa_mask(pqa_ndarray):
     create pqa_mask from a ndarray
 
     Parameters:
-        pqa_ndarray: input pqa array
-        good_pixel_masks: known good pixel values
-        dilation: amount of dilation to apply
+        pqa_ndarray: input pqa array (numpy or dask)
     '''
 
-    good_pixel_masks = [32767, 16383, 2457]
-    dilation = 3
+    if isinstance(pqa_ndarray, da.Array):
+        # Each block overlaps its neighbours by the dilation
+        return pqa_ndarray.map_overlap(get_pqa_mask, depth={0: 0, 1: PQA_DILATION, 2: PQA_DILATION},
+                                       boundary='none', dtype=bool)
+
+    dilation = PQA_DILATION
     pqa_mask = np.zeros(pqa_ndarray.shape, dtype=np.bool)
     for i in range(len(pqa_ndarray)):
         pqa_array = pqa_ndarray[i]
@@ -168,6 +179,5 @@ def get_pqa_mask(pqa_ndarray):
         dif[dif < 0] = 1
         pqa_array += (dif << 13)
 
-        for good_pixel_mask in good_pixel_masks:
-            pqa_mask[i][pqa_array == good_pixel_mask] = True
+        pqa_mask[i] = _GOOD_PIXELS.take(pqa_array, mode='clip')
     return pqa_mask
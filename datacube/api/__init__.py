@@ -4,9 +4,10 @@ Modules for the Storage and Access Query API
 """
 from __future__ import absolute_import
 
-from datacube.storage.masking import list_flag_names, describe_variable_flags, make_mask
+from datacube.storage.masking import list_flag_names, describe_variable_flags, make_mask, make_any_mask
 from ._api import API
 from .core import Datacube
 from .grid_workflow import GridWorkflow, Tile
 
-__all__ = ['API', 'Datacube', 'GridWorkflow', 'Tile', 'list_flag_names', 'describe_variable_flags', 'make_mask']
+__all__ = ['API', 'Datacube', 'GridWorkflow', 'Tile', 'list_flag_names', 'describe_variable_flags', 'make_mask',
+           'make_any_mask']
@@ -257,7 +257,7 @@ class API(object):
                                                                             group_by)
         return dataset_groups
 
-    def get_data(self, data_request, dataset_groups=None, return_all=False):
+    def get_data(self, data_request, dataset_groups=None, return_all=False, dask_chunks=None):
         """
         Gets the data for a ``ExecutionEngine`` query.
         Function to return composite in-memory arrays.
@@ -327,6 +327,8 @@ class API(object):
             otherwise only the first result is returned.
 
         :type dataset_groups: dict{dataset_type: list(Group(key, list(datasets)))}
+        :param dict dask_chunks: If the data should be loaded lazily as :class:`dask.array.Array`,
+            the chunk size in each dimension.
         :return: A mapping product
 
         .. seealso:: :meth:`get_descriptor`
@@ -338,7 +340,7 @@ class API(object):
             dataset_groups = self._get_dataset_groups(query)
 
         all_datasets = {dt.name: self._get_data_for_type(dt, sources, query.measurements,
-                                                         query.geopolygon, query.slices)
+                                                         query.geopolygon, query.slices, chunks=dask_chunks)
                         for dt, sources in dataset_groups.items()}
         if all_datasets and not return_all:
             type_name, data_descriptor = all_datasets.popitem()
@@ -15,9 +15,10 @@ from dask import array as da
 from ..config import LocalConfig
 from ..compat import string_types
 from ..index import index_connect
-from ..storage.storage import DatasetSource, reproject_and_fuse
+from ..storage.storage import new_datasource, reproject_and_fuse
 from ..utils import geometry, intersects, data_resolution_and_offset
 from .query import Query, query_group_by, query_geopolygon
+from .reducers import get_reducer
 
 _LOG = logging.getLogger(__name__)
 
@@ -134,7 +135,8 @@ class Datacube(object):
 
     #: pylint: disable=too-many-arguments, too-many-locals
     def load(self, product=None, measurements=None, output_crs=None, resolution=None, resampling=None, stack=False,
-             dask_chunks=None, like=None, fuse_func=None, align=None, datasets=None, **query):
+             dask_chunks=None, like=None, fuse_func=None, align=None, datasets=None, dtype=None, nodata_to_nan=False,
+             scale_offset=False, reduce=None, **query):
         """
         Load data as an ``xarray`` object.  Each measurement will be a data variable in the :class:`xarray.Dataset`.
 
@@ -214,6 +216,18 @@ class Datacube(object):
                 dc.load(product='ls5_nbar_albers', x=(148.15, 148.2), y=(-35.15, -35.2), time=('1990', '1991'),
                         output_crs='EPSG:3577`, resolution=(-25, 25), resampling='cubic')
 
+            To load data as floats, with nodata as ``NaN``, supply the ``dtype`` and ``nodata_to_nan`` fields.
+            The data is converted as it's read, without loading it in its stored type first::
+
+                dc.load(product='ls5_nbar_albers', x=(148.15, 148.2), y=(-35.15, -35.2), time=('1990', '1991'),
+                        dtype='float32', nodata_to_nan=True)
+
+            To load a composite of all the times, rather than each one, supply a ``reduce`` method.
+            Each time is combined into it as it's loaded, so the data of every time isn't in memory at once::
+
+                dc.load(product='ls5_nbar_albers', x=(148.15, 148.2), y=(-35.15, -35.2), time=('1990', '1991'),
+                        reduce='median')
+
         :param str product: the product to be included.
 
         :param measurements:
@@ -280,6 +294,25 @@ class Datacube(object):
             Optional. If this is a non-empty list of :class:`datacube.model.Dataset` objects, these will be loaded
             instead of performing a database lookup.
 
+        :param str dtype:
+            Data type to load the measurements as, instead of their stored type.
+
+            Defaults to a floating point type (``float32`` for 8 and 16 bit data) when ``nodata_to_nan`` or
+            ``scale_offset`` is set.
+
+        :param bool nodata_to_nan:
+            Load nodata pixels as ``NaN``, rather than the measurement's ``nodata`` value.
+
+        :param bool scale_offset:
+            Scale the data by the ``scale_factor`` and ``add_offset`` of each measurement (if defined), as it's
+            loaded. Nodata pixels aren't scaled.
+
+        :param reduce:
+            Combine the times into a single composite as they're loaded: one of
+            ``'mean', 'median', 'min', 'max', 'count', 'first', 'last'``, or a
+            :class:`datacube.api.reducers.Reducer`, such as :class:`~datacube.api.reducers.BestPixel`.
+            The result has no time dimension. Not supported with ``dask_chunks``.
+
         :return: Requested data in a :class:`xarray.Dataset`.
             As a :class:`xarray.DataArray` if the ``stack`` variable is supplied.
 
@@ -317,9 +350,15 @@ class Datacube(object):
 
         measurements = self.index.products.get_by_name(product).lookup_measurements(measurements)
         measurements = set_resampling_method(measurements, resampling)
+        measurements = set_measurement_conversion(measurements, dtype, nodata_to_nan, scale_offset)
 
-        result = self.load_data(grouped, geobox, measurements.values(),
-                                fuse_func=fuse_func, dask_chunks=dask_chunks)
+        if reduce is not None:
+            if dask_chunks is not None:
+                raise ValueError("'reduce' and 'dask_chunks' are not supported together")
+            result = self.reduce_data(grouped, geobox, measurements.values(), reduce, fuse_func=fuse_func)
+        else:
+            result = self.load_data(grouped, geobox, measurements.values(),
+                                    fuse_func=fuse_func, dask_chunks=dask_chunks)
         if not stack:
             return result
         else:
@@ -449,7 +488,8 @@ class Datacube(object):
         return Datacube.load_data(*args, **kwargs)
 
     @staticmethod
-    def load_data(sources, geobox, measurements, fuse_func=None, dask_chunks=None, skip_broken_datasets=False):
+    def load_data(sources, geobox, measurements, fuse_func=None, dask_chunks=None, skip_broken_datasets=False,
+                  lock=None, reproject_threads=None):
         """
         Load data from :meth:`group_datasets` into an :class:`xarray.Dataset`.
 
@@ -472,6 +512,15 @@ class Datacube(object):
             See the documentation on using `xarray with dask <http://xarray.pydata.org/en/stable/dask.html>`_
             for more information.
 
+        :param lock:
+            With ``dask_chunks``, a lock (eg. :class:`threading.Lock`) held while each chunk is read. Share it
+            with anything else using a storage library that isn't thread safe. (NetCDF sources already hold the
+            :data:`datacube.storage.storage.NETCDF_LOCK` while they're read)
+
+        :param int reproject_threads:
+            Number of threads GDAL uses to reproject each source. Defaults to the global ``reproject_threads``
+            option (see :class:`datacube.set_options`): give it here when loading from several threads at once.
+
         :rtype: xarray.Dataset
 
         .. seealso:: :meth:`find_datasets` :meth:`group_datasets`
@@ -481,15 +530,68 @@ class Datacube(object):
                 data = numpy.full(sources.shape + geobox.shape, measurement['nodata'], dtype=measurement['dtype'])
                 for index, datasets in numpy.ndenumerate(sources.values):
                     _fuse_measurement(data[index], datasets, geobox, measurement, fuse_func=fuse_func,
-                                      skip_broken_datasets=skip_broken_datasets)
+                                      skip_broken_datasets=skip_broken_datasets,
+                                      reproject_threads=reproject_threads)
                 return data
         else:
             def data_func(measurement):
-                return _make_dask_array(sources, geobox, measurement, fuse_func, dask_chunks)
+                return _make_dask_array(sources, geobox, measurement, fuse_func, dask_chunks, lock,
+                                        reproject_threads)
 
         return Datacube.create_storage(OrderedDict((dim, sources.coords[dim]) for dim in sources.dims),
                                        geobox, measurements, data_func)
 
+    @staticmethod
+    def reduce_data(sources, geobox, measurements, reduce, fuse_func=None, skip_broken_datasets=False):
+        """
+        Load data from :meth:`group_datasets`, reduced to a single composite of all the groups.
+
+        The groups are loaded one at a time (for each spatial chunk of the reducer), and combined by the reducer
+        as they are loaded.
+
+        :param xarray.DataArray sources:
+            DataArray holding a list of :class:`datacube.model.Dataset`, grouped along the time dimension
+
+        :param GeoBox geobox:
+            A GeoBox defining the output spatial projection and resolution
+
+        :param measurements:
+            list of measurement dicts with keys: {'name', 'dtype', 'nodata', 'units'}
+
+        :param reduce:
+            name of a reducer in :data:`datacube.api.reducers.REDUCERS`, or a
+            :class:`datacube.api.reducers.Reducer`
+
+        :param fuse_func:
+            function to merge successive arrays as an output
+
+        :rtype: xarray.Dataset
+
+        .. seealso:: :meth:`load_data`
+        """
+        reducer = get_reducer(reduce)
+        measurements = list(measurements)
+        reduced = [reducer.measurement(measurement) for measurement in measurements]
+        data = dict((measurement['name'], numpy.full(geobox.shape, measurement['nodata'], dtype=measurement['dtype']))
+                    for measurement in reduced)
+
+        def time_slices(chunk_geobox):
+            for datasets in sources.values.ravel():
+                time_slice = {}
+                for measurement in measurements:
+                    time_slice[measurement['name']] = numpy.full(chunk_geobox.shape, measurement['nodata'],
+                                                                 dtype=measurement['dtype'])
+                    _fuse_measurement(time_slice[measurement['name']], datasets, chunk_geobox, measurement,
+                                      fuse_func=fuse_func, skip_broken_datasets=skip_broken_datasets)
+                yield time_slice
+
+        for chunk_slices in _chunk_slices(geobox.shape, reducer.chunk_shape or geobox.shape):
+            result = reducer.reduce(measurements, time_slices(geobox[chunk_slices]))
+            for name, array in result.items():
+                data[name][chunk_slices] = array
+
+        return Datacube.create_storage(OrderedDict(), geobox, reduced, lambda measurement: data[measurement['name']])
+
     @staticmethod
     def measurement_data(sources, geobox, measurement, fuse_func=None, dask_chunks=None):
         """
@@ -532,22 +634,31 @@ class Datacube(object):
         self.close()
 
 
-def fuse_lazy(datasets, geobox, measurement, fuse_func=None, prepend_dims=0):
+def fuse_lazy(datasets, geobox, measurement, fuse_func=None, prepend_dims=0, lock=None, reproject_threads=None):
     prepend_shape = (1,) * prepend_dims
     data = numpy.full(geobox.shape, measurement['nodata'], dtype=measurement['dtype'])
-    _fuse_measurement(data, datasets, geobox, measurement, fuse_func)
+    if lock is None:
+        _fuse_measurement(data, datasets, geobox, measurement, fuse_func=fuse_func,
+                          reproject_threads=reproject_threads)
+    else:
+        with lock:
+            _fuse_measurement(data, datasets, geobox, measurement, fuse_func=fuse_func,
+                              reproject_threads=reproject_threads)
     return data.reshape(prepend_shape + geobox.shape)
 
 
-def _fuse_measurement(dest, datasets, geobox, measurement, skip_broken_datasets=False, fuse_func=None):
-    reproject_and_fuse([DatasetSource(dataset, measurement['name']) for dataset in datasets],
+def _fuse_measurement(dest, datasets, geobox, measurement, skip_broken_datasets=False, fuse_func=None,
+                      reproject_threads=None):
+    reproject_and_fuse([new_datasource(dataset, measurement['name']) for dataset in datasets],
                        dest,
                        geobox.affine,
                        geobox.crs,
                        dest.dtype.type(measurement['nodata']),
                        resampling=measurement.get('resampling_method', 'nearest'),
                        fuse_func=fuse_func,
-                       skip_broken_datasets=skip_broken_datasets)
+                       skip_broken_datasets=skip_broken_datasets,
+                       scale_offset=measurement.get('scale_offset'),
+                       reproject_threads=reproject_threads)
 
 
 def get_bounds(datasets, crs):
@@ -572,6 +683,36 @@ def set_resampling_method(measurements, resampling=None):
     return measurements
 
 
+def set_measurement_conversion(measurements, dtype=None, nodata_to_nan=False, scale_offset=False):
+    """
+    Measurements to convert as they're loaded: to `dtype`, with nodata as NaN, and/or scaled by their
+    `scale_factor` and `add_offset`.
+    """
+    if dtype is None and not nodata_to_nan and not scale_offset:
+        return measurements
+
+    def make_converted_measurement(measurement):
+        if dtype is not None:
+            out_dtype = numpy.dtype(dtype)
+        else:
+            out_dtype = numpy.result_type(measurement['dtype'], numpy.float32)
+        if (nodata_to_nan or scale_offset) and out_dtype.kind != 'f':
+            raise ValueError("Can't load %s as %s: nodata_to_nan and scale_offset need a floating point dtype" %
+                             (measurement['name'], out_dtype))
+
+        measurement = measurement.copy()
+        measurement['dtype'] = out_dtype.name
+        if nodata_to_nan:
+            measurement['nodata'] = float('nan')
+        if scale_offset:
+            measurement['scale_offset'] = (measurement.get('scale_factor', 1), measurement.get('add_offset', 0))
+        return measurement
+
+    measurements = OrderedDict((name, make_converted_measurement(measurement))
+                               for name, measurement in measurements.items())
+    return measurements
+
+
 def datatset_type_to_row(dt):
     row = {
         'id': dt.id,
@@ -589,6 +730,12 @@ def datatset_type_to_row(dt):
     return row
 
 
+def _chunk_slices(shape, chunk_size):
+    """Slices of each chunk of an array"""
+    for chunk_index in numpy.ndindex(*[int(ceil(s / float(c))) for s, c in zip(shape, chunk_size)]):
+        yield tuple(slice(i * c, min((i + 1) * c, s)) for i, c, s in zip(chunk_index, chunk_size, shape))
+
+
 def _chunk_geobox(geobox, chunk_size):
     num_grid_chunks = [int(ceil(s/float(c))) for s, c in zip(geobox.shape, chunk_size)]
     geobox_subsets = {}
@@ -617,7 +764,8 @@ def _calculate_chunk_sizes(sources, geobox, dask_chunks):
     return irr_chunks, grid_chunks
 
 
-def _make_dask_array(sources, geobox, measurement, fuse_func=None, dask_chunks=None):
+def _make_dask_array(sources, geobox, measurement, fuse_func=None, dask_chunks=None, lock=None,
+                     reproject_threads=None):
     dsk_name = 'datacube_' + measurement['name']
 
     irr_chunks, grid_chunks = _calculate_chunk_sizes(sources, geobox, dask_chunks)
@@ -629,7 +777,8 @@ def _make_dask_array(sources, geobox, measurement, fuse_func=None, dask_chunks=N
     for irr_index, datasets in numpy.ndenumerate(sources.values):
         for grid_index, subset_geobox in geobox_subsets.items():
             dsk[(dsk_name,) + irr_index + grid_index] = (fuse_lazy,
-                                                         datasets, subset_geobox, measurement, fuse_func, sources.ndim)
+                                                         datasets, subset_geobox, measurement, fuse_func, sources.ndim,
+                                                         lock, reproject_threads)
 
     data = da.Array(dsk, dsk_name,
                     chunks=(sliced_irr_chunks + grid_chunks),
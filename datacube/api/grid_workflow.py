@@ -28,6 +28,21 @@ def _fast_slice(array, indexers):
     return xarray.DataArray(variable, coords=coords, fastpath=True)
 
 
+def _same_grid(a, b):
+    """
+    Do the grids have the same cells?
+
+    :type a: datacube.model.GridSpec
+    :type b: datacube.model.GridSpec
+    """
+    if a is None or b is None or a.tile_size is None or b.tile_size is None:
+        return False
+    return (a.crs == b.crs and
+            tuple(a.tile_size) == tuple(b.tile_size) and
+            tuple(a.resolution) == tuple(b.resolution) and
+            tuple(a.origin) == tuple(b.origin))
+
+
 class Tile(object):
     """
     The Tile object holds a lightweight representation of a datacube result.
@@ -152,6 +167,10 @@ class GridWorkflow(object):
             grid_spec = product and product.grid_spec
         self.grid_spec = grid_spec
 
+        # Names of products found to have the cells of all their datasets recorded in the index.
+        # (datasets added since then have their cells recorded as they're added)
+        self._products_with_cells = set()
+
     def cell_observations(self, cell_index=None, geopolygon=None, tile_buffer=(0, 0), **indexers):
         """
         List datasets, grouped by cell.
@@ -179,43 +198,74 @@ class GridWorkflow(object):
         def add_dataset_to_cells(tile_index, tile_geobox, dataset_):
             cells.setdefault(tile_index, {'datasets': [], 'geobox': tile_geobox})['datasets'].append(dataset_)
 
+        def add_datasets_to_tiles(datasets_, tile_buffer_=(0, 0), only_tiles=None):
+            # GeoBoxes are only made for the cells we return.
+            for dataset_, tile_indexes in zip(datasets_,
+                                              self.grid_spec.tile_indexes([d.extent for d in datasets_],
+                                                                          tile_buffer=tile_buffer_)):
+                for tile_index in tile_indexes:
+                    if only_tiles is not None and tile_index not in only_tiles:
+                        continue
+                    if tile_index not in cells:
+                        tile_geobox = self.grid_spec.tile_geobox(tile_index)
+                        if tile_buffer_:
+                            tile_geobox = tile_geobox.buffered(*tile_buffer_)
+                        cells[tile_index] = {'datasets': [], 'geobox': tile_geobox}
+                    cells[tile_index]['datasets'].append(dataset_)
+
         if cell_index:
             assert len(cell_index) == 2
             cell_index = tuple(cell_index)
             geobox = self.grid_spec.tile_geobox(cell_index)
             geobox = geobox.buffered(*tile_buffer) if tile_buffer else geobox
 
-            datasets, query = self._find_datasets(geobox.extent, indexers)
+            datasets = None if any(tile_buffer) else self._find_cell_datasets(cell_index, indexers)
+            if datasets is None:
+                datasets, query = self._find_datasets(geobox.extent, indexers)
+                datasets = [dataset for dataset in datasets
+                            if intersects(geobox.extent, dataset.extent.to_crs(self.grid_spec.crs))]
             for dataset in datasets:
-                if intersects(geobox.extent, dataset.extent.to_crs(self.grid_spec.crs)):
-                    add_dataset_to_cells(cell_index, geobox, dataset)
+                add_dataset_to_cells(cell_index, geobox, dataset)
             return cells
         else:
             datasets, query = self._find_datasets(geopolygon, indexers)
 
             if query.geopolygon:
                 # Get a rough region of tiles
-                query_tiles = set(
-                    tile_index for tile_index, tile_geobox in
-                    self.grid_spec.tiles_inside_geopolygon(query.geopolygon))
-
-                for dataset in datasets:
-                    # Go through our datasets and see which tiles each dataset produces, and whether they intersect
-                    # our query geopolygon.
-                    dataset_extent = dataset.extent.to_crs(self.grid_spec.crs)
-                    for tile_index, tile_geobox in self.grid_spec.tiles(
-                            dataset_extent.boundingbox.buffered(*tile_buffer)):
-                        if tile_index in query_tiles and intersects(tile_geobox.extent, dataset_extent):
-                            add_dataset_to_cells(tile_index, tile_geobox, dataset)
+                query_tiles = set(self.grid_spec.tile_indexes([query.geopolygon])[0])
+
+                # See which tiles each dataset produces, and whether they intersect our query geopolygon.
+                add_datasets_to_tiles(datasets, only_tiles=query_tiles)
 
             else:
-                for dataset in datasets:
-                    for tile_index, tile_geobox in self.grid_spec.tiles_inside_geopolygon(dataset.extent,
-                                                                                          tile_buffer=tile_buffer):
-                        add_dataset_to_cells(tile_index, tile_geobox, dataset)
+                add_datasets_to_tiles(datasets, tile_buffer_=tile_buffer)
 
             return cells
 
+    def _find_cell_datasets(self, cell_index, indexers):
+        """
+        Look up the datasets in a cell from the cells recorded in the index, if possible.
+
+        Only possible when the product's grid is our grid, and the index has the cells of all of its datasets.
+
+        :return: the datasets, or None if they need to be found by a spatial search
+        """
+        query = Query(index=self.index, **indexers)
+        if not query.product:
+            raise RuntimeError('must specify a product')
+
+        if query.product not in self._products_with_cells:
+            product = self.index.products.get_by_name(query.product)
+            if product is None or not _same_grid(product.grid_spec, self.grid_spec):
+                return None
+            if not self.index.datasets.has_all_cells(product):
+                _LOG.info('Cells of %s datasets are not all indexed (see: datacube product index-cells)',
+                          product.name)
+                return None
+            self._products_with_cells.add(query.product)
+
+        return list(self.index.datasets.search_by_cell(cell_index, **query.search_terms))
+
     def _find_datasets(self, geopolygon, indexers):
         query = Query(index=self.index, geopolygon=geopolygon, **indexers)
         if not query.product:
@@ -329,7 +379,8 @@ class GridWorkflow(object):
         return self.tile_sources(observations, query_group_by(**query))
 
     @staticmethod
-    def load(tile, measurements=None, dask_chunks=None, fuse_func=None, resampling=None, skip_broken_datasets=False):
+    def load(tile, measurements=None, dask_chunks=None, fuse_func=None, resampling=None, skip_broken_datasets=False,
+             lock=None):
         """
         Load data for a cell/tile.
 
@@ -360,6 +411,8 @@ class GridWorkflow(object):
 
             Defaults to ``'nearest'``.
 
+        :param lock: With ``dask_chunks``, a lock held while each chunk is read: see :meth:`datacube.Datacube.load_data`
+
         :rtype: :py:class:`xarray.Dataset`
 
         .. seealso::
@@ -373,7 +426,7 @@ class GridWorkflow(object):
         measurements = set_resampling_method(measurements, resampling)
 
         dataset = Datacube.load_data(tile.sources, tile.geobox, measurements.values(), dask_chunks=dask_chunks,
-                                     fuse_func=fuse_func, skip_broken_datasets=skip_broken_datasets)
+                                     fuse_func=fuse_func, skip_broken_datasets=skip_broken_datasets, lock=lock)
 
         return dataset
 
@@ -0,0 +1,283 @@
+"""
+Reducers, combining the time slices of a load into a single composite as they are loaded.
+
+A reducer is given the time slices one at a time, so the ``(time, y, x)`` cube is never in memory at once.
+Online statistics (mean, min, max, count, first, last, best pixel) keep only running state. The median needs
+every observation of a pixel, so it loads a spatial chunk at a time.
+
+Use with :meth:`datacube.Datacube.load`::
+
+    dc.load(product='ls5_nbar_albers', time=('1990', '1991'), reduce='median')
+    dc.load(product='ls5_nbar_albers', time=('1990', '1991'),
+            reduce=BestPixel(lambda data: (data['nir'] - data['red']) / (data['nir'] + data['red'])))
+"""
+from __future__ import absolute_import, division
+
+import warnings
+
+import numpy
+
+from ..compat import string_types
+
+
+def _is_nan(value):
+    return value != value
+
+
+def valid_data(data, nodata):
+    """
+    Boolean array of where a time slice has data: isn't `nodata`, or NaN.
+
+    :param numpy.ndarray data:
+    :param nodata: nodata value of the data, if any
+    """
+    valid = numpy.ones(data.shape, dtype=bool) if data.dtype.kind != 'f' else ~numpy.isnan(data)
+    if nodata is not None and not _is_nan(nodata):
+        valid &= data != nodata
+    return valid
+
+
+def _float_measurement(measurement):
+    """A floating point version of a measurement, with NaN nodata"""
+    measurement = measurement.copy()
+    measurement['dtype'] = numpy.result_type(measurement['dtype'], numpy.float32).name
+    measurement['nodata'] = float('nan')
+    return measurement
+
+
+class Reducer(object):
+    """
+    Combines the time slices of some measurements into one.
+    """
+    #: (y, x) size of the spatial chunks to reduce at a time, or None to reduce the whole extent at once
+    chunk_shape = None
+
+    def measurement(self, measurement):
+        """
+        Definition of the reduced measurement: name, dtype, nodata and units
+
+        :param dict measurement: measurement being reduced
+        """
+        return measurement
+
+    def reduce(self, measurements, slices):
+        """
+        Reduce the time slices.
+
+        :param list[dict] measurements: measurements being reduced
+        :param slices: iterator of time slices, in time order. Each is a dict of measurement name to 2D array.
+        :return: dict of measurement name to the reduced 2D array
+        """
+        raise NotImplementedError
+
+
+class _SliceReducer(Reducer):
+    """
+    A reducer updating a running result with each time slice.
+    """
+
+    def reduce(self, measurements, slices):
+        state = None
+        for data in slices:
+            if state is None:
+                state = self.start(measurements, data)
+            self.update(measurements, state, data)
+        if state is None:
+            return {}
+        return self.finish(measurements, state)
+
+    def start(self, measurements, data):
+        """
+        The running result of the measurements, given the first time slice.
+        """
+        return dict((measurement['name'], numpy.full(data[measurement['name']].shape,
+                                                     self.measurement(measurement)['nodata'],
+                                                     dtype=self.measurement(measurement)['dtype']))
+                    for measurement in measurements)
+
+    def update(self, measurements, state, data):
+        raise NotImplementedError
+
+    def finish(self, measurements, state):
+        return state
+
+
+class Count(_SliceReducer):
+    """Number of valid observations of each pixel"""
+
+    def measurement(self, measurement):
+        return dict(measurement, dtype='int16', nodata=-1, units='1')
+
+    def start(self, measurements, data):
+        return dict((measurement['name'], numpy.zeros(data[measurement['name']].shape, dtype='int16'))
+                    for measurement in measurements)
+
+    def update(self, measurements, state, data):
+        for measurement in measurements:
+            state[measurement['name']] += valid_data(data[measurement['name']], measurement['nodata'])
+
+
+class Mean(_SliceReducer):
+    """Mean of the valid observations of each pixel"""
+
+    def measurement(self, measurement):
+        return _float_measurement(measurement)
+
+    def start(self, measurements, data):
+        return dict((measurement['name'], (numpy.zeros(data[measurement['name']].shape, dtype='float64'),
+                                           numpy.zeros(data[measurement['name']].shape, dtype='int32')))
+                    for measurement in measurements)
+
+    def update(self, measurements, state, data):
+        for measurement in measurements:
+            total, count = state[measurement['name']]
+            array = data[measurement['name']]
+            valid = valid_data(array, measurement['nodata'])
+            numpy.add(total, array, out=total, where=valid, casting='unsafe')
+            count += valid
+
+    def finish(self, measurements, state):
+        result = {}
+        for measurement in measurements:
+            total, count = state[measurement['name']]
+            mean = numpy.full(total.shape, numpy.nan, dtype=self.measurement(measurement)['dtype'])
+            numpy.divide(total, count, out=mean, where=count > 0, casting='unsafe')
+            result[measurement['name']] = mean
+        return result
+
+
+class _Select(_SliceReducer):
+    """
+    A reducer keeping, for each pixel, the valid observation selected by `_replace`.
+    """
+
+    def update(self, measurements, state, data):
+        for measurement in measurements:
+            current = state[measurement['name']]
+            array = data[measurement['name']]
+            replace = self._replace(current, array, measurement['nodata'])
+            numpy.copyto(current, array, where=replace)
+
+    def _replace(self, current, array, nodata):
+        raise NotImplementedError
+
+
+class Min(_Select):
+    """Minimum of the valid observations of each pixel"""
+
+    def _replace(self, current, array, nodata):
+        return valid_data(array, nodata) & (~valid_data(current, nodata) | (array < current))
+
+
+class Max(_Select):
+    """Maximum of the valid observations of each pixel"""
+
+    def _replace(self, current, array, nodata):
+        return valid_data(array, nodata) & (~valid_data(current, nodata) | (array > current))
+
+
+class First(_Select):
+    """First valid observation of each pixel"""
+
+    def _replace(self, current, array, nodata):
+        return valid_data(array, nodata) & ~valid_data(current, nodata)
+
+
+class Last(_Select):
+    """Last valid observation of each pixel"""
+
+    def _replace(self, current, array, nodata):
+        return valid_data(array, nodata)
+
+
+class BestPixel(_SliceReducer):
+    """
+    For each pixel, every measurement from the time slice with the highest score, eg. the greenest (max NDVI)
+
+    Pixels are only taken where all the measurements are valid.
+    """
+
+    def __init__(self, score):
+        """
+        :param score: function of a time slice (dict of measurement name to 2D array) returning a 2D array of
+                      the score of each pixel. NaN scores are never the best.
+        """
+        self.score = score
+
+    def start(self, measurements, data):
+        state = super(BestPixel, self).start(measurements, data)
+        state[None] = numpy.full(next(iter(data.values())).shape, -numpy.inf)
+        return state
+
+    def update(self, measurements, state, data):
+        best = state[None]
+        valid = numpy.ones(best.shape, dtype=bool)
+        for measurement in measurements:
+            valid &= valid_data(data[measurement['name']], measurement['nodata'])
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            score = numpy.asarray(self.score(data), dtype='float64')
+            replace = valid & (score > best)
+        numpy.copyto(best, score, where=replace)
+        for measurement in measurements:
+            numpy.copyto(state[measurement['name']], data[measurement['name']], where=replace)
+
+    def finish(self, measurements, state):
+        del state[None]
+        return state
+
+
+class Median(Reducer):
+    """
+    Median of the valid observations of each pixel
+
+    Every observation of a chunk is loaded at once: memory use is ``time x chunk_shape`` for each measurement.
+    """
+
+    def __init__(self, chunk_shape=(512, 512)):
+        """
+        :param (int,int) chunk_shape: (y, x) size of the spatial chunks to load at a time
+        """
+        self.chunk_shape = chunk_shape
+
+    def measurement(self, measurement):
+        return _float_measurement(measurement)
+
+    def reduce(self, measurements, slices):
+        stacks = dict((measurement['name'], []) for measurement in measurements)
+        for data in slices:
+            for measurement in measurements:
+                array = data[measurement['name']].astype(self.measurement(measurement)['dtype'])
+                array[~valid_data(array, measurement['nodata'])] = numpy.nan
+                stacks[measurement['name']].append(array)
+
+        result = {}
+        for name, stack in stacks.items():
+            if stack:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)  # (All-NaN slices)
+                    result[name] = numpy.nanmedian(numpy.stack(stack), axis=0)
+        return result
+
+
+#: Reducers by name, for ``dc.load(reduce=<name>)``
+REDUCERS = {
+    'count': Count,
+    'first': First,
+    'last': Last,
+    'max': Max,
+    'mean': Mean,
+    'median': Median,
+    'min': Min,
+}
+
+
+def get_reducer(reduce):
+    """
+    :param reduce: name of a reducer in `REDUCERS`, or a :class:`Reducer`
+    :rtype: Reducer
+    """
+    if isinstance(reduce, string_types):
+        if reduce not in REDUCERS:
+            raise ValueError('Unknown reducer %r. Valid reducers are: %s' % (reduce, ', '.join(sorted(REDUCERS))))
+        return REDUCERS[reduce]()
+    return reduce
@@ -25,11 +25,15 @@ DEFAULT_CONF_PATHS = (
 # Default configuration options.
 _DEFAULT_CONF = u"""
 [datacube]
+# Index backend: 'postgres', or 'sqlite' for an embedded (serverless) index stored at db_path.
+index_driver: postgres
 # Blank implies localhost
 db_hostname:
 db_database: datacube
 # If a connection is unused for this length of time, expect it to be invalidated.
 db_connection_timeout: 60
+# Cache dataset search results: blank for none, 'memory', or the path of a cache file.
+search_cache:
 """
 
 DATACUBE_SECTION = 'datacube'
@@ -66,6 +70,35 @@ class LocalConfig(object):
         except compat.NoOptionError:
             return None
 
+    @property
+    def index_driver(self):
+        return self._prop('index_driver') or 'postgres'
+
+    @property
+    def db_path(self):
+        """
+        Database file of the embedded (sqlite) index.
+        """
+        path = self._prop('db_path')
+        return os.path.expanduser(path) if path else None
+
+    @property
+    def search_cache(self):
+        """
+        Where to cache dataset search results: blank for no caching, 'memory', or the path of a cache file.
+        """
+        location = self._prop('search_cache')
+        if location and location != 'memory':
+            return os.path.expanduser(location)
+        return location or None
+
+    @property
+    def search_cache_size(self):
+        """
+        Maximum number of datasets held by the search cache.
+        """
+        return int(self._prop('search_cache_size') or 100000)
+
     @property
     def db_hostname(self):
         return self._prop('db_hostname')
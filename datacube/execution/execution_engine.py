@@ -22,11 +22,16 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+import os
 import sys
-import copy
 import inspect
 import logging
+import tempfile
+import threading
+from collections import OrderedDict, MutableMapping
 from pprint import pprint
+import dask
+import dask.array as da
 import numpy as np
 import numexpr as ne
 import gdal
@@ -34,16 +39,143 @@ import osr
 import xarray as xr
 from xarray import ufuncs
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+except ImportError:
+    ThreadPoolExecutor = None
+
 from datacube.api import API
 from datacube.analytics.analytics_engine import OperationType
 from datacube.analytics.utils.analytics_utils import get_pqa_mask
-from datacube.ndexpr import NDexpr
+from datacube.ndexpr import NDexpr, reduce_array
 
 
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.INFO)
 
 
+class ResultCache(MutableMapping):
+    """
+    Results of the tasks of a plan, by task name.
+
+    Results are held by reference, not copied. If `max_bytes` is given, the least recently used results are
+    spilled to disk while the arrays held in memory would take more than `max_bytes`, and loaded back when next
+    used.
+
+    Safe to use from the threads running tasks.
+    """
+
+    def __init__(self, max_bytes=None, spill_dir=None):
+        """
+        :param int max_bytes: memory to hold results in, if limited
+        :param str spill_dir: directory to spill results to. Defaults to the system temporary directory.
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        #: In memory, least recently used first
+        self._results = OrderedDict()
+        self._sizes = {}
+        self._spilled = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        if key in self._spilled:
+            filename = self._spilled.pop(key)
+            with open(filename, 'rb') as spill_file:
+                result = pickle.load(spill_file)
+            os.remove(filename)
+            LOG.debug('Loaded spilled result %s', key)
+            self[key] = result
+            return result
+
+        result = self._results.pop(key)
+        self._results[key] = result
+        return result
+
+    def __setitem__(self, key, result):
+        with self._lock:
+            if key in self:
+                del self[key]
+            self._results[key] = result
+            self._sizes[key] = _result_bytes(result)
+            self._spill(keep=key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key in self._spilled:
+                os.remove(self._spilled.pop(key))
+            else:
+                del self._results[key]
+                del self._sizes[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._results or key in self._spilled
+
+    def __iter__(self):
+        with self._lock:
+            keys = list(self._results) + list(self._spilled)
+        return iter(keys)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results) + len(self._spilled)
+
+    @property
+    def nbytes(self):
+        """Size of the arrays held in memory"""
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def _spill(self, keep):
+        if self.max_bytes is None:
+            return
+        total = self.nbytes
+        for key in list(self._results):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            handle, filename = tempfile.mkstemp(prefix='datacube-result-', suffix='.pickle', dir=self.spill_dir)
+            with os.fdopen(handle, 'wb') as spill_file:
+                pickle.dump(self._results.pop(key), spill_file, pickle.HIGHEST_PROTOCOL)
+            self._spilled[key] = filename
+            total -= self._sizes.pop(key)
+            LOG.debug('Spilled result %s to %s', key, filename)
+
+
+def _result_bytes(result):
+    return sum(getattr(array, 'nbytes', 0) for array in result.get('array_result', {}).values())
+
+
+def _map_blocks(func, arrays, dtype=None):
+    """
+    Apply an elementwise function to arrays: block by block, lazily, if any are dask arrays.
+    """
+    if any(isinstance(array, da.Array) for array in arrays):
+        return da.map_blocks(func, *[da.asarray(array) for array in arrays], dtype=dtype)
+    return func(*arrays)
+
+
+def _task_inputs(task):
+    """Names of the tasks whose results a task uses"""
+    value = next(iter(task.values()))
+    if value['operation_type'] == OperationType.Get_Data:
+        return []
+    inputs = list(value['array_input'])
+    if 'array_mask' in value:
+        inputs.append(value['array_mask'])
+    return inputs
+
+
 class ExecutionEngine(object):
 
     REDUCTION_FNS = {"all": xr.DataArray.all,
@@ -59,11 +191,24 @@ class ExecutionEngine(object):
                      "std": xr.DataArray.std,
                      "var": xr.DataArray.var}
 
-    def __init__(self, api=None, index=None):
+    def __init__(self, api=None, index=None, max_cache_bytes=None, spill_dir=None, max_workers=1, dask_chunks=None):
+        """
+        :param int max_cache_bytes: memory to hold task results in. Least recently used results are spilled
+                                    to disk beyond it.
+        :param str spill_dir: directory to spill results to, if not the system temporary directory
+        :param int max_workers: number of tasks to run at once, when they don't depend on each other.
+                                Tasks are run one at a time, in this thread, by default.
+        :param dict dask_chunks: chunk size of each dimension, to load data lazily with. Tasks then build a
+                                 dask graph, computed once at the end of the plan.
+        """
         LOG.info('Initialise Execution Module.')
-        self.cache = {}
+        self.cache = ResultCache(max_cache_bytes, spill_dir)
+        self.max_workers = max_workers
+        self.dask_chunks = dask_chunks
         self.nd = NDexpr()
         self.nd.set_ae(True)
+        # The expression parser keeps its state between calls, so only parses one at a time.
+        self._nd_lock = threading.Lock()
 
         self.api = api or API(index=index)
         self.udfuncs = {}
@@ -71,23 +216,97 @@ class ExecutionEngine(object):
     def add_function(self, name, func):
         self.udfuncs[name] = func
 
-    def execute_plan(self, plan):
-
-        for task in plan:
-            function = next(iter(task.values()))['orig_function']
-            op_type = next(iter(task.values()))['operation_type']
-
-            if op_type == OperationType.Get_Data:
-                self.execute_get_data(task)
-            elif op_type == OperationType.Expression:
-                self.execute_expression(task)
-            elif op_type == OperationType.Cloud_Mask:
-                self.execute_cloud_mask(task)
-            elif op_type == OperationType.Reduction and \
-                    len([s for s in self.REDUCTION_FNS.keys() if s in function]) > 0:
-                self.execute_reduction(task)
-            elif op_type == OperationType.Bandmath:
-                self.execute_bandmath(task)
+    def execute_plan(self, plan, keep=None):
+        """
+        Run the tasks of a plan, leaving their results in `cache`.
+
+        Tasks are run as soon as the tasks they use have, up to `max_workers` at once. If data is loaded
+        lazily (with `dask_chunks`), the results are computed together once all the tasks have run.
+
+        :param list plan: tasks, run in order once the tasks they use have run
+        :raises ValueError: if tasks of the plan use each other, so none of them can be run
+        :param list[str] keep: names of the task results to keep, besides those no other task uses.
+                               Other results are released as soon as the last task using them has run.
+                               Defaults to keeping every result.
+        """
+        tasks = OrderedDict((next(iter(task.keys())), task) for task in plan)
+        inputs = {name: _task_inputs(task) for name, task in tasks.items()}
+        uses = {}
+        waiting_for = {}
+        used_by = {name: [] for name in tasks}
+        for name in tasks:
+            waiting_for[name] = set()
+            for input_name in inputs[name]:
+                uses[input_name] = uses.get(input_name, 0) + 1
+                if input_name in tasks:
+                    waiting_for[name].add(input_name)
+                    used_by[input_name].append(name)
+
+        def finished(name):
+            for user in used_by[name]:
+                waiting_for[user].discard(name)
+            if keep is None:
+                return
+            for input_name in inputs[name]:
+                uses[input_name] -= 1
+                if uses[input_name] == 0 and input_name not in keep and input_name in self.cache:
+                    LOG.debug('Releasing result %s', input_name)
+                    del self.cache[input_name]
+
+        if ThreadPoolExecutor is None or self.max_workers <= 1:
+            while tasks:
+                ready = [name for name in tasks if not waiting_for[name]]
+                if not ready:
+                    raise ValueError('Tasks use each other: %s' % ', '.join(tasks))
+                self.execute_task(tasks.pop(ready[0]))
+                finished(ready[0])
+        else:
+            with ThreadPoolExecutor(self.max_workers) as pool:
+                running = {}
+                while tasks or running:
+                    for name in [name for name in tasks if not waiting_for[name]]:
+                        running[pool.submit(self.execute_task, tasks.pop(name))] = name
+                    if not running:
+                        raise ValueError('Tasks use each other: %s' % ', '.join(tasks))
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                        finished(running.pop(future))
+
+        self._compute_results()
+
+    def _compute_results(self):
+        """
+        Compute the lazy (dask) arrays of the results, together, so data used by several is only loaded once.
+        """
+        arrays = [(name, array_name, array)
+                  for name in self.cache
+                  for array_name, array in self.cache[name]['array_result'].items()
+                  if isinstance(getattr(array, 'data', None), da.Array)]
+        if not arrays:
+            return
+
+        computed = dask.compute(*[array for _, _, array in arrays])
+        for (name, array_name, _), array in zip(arrays, computed):
+            result = self.cache[name]
+            result['array_result'][array_name] = array
+            self.cache[name] = result
+
+    def execute_task(self, task):
+        function = next(iter(task.values()))['orig_function']
+        op_type = next(iter(task.values()))['operation_type']
+
+        if op_type == OperationType.Get_Data:
+            self.execute_get_data(task)
+        elif op_type == OperationType.Expression:
+            self.execute_expression(task)
+        elif op_type == OperationType.Cloud_Mask:
+            self.execute_cloud_mask(task)
+        elif op_type == OperationType.Reduction and \
+                len([s for s in self.REDUCTION_FNS.keys() if s in function]) > 0:
+            self.execute_reduction(task)
+        elif op_type == OperationType.Bandmath:
+            self.execute_bandmath(task)
 
     def execute_get_data(self, task):
 
@@ -107,7 +326,10 @@ class ExecutionEngine(object):
         for array in value['array_input']:
             data_request_param['variables'] += (next(iter(array.values()))['variable'],)
 
-        data_response = self.api.get_data(data_request_param)
+        if self.dask_chunks is None:
+            data_response = self.api.get_data(data_request_param)
+        else:
+            data_response = self.api.get_data(data_request_param, dask_chunks=self.dask_chunks)
 
         no_data_value = value['array_output']['no_data_value']
 
@@ -116,16 +338,17 @@ class ExecutionEngine(object):
                 data_response['arrays'][k] = data_response['arrays'][k].where(v != no_data_value)
 
         key = next(iter(task.keys()))
-        self.cache[key] = {}
-        self.cache[key]['array_result'] = copy.deepcopy(data_response['arrays'])
-        self.cache[key]['array_indices'] = copy.deepcopy(data_response['indices'])
-        self.cache[key]['array_dimensions'] = copy.deepcopy(data_response['dimensions'])
-        self.cache[key]['array_output'] = copy.deepcopy(value['array_output'])
-        self.cache[key]['crs'] = copy.deepcopy(data_response['coordinate_reference_systems'])
+        array_result = {}
+        array_result['array_result'] = data_response['arrays']
+        array_result['array_indices'] = data_response['indices']
+        array_result['array_dimensions'] = data_response['dimensions']
+        array_result['array_output'] = value['array_output']
+        array_result['crs'] = data_response['coordinate_reference_systems']
 
         del data_request_param
         del data_response
 
+        self.cache[key] = array_result
         return self.cache[key]
 
     def execute_cloud_mask(self, task):
@@ -142,19 +365,20 @@ class ExecutionEngine(object):
         data_array = next(iter(self.cache[data_key]['array_result'].values()))
         mask_array = next(iter(self.cache[mask_key]['array_result'].values()))
 
-        pqa_mask = get_pqa_mask(mask_array.values)
+        pqa_mask = get_pqa_mask(mask_array.data)
 
         masked_array = xr.DataArray.where(data_array, pqa_mask)
         #masked_array = masked_array.fillna(no_data_value)
 
-        self.cache[key] = {}
+        array_result = {}
+        array_result['array_result'] = {}
+        array_result['array_result'][key] = masked_array
+        array_result['array_indices'] = array_desc['array_indices']
+        array_result['array_dimensions'] = array_desc['array_dimensions']
+        array_result['array_output'] = value['array_output']
+        array_result['crs'] = array_desc['crs']
 
-        self.cache[key]['array_result'] = {}
-        self.cache[key]['array_result'][key] = masked_array
-        self.cache[key]['array_indices'] = copy.deepcopy(array_desc['array_indices'])
-        self.cache[key]['array_dimensions'] = copy.deepcopy(array_desc['array_dimensions'])
-        self.cache[key]['array_output'] = copy.deepcopy(value['array_output'])
-        self.cache[key]['crs'] = copy.deepcopy(array_desc['crs'])
+        self.cache[key] = array_result
 
     def execute_expression(self, task):
 
@@ -173,17 +397,18 @@ class ExecutionEngine(object):
 
         array_result = {}
         array_result['array_result'] = {}
-        array_result['array_result'][key] = self.nd.evaluate(value['function'],
-                                                             local_dict=arrays,
-                                                             user_functions=self.udfuncs)
+        with self._nd_lock:
+            array_result['array_result'][key] = self.nd.evaluate(value['function'],
+                                                                 local_dict=arrays,
+                                                                 user_functions=self.udfuncs)
         #array_result['array_result'][key] = array_result['array_result'][key].fillna(no_data_value)
 
         array_desc = self.cache[value['array_input'][0]]
 
-        array_result['array_indices'] = copy.deepcopy(array_desc['array_indices'])
-        array_result['array_dimensions'] = copy.deepcopy(array_desc['array_dimensions'])
-        array_result['array_output'] = copy.deepcopy(value['array_output'])
-        array_result['crs'] = copy.deepcopy(array_desc['crs'])
+        array_result['array_indices'] = array_desc['array_indices']
+        array_result['array_dimensions'] = array_desc['array_dimensions']
+        array_result['array_output'] = value['array_output']
+        array_result['crs'] = array_desc['crs']
 
         self.cache[key] = array_result
 
@@ -202,15 +427,18 @@ class ExecutionEngine(object):
 
         array_result = {}
         array_result['array_result'] = {}
-        array_result['array_result'][key] = xr.DataArray(ne.evaluate(value['function'], arrays))
+        names = list(arrays)
+        array_result['array_result'][key] = xr.DataArray(_map_blocks(
+            lambda *blocks: ne.evaluate(value['function'], dict(zip(names, blocks))),
+            [getattr(arrays[name], 'data', arrays[name]) for name in names]))
         #array_result['array_result'][key] = self.nd.evaluate(value['function'],  arrays)
 
         array_desc = self.cache[value['array_input'][0]]
 
-        array_result['array_indices'] = copy.deepcopy(array_desc['array_indices'])
-        array_result['array_dimensions'] = copy.deepcopy(array_desc['array_dimensions'])
-        array_result['array_output'] = copy.deepcopy(value['array_output'])
-        array_result['crs'] = copy.deepcopy(array_desc['crs'])
+        array_result['array_indices'] = array_desc['array_indices']
+        array_result['array_dimensions'] = array_desc['array_dimensions']
+        array_result['array_output'] = value['array_output']
+        array_result['crs'] = array_desc['crs']
 
         self.cache[key] = array_result
         return self.cache[key]
@@ -235,7 +463,7 @@ class ExecutionEngine(object):
 
         array_result = {}
         array_result['array_result'] = {}
-        array_result['array_output'] = copy.deepcopy(value['array_output'])
+        array_result['array_output'] = value['array_output']
 
         dims = tuple((self.cache[data_key]['array_dimensions'].index(p) for p in value['dimension']))
 
@@ -255,10 +483,10 @@ class ExecutionEngine(object):
                function_name != 'prod':
                 args['skipna'] = True
 
-        array_result['array_result'][key] = func(xr.DataArray(array_data), **args)
-        array_result['array_indices'] = copy.deepcopy(array_desc['array_indices'])
-        array_result['array_dimensions'] = copy.deepcopy(array_result['array_output']['dimensions_order'])
-        array_result['crs'] = copy.deepcopy(array_desc['crs'])
+        array_result['array_result'][key] = reduce_array(func, array_data, **args)
+        array_result['array_indices'] = array_desc['array_indices']
+        array_result['array_dimensions'] = array_result['array_output']['dimensions_order']
+        array_result['crs'] = array_desc['crs']
 
         self.cache[key] = array_result
         return self.cache[key]
@@ -14,12 +14,88 @@
 
 from __future__ import absolute_import, division
 
+import itertools
+import json
+import logging
+import multiprocessing
 import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy
 import six
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+_LOG = logging.getLogger(__name__)
+
 _REMOTE_LOG_FORMAT_STRING = '%(asctime)s {} %(process)d %(name)s %(levelname)s %(message)s'
 
 
+class _CompletionQueue(object):
+    """
+    Futures, in the order they finish.
+
+    Each future added pushes itself onto a queue when done (with a callback), so waiting for the
+    next ones to finish takes constant time, however many are pending.
+    """
+
+    def __init__(self):
+        self._done = queue.Queue()
+        self._pending = 0
+
+    def add(self, future):
+        self._pending += 1
+        future.add_done_callback(self._done.put)
+
+    def wait(self):
+        """
+        Wait for a future to finish.
+
+        :return: the futures that have finished since last called: at least one, unless none are pending
+        :rtype: list
+        """
+        if not self._pending:
+            return []
+        finished = [self._done.get()]
+        while True:
+            try:
+                finished.append(self._done.get_nowait())
+            except queue.Empty:
+                break
+        self._pending -= len(finished)
+        return finished
+
+    def __len__(self):
+        return self._pending
+
+
+class _SerialCompletionQueue(object):
+    """
+    Serial 'futures', in the order they were added. They are run when their result is asked for.
+    """
+
+    def __init__(self):
+        self._pending = deque()
+
+    def add(self, future):
+        self._pending.append(future)
+
+    def wait(self):
+        return [self._pending.popleft()] if self._pending else []
+
+    def __len__(self):
+        return len(self._pending)
+
+
 class SerialExecutor(object):
     @staticmethod
     def submit(func, *args, **kwargs):
@@ -52,6 +128,10 @@ class SerialExecutor(object):
         results.remove(result)
         return result, results
 
+    @staticmethod
+    def completion_queue():
+        return _SerialCompletionQueue()
+
     @staticmethod
     def results(futures):
         return [SerialExecutor.result(future) for future in futures]
@@ -125,6 +205,10 @@ def _get_distributed_executor(scheduler):
             results.remove(result)
             return result, results
 
+        @staticmethod
+        def completion_queue():
+            return _CompletionQueue()
+
         def results(self, futures):
             return self._executor.gather(futures)
 
@@ -143,9 +227,13 @@ def _get_distributed_executor(scheduler):
         return None
 
 
-def _get_concurrent_executor(workers):
+def _get_concurrent_executor(workers, use_threads=False):
+    """
+    :param workers: Number of processes (or threads) to run tasks in. Defaults to the number of CPUs.
+    :param bool use_threads: Run tasks in threads of this process, rather than separate processes.
+    """
     try:
-        from concurrent.futures import ProcessPoolExecutor, as_completed
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
     except ImportError:
         return None
 
@@ -187,6 +275,10 @@ def _get_concurrent_executor(workers):
             results.remove(result)
             return result, results
 
+        @staticmethod
+        def completion_queue():
+            return _CompletionQueue()
+
         @staticmethod
         def results(futures):
             return [future.result() for future in futures]
@@ -199,15 +291,24 @@ def _get_concurrent_executor(workers):
         def release(future):
             pass
 
+    if use_threads:
+        # Suited to tasks that mostly wait on I/O with the GIL released, such as GDAL reads of GeoTIFFs. The NetCDF
+        # and HDF libraries aren't thread safe: every task's use of them is serialised by
+        # datacube.storage.storage.NETCDF_LOCK, so tasks reading or writing NetCDF gain little from more threads.
+        # Tasks share this process' memory, so their arguments and results are never pickled.
+        # Index objects can be shared by the threads: each thread uses its own database connection.
+        return MultiprocessingExecutor(ThreadPoolExecutor(workers if workers > 0 else multiprocessing.cpu_count()))
+
     return MultiprocessingExecutor(ProcessPoolExecutor(workers if workers > 0 else None))
 
 
-def get_executor(scheduler, workers):
+def get_executor(scheduler, workers, use_threads=False):
     """
     Return a task executor based on input parameters. Falling back as required.
 
     :param scheduler: IP address and port of a distributed.Scheduler, or a Scheduler instance
     :param workers: Number of processes to start for process based parallel execution
+    :param bool use_threads: Start threads rather than processes for local parallel execution
     """
     if not workers:
         return SerialExecutor()
@@ -217,8 +318,247 @@ def get_executor(scheduler, workers):
         if distributed_exec:
             return distributed_exec
 
-    concurrent_exec = _get_concurrent_executor(workers)
+    concurrent_exec = _get_concurrent_executor(workers, use_threads=use_threads)
     if concurrent_exec:
         return concurrent_exec
 
     return SerialExecutor()
+
+
+class _TimedResult(object):
+    def __init__(self, task_id, result, started, finished, result_bytes):
+        self.task_id = task_id
+        self.result = result
+        self.started = started
+        self.finished = finished
+        self.result_bytes = result_bytes
+
+
+class _TimedTask(object):
+    """
+    Run a task, returning its result along with when it started and finished running (on the worker's clock),
+    and optionally its pickled size.
+
+    If the task fails, the times are attached to its exception as `task_timing`.
+    """
+    def __init__(self, func, task_id, measure_result=False):
+        self.func = func
+        self.task_id = task_id
+        self.measure_result = measure_result
+
+    def __call__(self, *args, **kwargs):
+        started = time.time()
+        try:
+            result = self.func(*args, **kwargs)
+        except Exception as err:
+            err.task_timing = self.task_id, started, time.time()
+            raise
+        finished = time.time()
+        result_bytes = _pickled_size(result) if self.measure_result else None
+        return _TimedResult(self.task_id, result, started, finished, result_bytes)
+
+
+def _pickled_size(obj):
+    try:
+        return len(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def _percentiles(values):
+    if not values:
+        return None, None
+    p50, p95 = numpy.percentile(values, [50, 95])
+    return float(p50), float(p95)
+
+
+class InstrumentedExecutor(object):
+    """
+    Wraps any of the executors, recording each task's timings and result size.
+
+    For each task it records when it was submitted, when it started and finished running, when its result was
+    collected, the size of its (pickled) result, and whether it failed. It also records how long the caller
+    spent waiting on the executor for results: the idle time of its main loop.
+
+    Measuring result sizes means pickling each result an extra time on the worker, so it's only done when
+    asked for (by default, when writing a trace file).
+
+    Records are written as JSON lines to a trace file, if given, as each task's result is collected (so the
+    trace of an interrupted run is kept).
+    Start and finish times are read from the worker's clock, so are only comparable across hosts with
+    synchronised clocks.
+    """
+
+    def __init__(self, executor, trace_file=None, measure_results=None):
+        """
+        :param executor: executor to run the tasks
+        :param str trace_file: path of a JSON lines file to write the task records to
+        :param bool measure_results: whether to record the pickled size of each result
+                                     (default: only if writing a trace file)
+        """
+        self._executor = executor
+        self._measure_results = bool(trace_file) if measure_results is None else measure_results
+        self._task_ids = itertools.count()
+        self._submitted = {}
+        self._records = []
+        self._waiting = 0.0
+        self._started = time.time()
+        self._trace = open(trace_file, 'w') if trace_file else None
+
+    def submit(self, func, *args, **kwargs):
+        task_id = next(self._task_ids)
+        self._submitted[task_id] = time.time()
+        return self._executor.submit(_TimedTask(func, task_id, self._measure_results), *args, **kwargs)
+
+    def map(self, func, iterable):
+        return [self.submit(func, data) for data in iterable]
+
+    def get_ready(self, futures):
+        with self._waiting_for_results():
+            return self._executor.get_ready(futures)
+
+    def as_completed(self, futures):
+        completed = iter(self._executor.as_completed(futures))
+        while True:
+            with self._waiting_for_results():
+                future = next(completed, None)
+            if future is None:
+                return
+            yield future
+
+    def next_completed(self, futures, default):
+        with self._waiting_for_results():
+            return self._executor.next_completed(futures, default)
+
+    def completion_queue(self):
+        return _InstrumentedCompletionQueue(self._executor.completion_queue(), self._waiting_for_results)
+
+    def results(self, futures):
+        # Each future is collected separately, so every task is recorded even if one of them failed.
+        results = []
+        exc_info = None
+        for future in futures:
+            try:
+                results.append(self.result(future))
+            except Exception:  # pylint: disable=broad-except
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+        if exc_info is not None:
+            six.reraise(*exc_info)
+        return results
+
+    def result(self, future):
+        with self._waiting_for_results():
+            try:
+                timed_result = self._executor.result(future)
+            except Exception as err:
+                self._record_failure(err)
+                raise
+        return self._record_result(timed_result)
+
+    def release(self, future):
+        self._executor.release(future)
+
+    @contextmanager
+    def _waiting_for_results(self):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._waiting += time.time() - start
+
+    def _record_result(self, timed_result):
+        self._add_record(timed_result.task_id, timed_result.started, timed_result.finished,
+                         result_bytes=timed_result.result_bytes, failed=False)
+        return timed_result.result
+
+    def _record_failure(self, err):
+        task_id, started, finished = getattr(err, 'task_timing', (None, None, None))
+        self._add_record(task_id, started, finished, result_bytes=None, failed=True, error=repr(err))
+
+    def _add_record(self, task_id, started, finished, **kwargs):
+        record = dict(task=task_id, submitted=self._submitted.pop(task_id, None), started=started,
+                      finished=finished, collected=time.time(), **kwargs)
+        self._records.append(record)
+        if self._trace:
+            self._trace.write(json.dumps(record) + '\n')
+            self._trace.flush()
+
+    def summary(self):
+        """
+        Summary of the tasks collected so far.
+
+        :return: counts of tasks, throughput in tasks per second, time spent waiting for results,
+                 and the (p50, p95) in seconds of how long tasks were queued, running, returning their result,
+                 and in total
+        :rtype: dict
+        """
+        elapsed = time.time() - self._started
+        timed = [r for r in self._records if r['started'] is not None and r['submitted'] is not None]
+        return {
+            'completed': sum(1 for r in self._records if not r['failed']),
+            'failed': sum(1 for r in self._records if r['failed']),
+            'pending': len(self._submitted),
+            'elapsed': elapsed,
+            'tasks_per_second': len(self._records) / elapsed if elapsed > 0 else None,
+            'waiting': self._waiting,
+            'result_bytes': _sum_measured(r['result_bytes'] for r in self._records),
+            'queued': _percentiles([r['started'] - r['submitted'] for r in timed]),
+            'running': _percentiles([r['finished'] - r['started'] for r in timed]),
+            'returning': _percentiles([r['collected'] - r['finished'] for r in timed]),
+            'total': _percentiles([r['collected'] - r['submitted'] for r in timed]),
+        }
+
+    def close(self):
+        """
+        Close the trace file, and log a summary of the tasks.
+
+        :return: the summary, as text
+        """
+        if self._trace:
+            self._trace.close()
+            self._trace = None
+        text = format_summary(self.summary())
+        _LOG.info('Task summary: %s', text)
+        return text
+
+
+class _InstrumentedCompletionQueue(object):
+    def __init__(self, completion_queue, waiting_for_results):
+        self._queue = completion_queue
+        self._waiting_for_results = waiting_for_results
+
+    def add(self, future):
+        self._queue.add(future)
+
+    def wait(self):
+        with self._waiting_for_results():
+            return self._queue.wait()
+
+    def __len__(self):
+        return len(self._queue)
+
+
+def _sum_measured(values):
+    measured = [value for value in values if value is not None]
+    return sum(measured) if measured else None
+
+
+def format_summary(summary):
+    """
+    Format a summary from :meth:`InstrumentedExecutor.summary` for display.
+    """
+    def seconds(percentiles):
+        if percentiles[0] is None:
+            return 'n/a'
+        return 'p50 %.3fs, p95 %.3fs' % percentiles
+
+    rate = summary['tasks_per_second']
+    result_bytes = summary['result_bytes']
+    return ('%d completed, %d failed, %d pending in %.1fs (%s tasks/s), %.1fs waiting for results, '
+            '%s result bytes. Queued: %s. Running: %s. Returning: %s. Total: %s.') % (
+                summary['completed'], summary['failed'], summary['pending'], summary['elapsed'],
+                'n/a' if rate is None else '%.2f' % rate, summary['waiting'],
+                'n/a' if result_bytes is None else '%d' % result_bytes,
+                seconds(summary['queued']), seconds(summary['running']), seconds(summary['returning']),
+                seconds(summary['total']))
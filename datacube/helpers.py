@@ -3,8 +3,15 @@ Useful functions for Datacube users
 
 Not used internally, those should go in `utils.py`
 """
+import string
+import threading
+
+import dask.array as da
 import rasterio
 import numpy as np
+import pandas
+
+from datacube.storage.storage import RESAMPLING_METHODS, align_to_chunking
 
 DEFAULT_PROFILE = {
     'blockxsize': 256,
@@ -17,34 +24,117 @@ DEFAULT_PROFILE = {
     'tiled': True}
 
 
-def write_geotiff(filename, dataset, time_index=None, profile_override=None):
+def write_geotiff(filename, dataset, time_index=None, profile_override=None, time_slices='bands',
+                  overview_levels=None, overview_resampling='nearest'):
     """
     Write an xarray dataset to a geotiff
 
-    :param filename: Output filename
+    Dask-backed bands are computed and written a window at a time, aligned to the GeoTIFF blocks, so the
+    dataset doesn't need to fit in memory. All bands and time slices are computed in a single pass.
+
+    :param filename: Output filename. When writing time slices to separate files, a format string
+        given the `time` of each slice, eg. ``'ndvi_{time:%Y%m%d}.tif'``
     :attr dataset: xarray dataset containing multiple bands to write to file
-    :attr time_index: time index to write to file
+    :attr time_index: time index to write to file. All time slices are written if not given.
+        (When writing 'files', its filename is still formatted with its `time`)
     :attr profile_override: option dict, overrides rasterio file creation options.
+    :param str time_slices: Write multiple time slices as 'bands' of the one file (the bands of each
+        time slice in turn, tagged with their `time`), or as separate 'files'.
+    :param list[int] overview_levels: decimation factors of overviews to build, if any. eg. ``[2, 4, 8, 16]``
+    :param str overview_resampling: resampling method of the overviews, eg. 'nearest' or 'average'
     """
     profile_override = profile_override or {}
 
-    dtypes = {val.dtype for val in dataset.data_vars.values()}
-    assert len(dtypes) == 1  # Check for multiple dtypes
+    if 'time' not in dataset.dims:
+        slices = [(None, dataset)]
+    elif time_index is not None:
+        slices = [(pandas.Timestamp(dataset.time.values[time_index]), dataset.isel(time=time_index))]
+    else:
+        slices = [(pandas.Timestamp(time), dataset.isel(time=i)) for i, time in enumerate(dataset.time.values)]
+
+    has_time_field = any(field == 'time' for _, field, _, _ in string.Formatter().parse(str(filename)))
+    if time_slices == 'files' and slices[0][0] is not None:
+        if not has_time_field:
+            raise ValueError('filename needs a {time} field to write time slices to separate files')
+        files = [(str(filename).format(time=time), [(time, data)]) for time, data in slices]
+    elif time_slices in ('bands', 'files'):
+        if time_slices == 'files' and has_time_field:
+            raise ValueError('dataset has no time to format the filename with')
+        files = [(str(filename), slices)]
+    else:
+        raise ValueError("time_slices must be 'bands' or 'files', not %r" % time_slices)
 
     profile = DEFAULT_PROFILE.copy()
     profile.update({
         'width': dataset.dims[dataset.crs.dimensions[1]],
         'height': dataset.dims[dataset.crs.dimensions[0]],
-        'affine': dataset.affine,
+        'transform': dataset.affine,
         'crs': dataset.crs.crs_str,
-        'count': len(dataset.data_vars),
-        'dtype': str(dtypes.pop())
+        'dtype': str(np.result_type(*[variable.dtype for variable in dataset.data_vars.values()]))
     })
     profile.update(profile_override)
 
-    with rasterio.open(str(filename), 'w', **profile) as dest:
-        for bandnum, data in enumerate(dataset.data_vars.values(), start=1):
-            dest.write(data.isel(time=time_index).data, bandnum)
+    destinations = []
+    try:
+        bands = []
+        for file_name, file_slices in files:
+            dest = rasterio.open(file_name, 'w', **dict(profile, count=len(file_slices) * len(dataset.data_vars)))
+            destinations.append(dest)
+            file_bands = [(time, name, variable) for time, data in file_slices
+                          for name, variable in data.data_vars.items()]
+            for bandnum, (time, name, variable) in enumerate(file_bands, start=1):
+                dest.update_tags(bandnum, name=name, **({'time': time.isoformat()} if time is not None else {}))
+                bands.append((dest, bandnum, variable.data))
+        _write_bands(bands, profile)
+
+        if overview_levels:
+            for dest in destinations:
+                dest.build_overviews(overview_levels, RESAMPLING_METHODS[overview_resampling])
+                dest.update_tags(ns='rio_overview', resampling=overview_resampling)
+    finally:
+        for dest in destinations:
+            dest.close()
+
+
+def _write_bands(bands, profile):
+    """
+    Write arrays to bands of open rasterio files.
+
+    Dask arrays are computed together, and written a window at a time (covering whole blocks of the file).
+
+    :param list bands: (rasterio dataset, band number, array) of each band
+    """
+    if profile.get('tiled'):
+        blockshape = (profile.get('blockysize', 256), profile.get('blockxsize', 256))
+    else:
+        blockshape = (profile.get('blockysize', 1), profile['width'])
+
+    sources, targets = [], []
+    for dest, bandnum, data in bands:
+        data = data.astype(profile['dtype'], copy=False)
+        if isinstance(data, da.Array):
+            sources.append(align_to_chunking(data, blockshape))
+            targets.append(_BandTarget(dest, bandnum))
+        else:
+            dest.write(data, bandnum)
+
+    if sources:
+        # Rasterio datasets can't be written from multiple threads at once.
+        da.store(sources, targets, lock=threading.Lock())
+
+
+class _BandTarget(object):
+    """
+    A :func:`dask.array.store` target that writes to a band of a rasterio dataset.
+    """
+    def __init__(self, dest, bandnum):
+        self._dest = dest
+        self._bandnum = bandnum
+
+    def __setitem__(self, index, block):
+        window = tuple(dim_slice.indices(size)[:2] for dim_slice, size in zip(index, (self._dest.height,
+                                                                                      self._dest.width)))
+        self._dest.write(block, self._bandnum, window=window)
 
 
 def ga_pq_fuser(dest, src):
@@ -9,18 +9,26 @@ from pathlib import Path
 
 import datacube.utils
 from datacube.config import LocalConfig
+from . import _cache
 from ._datasets import DatasetResource, ProductResource, MetadataTypeResource
 from .postgres import PostgresDb
+from .sqlite import SqliteDb
 
 _LOG = logging.getLogger(__name__)
 
+#: Index database implementations, selectable by the `index_driver` config option.
+INDEX_DRIVERS = {
+    'postgres': PostgresDb,
+    'sqlite': SqliteDb,
+}
+
 _DEFAULT_METADATA_TYPES_PATH = Path(__file__).parent.joinpath('default-metadata-types.yaml')
 
 
 def connect(local_config=None, application_name=None, validate_connection=True):
     # type: (LocalConfig, str, bool) -> Index
     """
-    Connect to the index. Default Postgres implementation.
+    Connect to the index. Default Postgres implementation, or as set by the `index_driver` config option.
 
     :param application_name: A short, alphanumeric name to identify this application.
     :param local_config: Config object to use.
@@ -32,8 +40,14 @@ def connect(local_config=None, application_name=None, validate_connection=True):
     if local_config is None:
         local_config = LocalConfig.find()
 
+    driver = INDEX_DRIVERS.get(local_config.index_driver)
+    if driver is None:
+        raise ValueError('Unknown index driver %r. Expected one of %r' % (
+            local_config.index_driver, sorted(INDEX_DRIVERS.keys())))
+
     return Index(
-        PostgresDb.from_config(local_config, application_name=application_name, validate_connection=validate_connection)
+        driver.from_config(local_config, application_name=application_name, validate_connection=validate_connection),
+        search_cache=_cache.from_config(local_config)
     )
 
 
@@ -57,14 +71,18 @@ class Index(object):
     :type products: datacube.index._datasets.DatasetTypeResource
     :type metadata_types: datacube.index._datasets.MetadataTypeResource
     """
-    def __init__(self, db):
-        # type: (PostgresDb) -> None
+    def __init__(self, db, search_cache=None):
+        # type: (PostgresDb, object) -> None
+        """
+        :param search_cache: Optional cache of dataset search results.
+            See :mod:`datacube.index._cache`.
+        """
         self._db = db
 
         self.users = UserResource(db)
         self.metadata_types = MetadataTypeResource(db)
         self.products = ProductResource(db, self.metadata_types)
-        self.datasets = DatasetResource(db, self.products)
+        self.datasets = DatasetResource(db, self.products, search_cache=search_cache)
 
     @property
     def url(self):
@@ -0,0 +1,213 @@
+# coding=utf-8
+"""
+Caches of dataset search results.
+
+Each cached search is stored with the change counters of the products it searched
+(see ``get_dataset_type_changes()`` of the index drivers). An entry is only used while those
+counters are unchanged, so a cached result never misses datasets that were since added,
+archived, restored or updated.
+
+Indexes without change counters (Postgres databases without the per-product ``dataset_change_<id>``
+sequences, added by ``datacube system init``) aren't cached.
+"""
+from __future__ import absolute_import
+
+import datetime
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from cachetools import LRUCache
+from dateutil import tz
+
+_LOG = logging.getLogger(__name__)
+
+#: Default limit on the number of datasets held by a cache, across all of its searches.
+DEFAULT_MAX_DATASETS = 100000
+
+
+def search_cache_key(query, index_url=''):
+    """
+    A stable key for the given search terms of an index.
+
+    Equivalent queries give the same key, regardless of argument order or timezone.
+
+    >>> key = search_cache_key({'product': 'ls8', 'lat': (-30, -20)})
+    >>> key == search_cache_key({'lat': [-30, -20], 'product': 'ls8'})
+    True
+    >>> search_cache_key({'product': 'ls8'}) == search_cache_key({'product': 'ls7'})
+    False
+    >>> search_cache_key({'product': 'ls8'}, 'sqlite:///a.db') == search_cache_key({'product': 'ls8'}, 'sqlite:///b.db')
+    False
+
+    :param dict query: search terms, such as :attr:`datacube.api.query.Query.search_terms`
+    :param str index_url: the index searched: a cache file may be shared by several.
+    :rtype: str
+    """
+    return hashlib.sha1(repr((str(index_url), _normalise(query))).encode('utf-8')).hexdigest()
+
+
+def _normalise(value):
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _normalise(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted((_normalise(v) for v in value), key=repr))
+    # (Including Range tuples)
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalise(v) for v in value)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(tz.tzutc()).replace(tzinfo=None)
+        return value.isoformat()
+    return value
+
+
+def _entry_size(entry):
+    changes, rows = entry
+    return max(len(rows), 1)
+
+
+class MemorySearchCache(object):
+    """
+    Search results held in memory, evicting the least-recently used.
+
+    Thread safe.
+    """
+
+    def __init__(self, max_datasets=DEFAULT_MAX_DATASETS):
+        """
+        :param int max_datasets: Maximum number of datasets held, across all cached searches.
+        """
+        self._entries = LRUCache(maxsize=max_datasets, getsizeof=_entry_size)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param str key: from :func:`search_cache_key`
+        :returns: the (product changes, results) stored for the key, or None
+        """
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, entry):
+        """
+        :param str key: from :func:`search_cache_key`
+        :param tuple entry: (product changes, results)
+        """
+        with self._lock:
+            try:
+                self._entries[key] = entry
+            except ValueError:
+                _LOG.debug('Search results too large to cache: %s datasets', _entry_size(entry))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __repr__(self):
+        return 'MemorySearchCache<max_datasets={!r}>'.format(self._entries.maxsize)
+
+
+class DiskSearchCache(object):
+    """
+    Search results stored in a local sqlite file, evicting the least-recently used.
+
+    The file can be shared by many processes, and persists between them.
+    """
+
+    def __init__(self, path, max_datasets=DEFAULT_MAX_DATASETS):
+        """
+        :param str path: cache file. Created if it doesn't exist.
+        :param int max_datasets: Maximum number of datasets held, across all cached searches.
+        """
+        self.path = path
+        self.max_datasets = max_datasets
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'path': self.path, 'max_datasets': self.max_datasets}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['max_datasets'])
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.execute('pragma journal_mode = wal')
+            connection.execute('create table if not exists search_cache ('
+                               'key text primary key, size integer not null, used real not null, entry blob not null)')
+            self._connection = connection
+        return self._connection
+
+    def get(self, key):
+        """
+        :param str key: from :func:`search_cache_key`
+        :returns: the (product changes, results) stored for the key, or None
+        """
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('select entry from search_cache where key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute('update search_cache set used = ? where key = ?', (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key, entry):
+        """
+        :param str key: from :func:`search_cache_key`
+        :param tuple entry: (product changes, results)
+        """
+        size = _entry_size(entry)
+        if size > self.max_datasets:
+            _LOG.debug('Search results too large to cache: %s datasets', size)
+            return
+
+        data = sqlite3.Binary(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            connection = self._connect()
+            connection.execute('begin immediate')
+            try:
+                connection.execute('insert or replace into search_cache (key, size, used, entry) values (?, ?, ?, ?)',
+                                   (key, size, time.time(), data))
+                # Evict the least-recently used until we're within the limit.
+                connection.execute(
+                    'delete from search_cache where key in ('
+                    '  select key from ('
+                    '    select key, sum(size) over (order by used desc, key) as total from search_cache'
+                    '  ) where total > ?'
+                    ')', (self.max_datasets,)
+                )
+                connection.execute('commit')
+            except Exception:
+                connection.execute('rollback')
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute('delete from search_cache')
+
+    def __repr__(self):
+        return 'DiskSearchCache<path={!r}, max_datasets={!r}>'.format(self.path, self.max_datasets)
+
+
+def from_config(config):
+    """
+    The search cache specified by the `search_cache` config option, if any.
+
+    :type config: datacube.config.LocalConfig
+    :rtype: MemorySearchCache or DiskSearchCache or None
+    """
+    location = config.search_cache
+    if not location:
+        return None
+    if location == 'memory':
+        return MemorySearchCache(config.search_cache_size)
+    return DiskSearchCache(location, config.search_cache_size)
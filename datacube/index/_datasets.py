@@ -4,6 +4,7 @@ API for dataset indexing, access and search.
 """
 from __future__ import absolute_import
 
+import json
 import logging
 import warnings
 from collections import namedtuple
@@ -16,8 +17,8 @@ from datacube.index.fields import Field
 from datacube.model import Dataset, DatasetType, MetadataType
 from datacube.utils import InvalidDocException, jsonify_document, changes
 from datacube.utils.changes import get_doc_changes, check_doc_unchanged
-from . import fields
-from .exceptions import DuplicateRecordError
+from . import _cache, fields
+from .exceptions import DuplicateRecordError, IndexSetupError
 
 _LOG = logging.getLogger(__name__)
 
@@ -603,13 +604,16 @@ class DatasetResource(object):
     :type types: datacube.index._datasets.ProductResource
     """
 
-    def __init__(self, db, dataset_type_resource):
+    def __init__(self, db, dataset_type_resource, search_cache=None):
         """
         :type db: datacube.index.postgres._connections.PostgresDb
         :type dataset_type_resource: datacube.index._datasets.ProductResource
+        :param search_cache: Optional cache for the results of :meth:`search_eager`.
+            (a :class:`datacube.index._cache.MemorySearchCache` or :class:`datacube.index._cache.DiskSearchCache`)
         """
         self._db = db
         self.types = dataset_type_resource
+        self.search_cache = search_cache
 
     def get(self, id_, include_sources=False):
         """
@@ -811,9 +815,12 @@ class DatasetResource(object):
         dataset.type.dataset_reader(dataset.metadata_doc).sources = {}
         try:
             product = self.types.get_by_name(dataset.type.name)
+            cell_indexes = _dataset_cells(product, dataset)
             with self._db.begin() as transaction:
                 if not transaction.update_dataset(dataset.metadata_doc, dataset.id, product.id):
                     raise ValueError("Failed to update dataset %s..." % dataset.id)
+                if cell_indexes is not None:
+                    transaction.set_dataset_cells(dataset.id, cell_indexes)
 
             self._ensure_new_locations(dataset, existing)
         finally:
@@ -1022,6 +1029,82 @@ class DatasetResource(object):
         for product, datasets in self._do_search_by_product(query):
             yield product, self._make_many(datasets)
 
+    def search_by_cell(self, cell_index, **query):
+        """
+        Perform a search, returning only datasets recorded in the given cell of their product's grid.
+
+        This is a direct lookup, rather than a spatial search, but only finds datasets of products
+        that declare a grid, and only those whose cells are recorded: see :meth:`has_all_cells`.
+
+        :param (int,int) cell_index: The cell index. E.g. (14, -40)
+        :param dict[str,str|float|datacube.model.Range] query:
+        :rtype: __generator[datacube.model.Dataset]
+        :raises IndexSetupError: if the index doesn't record cells
+        """
+        self._check_records_cells()
+        for _, datasets in self._do_search_by_product(query, cell_index=tuple(cell_index)):
+            for dataset in self._make_many(datasets):
+                yield dataset
+
+    def has_all_cells(self, product):
+        """
+        Are the grid cells of all the product's datasets recorded in the index?
+
+        They are recorded as datasets are added, but datasets indexed by older versions need
+        :meth:`add_missing_cells` (``datacube product index-cells``). Always False if the index
+        doesn't record cells (its schema predates them: see ``datacube system init``).
+
+        :param datacube.model.DatasetType product:
+        :rtype: bool
+        """
+        if _product_grid(product) is None:
+            return False
+        with self._db.connect() as connection:
+            if not connection.records_cells:
+                return False
+            return not connection.get_datasets_without_cells(product.id, limit=1)
+
+    def add_missing_cells(self, product, batch_size=1000):
+        """
+        Record the grid cells of any of the product's datasets that don't have them.
+
+        :param datacube.model.DatasetType product: a product that declares a grid
+        :param int batch_size: number of datasets to read and update at a time
+        :return: number of datasets updated
+        :rtype: int
+        :raises IndexSetupError: if the index doesn't record cells
+        """
+        grid_spec = _product_grid(product)
+        if grid_spec is None:
+            raise ValueError('Product %s has no grid' % product.name)
+        self._check_records_cells()
+
+        count = 0
+        last_id = None
+        while True:
+            with self._db.connect() as connection:
+                datasets = [self._make(result) for result in
+                            connection.get_datasets_without_cells(product.id, limit=batch_size, after_id=last_id)]
+            if not datasets:
+                return count
+            last_id = datasets[-1].id
+
+            # (Datasets without an extent have no cells, but are still recorded as done)
+            with_extent = [dataset for dataset in datasets if dataset.extent is not None]
+            cell_indexes = dict(zip((dataset.id for dataset in with_extent),
+                                    grid_spec.tile_indexes([dataset.extent for dataset in with_extent])))
+            with self._db.begin() as transaction:
+                for dataset in datasets:
+                    transaction.set_dataset_cells(dataset.id, cell_indexes.get(dataset.id, []))
+            count += len(datasets)
+            _LOG.info('Recorded cells of %s datasets of %s', count, product.name)
+
+    def _check_records_cells(self):
+        with self._db.connect() as connection:
+            if not connection.records_cells:
+                raise IndexSetupError('The index does not record dataset cells. '
+                                      'An administrator can add them with: datacube -v system init')
+
     def search_returning(self, field_names, **query):
         """
         Perform a search, returning only the specified fields.
@@ -1102,10 +1185,13 @@ class DatasetResource(object):
             product = self.types.add(dataset.type)
         if dataset.sources is None:
             raise ValueError("Dataset has missing (None) sources. Was this loaded without include_sources=True?")
+        cell_indexes = _dataset_cells(product, dataset)
 
         with self._db.begin() as transaction:
             try:
                 was_inserted = transaction.insert_dataset(dataset.metadata_doc, dataset.id, product.id)
+                if was_inserted and cell_indexes is not None:
+                    transaction.set_dataset_cells(dataset.id, cell_indexes)
 
                 for classifier, source_dataset in dataset.sources.items():
                     transaction.insert_dataset_source(classifier, dataset.id, source_dataset.id)
@@ -1137,7 +1223,7 @@ class DatasetResource(object):
             yield q, product
 
     def _do_search_by_product(self, query, return_fields=False, select_field_names=None,
-                              with_source_ids=False, source_filter=None):
+                              with_source_ids=False, source_filter=None, cell_index=None):
         if source_filter:
             product_queries = list(self._get_product_queries(source_filter))
             if not product_queries:
@@ -1172,7 +1258,8 @@ class DatasetResource(object):
                            query_exprs,
                            source_exprs,
                            select_fields=select_fields,
-                           with_source_ids=with_source_ids
+                           with_source_ids=with_source_ids,
+                           cell_index=cell_index
                        ))
 
     def _do_count_by_product(self, query):
@@ -1229,7 +1316,78 @@ class DatasetResource(object):
         """
         Perform a search, returning results as Dataset objects.
 
+        Results are cached if there is a search cache.
+
         :param dict[str,str|float|datacube.model.Range] query:
         :rtype: list[datacube.model.Dataset]
         """
-        return list(self.search(**query))
+        if self.search_cache is None:
+            return list(self.search(**query))
+        return self._cached_search(query)
+
+    def _cached_search(self, query):
+        key = _cache.search_cache_key(query, index_url=self._db.url)
+
+        query = dict(query)
+        source_filter = query.pop('source_filter', None)
+        products = [product for _, product in self._get_product_queries(query)]
+        if source_filter:
+            products.extend(product for _, product in self._get_product_queries(source_filter))
+
+        # Read the change counters before searching: if datasets are changed during our search
+        # the counters will differ from those we store, and the result won't be reused.
+        with self._db.connect() as connection:
+            product_changes = connection.get_dataset_type_changes([p.id for p in products])
+        if product_changes is None:
+            _LOG.warning('Index has no change tracking: not caching searches. '
+                         'An administrator can add it with: datacube -v system init')
+            self.search_cache = None
+            return list(self.search(source_filter=source_filter, **query))
+        product_changes = tuple(sorted(product_changes.items()))
+
+        entry = self.search_cache.get(key)
+        if entry is not None and entry[0] == product_changes:
+            return [self._make(_CachedDataset(type_ref, json.loads(metadata), uris, archived))
+                    for type_ref, metadata, uris, archived in entry[1]]
+
+        datasets = []
+        rows = []
+        for _, results in self._do_search_by_product(query, source_filter=source_filter):
+            for result in results:
+                datasets.append(self._make(result))
+                rows.append((result.dataset_type_ref, json.dumps(result.metadata), result.uris, result.archived))
+        self.search_cache.put(key, (product_changes, rows))
+        return datasets
+
+
+def _product_grid(product):
+    """
+    The product's grid of cells, if it declares one.
+
+    :type product: datacube.model.DatasetType
+    :rtype: datacube.model.GridSpec
+    """
+    grid_spec = product.grid_spec
+    if grid_spec is None or grid_spec.tile_size is None:
+        return None
+    return grid_spec
+
+
+def _dataset_cells(product, dataset):
+    """
+    The cells of the product's grid that the dataset overlaps, or None if the product has no grid.
+
+    :type product: datacube.model.DatasetType
+    :type dataset: datacube.model.Dataset
+    :rtype: list[(int,int)]
+    """
+    grid_spec = _product_grid(product)
+    if grid_spec is None:
+        return None
+    extent = dataset.extent
+    if extent is None:
+        return []
+    return grid_spec.tile_indexes([extent])[0]
+
+
+_CachedDataset = namedtuple('_CachedDataset', ('dataset_type_ref', 'metadata', 'uris', 'archived'))
@@ -12,3 +12,12 @@ class MissingRecordError(Exception):
 
 class UnknownFieldError(Exception):
     pass
+
+
+class IndexSetupError(Exception):
+    pass
+
+
+class UnsupportedOperationError(Exception):
+    """The index driver doesn't support the operation (eg. user management in an embedded database)"""
+    pass
@@ -13,7 +13,7 @@ import logging
 
 from sqlalchemy import cast
 from sqlalchemy import delete
-from sqlalchemy import select, text, bindparam, and_, or_, func, literal, distinct
+from sqlalchemy import select, text, bindparam, and_, or_, func, literal, distinct, exists
 from sqlalchemy.dialects.postgresql import INTERVAL
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.exc import IntegrityError
@@ -25,7 +25,8 @@ from datacube.model import Range
 from . import _dynamic as dynamic
 from . import tables
 from ._fields import parse_fields, NativeField, Expression, PgField
-from .tables import DATASET, DATASET_SOURCE, METADATA_TYPE, DATASET_LOCATION, DATASET_TYPE
+from .tables import DATASET, DATASET_SOURCE, METADATA_TYPE, DATASET_LOCATION, DATASET_TYPE, DATASET_CELL
+from .tables import DATASET_CELL_RECORDED
 
 try:
     from typing import Iterable
@@ -145,8 +146,18 @@ def get_dataset_fields(dataset_search_fields):
 
 
 class PostgresDbAPI(object):
-    def __init__(self, connection):
+    def __init__(self, connection, track_changes=False, record_cells=False, transaction=False):
+        """
+        :param bool track_changes: Whether to advance the change sequences of dataset types (if the schema has them)
+        :param bool record_cells: Whether to record dataset cells (if the schema has the cell tables)
+        :param bool transaction: Whether the connection is in a transaction, so changes are tracked once committed
+        """
         self._connection = connection
+        self._track_changes = track_changes
+        self._record_cells = record_cells
+        self._transaction = transaction
+        # Dataset types changed in the current transaction, whose sequences are advanced on commit.
+        self._uncommitted_changes = set()
 
     @property
     def in_transaction(self):
@@ -154,6 +165,15 @@ class PostgresDbAPI(object):
 
     def rollback(self):
         self._connection.execute(text('ROLLBACK'))
+        self._uncommitted_changes = set()
+
+    def committed(self):
+        """
+        Called after the transaction commits.
+        """
+        for dataset_type_id in self._uncommitted_changes:
+            self._advance_dataset_change(dataset_type_id)
+        self._uncommitted_changes = set()
 
     def insert_dataset(self, metadata_doc, dataset_id, dataset_type_id):
         """
@@ -183,11 +203,14 @@ class PostgresDbAPI(object):
                 dataset_type_ref=dataset_type_id,
                 metadata=metadata_doc
             )
-            return ret.rowcount > 0
         except IntegrityError as e:
             if e.orig.pgcode == PGCODE_UNIQUE_CONSTRAINT:
                 raise DuplicateRecordError('Duplicate dataset, not inserting: %s' % dataset_id)
             raise
+        if ret.rowcount > 0:
+            self._datasets_changed([dataset_type_id])
+            return True
+        return False
 
     def update_dataset(self, metadata_doc, dataset_id, dataset_type_id):
         """
@@ -206,7 +229,10 @@ class PostgresDbAPI(object):
                 metadata=metadata_doc
             )
         )
-        return res.rowcount > 0
+        if res.rowcount > 0:
+            self._datasets_changed([dataset_type_id])
+            return True
+        return False
 
     def ensure_dataset_locations(self, dataset_id, uris):
         """
@@ -229,6 +255,7 @@ class PostgresDbAPI(object):
                 if e.orig.pgcode == PGCODE_UNIQUE_CONSTRAINT:
                     raise DuplicateRecordError('Location already exists: %s' % uri)
                 raise
+            self._dataset_changed(dataset_id)
 
     def contains_dataset(self, dataset_id):
         return bool(
@@ -270,7 +297,7 @@ class PostgresDbAPI(object):
             raise
 
     def archive_dataset(self, dataset_id):
-        self._connection.execute(
+        res = self._connection.execute(
             DATASET.update().where(
                 DATASET.c.id == dataset_id
             ).where(
@@ -279,15 +306,138 @@ class PostgresDbAPI(object):
                 archived=func.now()
             )
         )
+        if res.rowcount > 0:
+            self._dataset_changed(dataset_id)
 
     def restore_dataset(self, dataset_id):
-        self._connection.execute(
+        res = self._connection.execute(
             DATASET.update().where(
                 DATASET.c.id == dataset_id
             ).values(
                 archived=None
             )
         )
+        if res.rowcount > 0:
+            self._dataset_changed(dataset_id)
+
+    def get_dataset_type_changes(self, dataset_type_ids):
+        """
+        The change counter of each dataset type: it increases after one of
+        the type's datasets is added, updated, archived, restored or has its locations changed.
+
+        :type dataset_type_ids: list[int]
+        :return: counters, or None if changes of the types aren't tracked by this database
+        :rtype: dict[int, int]
+        """
+        if not self._track_changes:
+            return None
+        dataset_type_ids = sorted(set(dataset_type_ids))
+        if not dataset_type_ids:
+            return {}
+        sequences = dict((tables.dataset_change_name(dataset_type_id), dataset_type_id)
+                         for dataset_type_id in dataset_type_ids)
+        existing = self._connection.execute(
+            text("select n.nspname || '.' || c.relname from pg_class c "
+                 "join pg_namespace n on n.oid = c.relnamespace "
+                 "where n.nspname || '.' || c.relname in :names"),
+            names=tuple(sequences)
+        ).fetchall()
+        if len(existing) < len(sequences):
+            # A type added by an older version of the datacube, without a sequence.
+            return None
+        rows = self._connection.execute(text(' union all '.join(
+            'select {id} as id, last_value, is_called from {name}'.format(id=dataset_type_id, name=name)
+            for name, dataset_type_id in sorted(sequences.items())
+        ))).fetchall()
+        return dict((dataset_type_id, last_value if is_called else 0)
+                    for dataset_type_id, last_value, is_called in rows)
+
+    def _dataset_changed(self, dataset_id):
+        if not self._track_changes:
+            return
+        self._datasets_changed(
+            [self._connection.execute(
+                select([DATASET.c.dataset_type_ref]).where(DATASET.c.id == dataset_id)
+            ).scalar()]
+        )
+
+    def _datasets_changed(self, dataset_type_ids):
+        if not self._track_changes:
+            return
+        if self._transaction:
+            # Advanced after commit: a reader must never see the new value without the change.
+            self._uncommitted_changes.update(dataset_type_ids)
+        else:
+            for dataset_type_id in set(dataset_type_ids):
+                self._advance_dataset_change(dataset_type_id)
+
+    def _advance_dataset_change(self, dataset_type_id):
+        # (A sequence: advancing it takes no row locks, and writes no tuples)
+        # Types added by older versions of the datacube have no sequence, and are skipped.
+        self._connection.execute(
+            text("select nextval(c.oid) from pg_class c join pg_namespace n on n.oid = c.relnamespace "
+                 "where n.nspname || '.' || c.relname = :name"),
+            name=tables.dataset_change_name(dataset_type_id)
+        )
+
+    @property
+    def records_cells(self):
+        """
+        Does the database record dataset cells? (The tables are optional: they're added by `system init`)
+        """
+        return self._record_cells
+
+    def set_dataset_cells(self, dataset_id, cell_indexes):
+        """
+        Record the cells of its product's grid that a dataset overlaps, replacing any recorded before.
+
+        (Ignored if the database doesn't record cells)
+
+        :type dataset_id: str or uuid.UUID
+        :type cell_indexes: list[(int,int)]
+        """
+        if not self._record_cells:
+            return
+        self._connection.execute(
+            DATASET_CELL.delete().where(DATASET_CELL.c.dataset_ref == dataset_id)
+        )
+        if cell_indexes:
+            self._connection.execute(
+                DATASET_CELL.insert(),
+                [{'dataset_ref': dataset_id, 'cell_x': x, 'cell_y': y} for x, y in cell_indexes]
+            )
+        self._connection.execute(
+            DATASET_CELL_RECORDED.delete().where(DATASET_CELL_RECORDED.c.dataset_ref == dataset_id)
+        )
+        self._connection.execute(
+            DATASET_CELL_RECORDED.insert().values(dataset_ref=dataset_id)
+        )
+
+    def get_datasets_without_cells(self, dataset_type_id, limit=None, after_id=None):
+        """
+        Datasets of the type (including archived) that haven't had their cells recorded, in id order.
+
+        :type dataset_type_id: int
+        :type limit: int
+        :param after_id: Only datasets with an id greater than this
+        """
+        where_expr = and_(
+            DATASET.c.dataset_type_ref == dataset_type_id,
+            ~exists().where(DATASET_CELL_RECORDED.c.dataset_ref == DATASET.c.id)
+        )
+        if after_id is not None:
+            where_expr = and_(where_expr, DATASET.c.id > after_id)
+        return self._connection.execute(
+            select(
+                _DATASET_SELECT_FIELDS
+            ).where(
+                where_expr
+            ).order_by(
+                DATASET.c.id
+            ).limit(
+                limit
+            )
+        ).fetchall()
 
     def get_dataset(self, dataset_id):
         return self._connection.execute(
@@ -368,8 +518,9 @@ class PostgresDbAPI(object):
         return [raw_expr(expression) for expression in expressions]
 
     @staticmethod
-    def search_datasets_query(expressions, source_exprs=None, select_fields=None, with_source_ids=False):
-        # type: (Tuple[Expression], Tuple[Expression], Iterable[PgField], bool) -> sqlalchemy.Expression
+    def search_datasets_query(expressions, source_exprs=None, select_fields=None, with_source_ids=False,
+                              cell_index=None):
+        # type: (Tuple[Expression], Tuple[Expression], Iterable[PgField], bool, tuple) -> sqlalchemy.Expression
         if select_fields:
             select_columns = tuple(
                 f.alchemy_expression.label(f.name)
@@ -395,6 +546,18 @@ class PostgresDbAPI(object):
         raw_expressions = PostgresDbAPI._alchemify_expressions(expressions)
         from_expression = PostgresDbAPI._from_expression(DATASET, expressions, select_fields)
         where_expr = and_(DATASET.c.archived == None, *raw_expressions)
+        if cell_index is not None:
+            cell_x, cell_y = cell_index
+            where_expr = and_(
+                where_expr,
+                DATASET.c.id.in_(
+                    select([
+                        DATASET_CELL.c.dataset_ref
+                    ]).where(
+                        and_(DATASET_CELL.c.cell_x == cell_x, DATASET_CELL.c.cell_y == cell_y)
+                    )
+                )
+            )
 
         if not source_exprs:
             return (
@@ -444,13 +607,16 @@ class PostgresDbAPI(object):
             )
         )
 
-    def search_datasets(self, expressions, source_exprs=None, select_fields=None, with_source_ids=False):
+    def search_datasets(self, expressions, source_exprs=None, select_fields=None, with_source_ids=False,
+                        cell_index=None):
         """
         :type with_source_ids: bool
         :type select_fields: tuple[datacube.index.postgres._fields.PgField]
         :type expressions: tuple[datacube.index.postgres._fields.PgExpression]
+        :param (int,int) cell_index: Only datasets recorded in this cell of their product's grid
         """
-        select_query = self.search_datasets_query(expressions, source_exprs, select_fields, with_source_ids)
+        select_query = self.search_datasets_query(expressions, source_exprs, select_fields, with_source_ids,
+                                                  cell_index)
         return self._connection.execute(select_query)
 
     def get_duplicates(self, match_fields, expressions):
@@ -600,6 +766,8 @@ class PostgresDbAPI(object):
         )
 
         type_id = res.inserted_primary_key[0]
+        if self._track_changes:
+            tables.ensure_dataset_change(self._connection, type_id)
 
         # Initialise search fields.
         self._setup_dataset_type_fields(type_id, name, search_fields, definition['metadata'],
@@ -622,6 +790,8 @@ class PostgresDbAPI(object):
             )
         )
         type_id = res.first()[0]
+        # Search results of the type may now differ.
+        self._datasets_changed([type_id])
 
         if update_metadata_type:
             if not self._connection.in_transaction():
@@ -665,6 +835,13 @@ class PostgresDbAPI(object):
             )
         )
         type_id = res.first()[0]
+        # Its search fields may have changed, and so the search results of its dataset types.
+        if self._track_changes:
+            self._datasets_changed(
+                [dataset_type_id for dataset_type_id, in self._connection.execute(
+                    select([DATASET_TYPE.c.id]).where(DATASET_TYPE.c.metadata_type_ref == type_id)
+                )]
+            )
 
         search_fields = get_dataset_fields(definition['dataset']['search_fields'])
         self._setup_metadata_type_fields(
@@ -793,7 +970,10 @@ class PostgresDbAPI(object):
                 )
             )
         )
-        return res.rowcount > 0
+        if res.rowcount > 0:
+            self._dataset_changed(dataset_id)
+            return True
+        return False
 
     def archive_location(self, dataset_id, uri):
         scheme, body = _split_uri(uri)
@@ -809,7 +989,10 @@ class PostgresDbAPI(object):
                 archived=func.now()
             )
         )
-        return res.rowcount > 0
+        if res.rowcount > 0:
+            self._dataset_changed(dataset_id)
+            return True
+        return False
 
     def restore_location(self, dataset_id, uri):
         scheme, body = _split_uri(uri)
@@ -825,7 +1008,10 @@ class PostgresDbAPI(object):
                 archived=None
             )
         )
-        return res.rowcount > 0
+        if res.rowcount > 0:
+            self._dataset_changed(dataset_id)
+            return True
+        return False
 
     def __repr__(self):
         return "PostgresDb<connection={!r}>".format(self._connection)
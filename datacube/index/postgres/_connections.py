@@ -21,6 +21,7 @@ from sqlalchemy.engine.url import URL as EngineUrl
 import datacube
 from datacube.compat import string_types
 from datacube.config import LocalConfig
+from datacube.index.exceptions import IndexSetupError
 from datacube.utils import jsonify_document
 from . import tables, _api
 
@@ -29,10 +30,6 @@ _LIB_ID = 'agdc-' + str(datacube.__version__)
 _LOG = logging.getLogger(__name__)
 
 
-class IndexSetupError(Exception):
-    pass
-
-
 class PostgresDb(object):
     """
     A very thin database access api.
@@ -52,6 +49,9 @@ class PostgresDb(object):
         # We don't recommend using this constructor directly as it may change.
         # Use static methods PostgresDb.create() or PostgresDb.from_config()
         self._engine = engine
+        # Whether the schema has the (optional) dataset change sequence and cell tables. Checked on first connection.
+        self._has_dataset_change = None
+        self._has_dataset_cells = None
 
     def __getstate__(self):
         _LOG.warning("Serializing PostgresDb engine %s", self.url)
@@ -174,14 +174,26 @@ class PostgresDb(object):
         is_new = tables.ensure_db(self._engine, with_permissions=with_permissions)
         if not is_new:
             tables.update_schema(self._engine)
+        self._has_dataset_change = None
+        self._has_dataset_cells = None
 
         return is_new
 
+    def _tracks_changes(self):
+        if self._has_dataset_change is None:
+            self._has_dataset_change = tables.has_dataset_change(self._engine)
+        return self._has_dataset_change
+
+    def _records_cells(self):
+        if self._has_dataset_cells is None:
+            self._has_dataset_cells = tables.has_dataset_cells(self._engine)
+        return self._has_dataset_cells
+
     def connect(self):
         """
         Borrow a connection from the pool.
         """
-        return _PostgresDbConnection(self._engine)
+        return _PostgresDbConnection(self._engine, self._tracks_changes(), self._records_cells())
 
     def begin(self):
         """
@@ -196,7 +208,7 @@ class PostgresDb(object):
 
         :rtype: _PostgresDbInTransaction
         """
-        return _PostgresDbInTransaction(self._engine)
+        return _PostgresDbInTransaction(self._engine, self._tracks_changes(), self._records_cells())
 
     def get_dataset_fields(self, search_fields_definition):
         return _api.get_dataset_fields(search_fields_definition)
@@ -206,13 +218,16 @@ class PostgresDb(object):
 
 
 class _PostgresDbConnection(object):
-    def __init__(self, engine):
+    def __init__(self, engine, track_changes=False, record_cells=False):
         self._engine = engine
+        self._track_changes = track_changes
+        self._record_cells = record_cells
         self._connection = None
 
     def __enter__(self):
         self._connection = self._engine.connect()
-        return _api.PostgresDbAPI(self._connection)
+        return _api.PostgresDbAPI(self._connection, track_changes=self._track_changes,
+                                  record_cells=self._record_cells)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._connection.close()
@@ -232,22 +247,29 @@ class _PostgresDbInTransaction(object):
     (Don't share an instance between threads)
     """
 
-    def __init__(self, engine):
+    def __init__(self, engine, track_changes=False, record_cells=False):
         self._engine = engine
+        self._track_changes = track_changes
+        self._record_cells = record_cells
         self._connection = None
+        self._api = None
 
     def __enter__(self):
         self._connection = self._engine.connect()
         self._connection.execute(text('BEGIN'))
-        return _api.PostgresDbAPI(self._connection)
+        self._api = _api.PostgresDbAPI(self._connection, track_changes=self._track_changes,
+                                       record_cells=self._record_cells, transaction=True)
+        return self._api
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_type:
             self._connection.execute(text('ROLLBACK'))
         else:
             self._connection.execute(text('COMMIT'))
+            self._api.committed()
         self._connection.close()
         self._connection = None
+        self._api = None
 
 
 def _to_json(o):
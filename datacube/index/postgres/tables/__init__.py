@@ -4,9 +4,11 @@ SQL Alchemy table definitions.
 """
 from __future__ import absolute_import
 
-from ._core import ensure_db, database_exists, schema_is_latest, update_schema
+from ._core import ensure_db, database_exists, schema_is_latest, update_schema, has_dataset_change
+from ._core import has_dataset_cells, dataset_change_name, ensure_dataset_change
 from ._core import schema_qualified, has_role, grant_role, create_user, drop_user, from_pg_role, to_pg_role
-from ._schema import DATASET, DATASET_SOURCE, DATASET_LOCATION, DATASET_TYPE, METADATA_TYPE
+from ._schema import DATASET, DATASET_SOURCE, DATASET_LOCATION, DATASET_TYPE, METADATA_TYPE, DATASET_CELL
+from ._schema import DATASET_CELL_RECORDED
 from ._sql import CreateView, FLOAT8RANGE, PGNAME
 
 
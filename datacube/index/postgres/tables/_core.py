@@ -87,12 +87,14 @@ def ensure_db(engine, with_permissions=True):
         c.execute("""
         grant usage on schema {schema} to agdc_user;
         grant select on all tables in schema {schema} to agdc_user;
+        grant select on all sequences in schema {schema} to agdc_user;
         grant execute on function {schema}.common_timestamp(text) to agdc_user;
 
         grant insert on {schema}.dataset,
                         {schema}.dataset_location,
                         {schema}.dataset_source to agdc_ingest;
         grant usage, select on all sequences in schema {schema} to agdc_ingest;
+        grant insert, delete on {schema}.dataset_cell, {schema}.dataset_cell_recorded to agdc_ingest;
 
         -- (We're only granting deletion of types that have nothing written yet: they can't delete the data itself)
         grant insert, delete on {schema}.dataset_type,
@@ -149,6 +151,53 @@ def schema_is_latest(engine):
     return has_dataset_source_update and has_uri_searches and has_dataset_location
 
 
+def dataset_change_name(dataset_type_id):
+    """
+    The change sequence of a dataset type.
+
+    >>> dataset_change_name(3)
+    'agdc.dataset_change_3'
+    """
+    return schema_qualified('dataset_change_{}'.format(dataset_type_id))
+
+
+def has_dataset_change(engine):
+    """
+    Does every dataset type have a change sequence? (They're optional: without them, search results aren't cached)
+    """
+    return not engine.execute("""
+        select 1 from {schema}.dataset_type t
+        where not exists (
+          select 1 from pg_class c join pg_namespace n on n.oid = c.relnamespace
+          where n.nspname = %s and c.relname = 'dataset_change_' || t.id
+        )
+        limit 1
+        """.format(schema=SCHEMA_NAME), SCHEMA_NAME).scalar()
+
+
+def ensure_dataset_change(conn, dataset_type_id):
+    """
+    Create the change sequence of a dataset type, if it doesn't exist.
+    """
+    name = dataset_change_name(dataset_type_id)
+    if _pg_exists(conn, name):
+        return
+    conn.execute('create sequence {}'.format(name))
+    if has_role(conn, 'agdc_user'):
+        conn.execute('grant select on {} to agdc_user'.format(name))
+    if has_role(conn, 'agdc_ingest'):
+        # Ingesters advance it as they add datasets.
+        conn.execute('grant usage on {} to agdc_ingest'.format(name))
+
+
+def has_dataset_cells(engine):
+    """
+    Are the cells of datasets recorded? (It's optional: without it, datasets can't be looked up by cell)
+    """
+    return (_pg_exists(engine, schema_qualified('dataset_cell')) and
+            _pg_exists(engine, schema_qualified('dataset_cell_recorded')))
+
+
 def update_schema(engine):
     is_unification = _pg_exists(engine, schema_qualified('dataset_type'))
     if not is_unification:
@@ -193,6 +242,49 @@ def update_schema(engine):
         """.format(schema=SCHEMA_NAME))
         _LOG.info('Completed uri-search update')
 
+    # Change sequence of each dataset type, used to invalidate cached search results.
+    if not has_dataset_change(engine):
+        _LOG.info('Applying dataset_change update')
+        for dataset_type_id, in engine.execute('select id from {schema}.dataset_type'.format(schema=SCHEMA_NAME)):
+            ensure_dataset_change(engine, dataset_type_id)
+        _LOG.info('Completed dataset_change update')
+
+    # Cells of each dataset in its product's grid.
+    if not _pg_exists(engine, schema_qualified('dataset_cell')):
+        _LOG.info('Applying dataset_cell update')
+        from ._schema import DATASET_CELL
+        DATASET_CELL.create(engine)
+        if has_role(engine, 'agdc_user'):
+            engine.execute("""
+              grant select on {schema}.dataset_cell to agdc_user
+              """.format(schema=SCHEMA_NAME))
+        if has_role(engine, 'agdc_ingest'):
+            engine.execute("""
+              grant insert, delete on {schema}.dataset_cell to agdc_ingest
+              """.format(schema=SCHEMA_NAME))
+        _LOG.info('Completed dataset_cell update')
+
+    # Which datasets have their cells recorded.
+    if not _pg_exists(engine, schema_qualified('dataset_cell_recorded')):
+        _LOG.info('Applying dataset_cell_recorded update')
+        from ._schema import DATASET_CELL_RECORDED
+        DATASET_CELL_RECORDED.create(engine)
+        # (Datasets without cells can't be told apart from those never recorded: index-cells will revisit them)
+        engine.execute("""
+          insert into {schema}.dataset_cell_recorded (dataset_ref)
+          select distinct dataset_ref from {schema}.dataset_cell
+          """.format(schema=SCHEMA_NAME))
+        if has_role(engine, 'agdc_user'):
+            engine.execute("""
+              grant select on {schema}.dataset_cell_recorded to agdc_user
+              """.format(schema=SCHEMA_NAME))
+        if has_role(engine, 'agdc_ingest'):
+            engine.execute("""
+              grant insert, delete on {schema}.dataset_cell_recorded to agdc_ingest
+              """.format(schema=SCHEMA_NAME))
+        _LOG.info('Completed dataset_cell_recorded update. '
+                  'Cells of existing datasets can be recorded with: datacube product index-cells')
+
 
 def _ensure_role(engine, name, inherits_from=None, add_user=False, create_db=False):
     if has_role(engine, name):
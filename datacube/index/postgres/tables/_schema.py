@@ -6,7 +6,7 @@ from __future__ import absolute_import
 
 import logging
 
-from sqlalchemy import ForeignKey, UniqueConstraint, PrimaryKeyConstraint, CheckConstraint, SmallInteger
+from sqlalchemy import ForeignKey, UniqueConstraint, PrimaryKeyConstraint, CheckConstraint, SmallInteger, Index
 from sqlalchemy import Table, Column, Integer, String, DateTime, Boolean
 from sqlalchemy.dialects import postgresql as postgres
 from sqlalchemy.sql import func
@@ -111,3 +111,24 @@ DATASET_SOURCE = Table(
     PrimaryKeyConstraint('dataset_ref', 'classifier'),
     UniqueConstraint('source_dataset_ref', 'dataset_ref'),
 )
+
+# The cells of its product's grid that each dataset overlaps.
+# (only for products that declare a grid: see datacube.model.DatasetType.grid_spec)
+DATASET_CELL = Table(
+    'dataset_cell', _core.METADATA,
+    Column('dataset_ref', None, ForeignKey(DATASET.c.id), nullable=False),
+
+    # Cell index (x, y) in the grid.
+    Column('cell_x', Integer, nullable=False),
+    Column('cell_y', Integer, nullable=False),
+
+    PrimaryKeyConstraint('dataset_ref', 'cell_x', 'cell_y'),
+    Index('ix_dataset_cell_cell', 'cell_x', 'cell_y'),
+)
+
+# Datasets whose cells have been recorded in dataset_cell.
+# (a dataset may overlap no cells: it has no dataset_cell rows, but is still recorded here)
+DATASET_CELL_RECORDED = Table(
+    'dataset_cell_recorded', _core.METADATA,
+    Column('dataset_ref', None, ForeignKey(DATASET.c.id), primary_key=True),
+)
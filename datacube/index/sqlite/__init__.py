@@ -0,0 +1,11 @@
+# coding=utf-8
+"""
+Embedded (serverless) index database, backed by SQLite.
+
+Provides the same interface as :mod:`datacube.index.postgres`.
+"""
+from __future__ import absolute_import
+
+from ._connections import SqliteDb
+
+__all__ = ['SqliteDb']
@@ -0,0 +1,930 @@
+# coding=utf-8
+
+# We often have one-arg-per column, so these checks aren't so useful.
+# pylint: disable=too-many-arguments,too-many-public-methods
+
+"""
+Persistence API implementation for the embedded SQLite index.
+
+Implements the same methods as :class:`datacube.index.postgres._api.PostgresDbAPI`, so it can be used
+by the index resources interchangeably.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import re
+import sqlite3
+from datetime import datetime
+from uuid import UUID
+
+from dateutil import tz
+from dateutil.relativedelta import relativedelta
+
+from datacube import compat
+from datacube.index.exceptions import DuplicateRecordError, MissingRecordError, UnsupportedOperationError
+from datacube.index.fields import OrExpression
+from datacube.model import Range
+from datacube.utils import jsonify_document
+from ._fields import parse_fields, NativeField, EXTENT_DIMENSIONS, RTREE_MIN, RTREE_MAX
+
+_LOG = logging.getLogger(__name__)
+
+_DB_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+_NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+_NO_USERS = 'User management is not supported by the SQLite index'
+
+# Columns for selecting full datasets (including their active URIs, from newest to oldest)
+_DATASET_COLUMNS = """
+    {alias}.id, {alias}.metadata_type_ref, {alias}.dataset_type_ref, {alias}.metadata,
+    {alias}.archived, {alias}.added, {alias}.added_by,
+    (
+        select json_group_array(uri) from (
+            select selected_location.uri_scheme || ':' || selected_location.uri_body as uri
+            from dataset_location selected_location
+            where selected_location.dataset_ref = {alias}.id and selected_location.archived is null
+            order by selected_location.added desc, selected_location.id desc
+        )
+    ) as uris
+"""
+
+
+def _split_uri(uri):
+    """
+    Split the scheme and the remainder of the URI.
+
+    >>> _split_uri('http://test.com/something.txt')
+    ('http', '//test.com/something.txt')
+    >>> _split_uri('file:///C:/tmp/first/something.yaml')
+    ('file', '///C:/tmp/first/something.yaml')
+    """
+    comp = uri.split(':')
+    scheme = comp[0]
+    body = ':'.join(comp[1:])
+    return scheme, body
+
+
+def _dataset_id(id_):
+    """
+    Normalise a dataset id to its stored form.
+
+    >>> _dataset_id('F2F12372-8366-11E5-817E-1040F381A756')
+    'f2f12372-8366-11e5-817e-1040f381a756'
+    """
+    if not isinstance(id_, UUID):
+        id_ = UUID(str(id_))
+    return str(id_)
+
+
+def _to_json(o):
+    return json.dumps(jsonify_document(o))
+
+
+def _from_json(value):
+    return None if value is None else json.loads(value)
+
+
+def _parse_db_time(value):
+    """
+    >>> _parse_db_time('2017-05-02 01:02:03.456')
+    datetime.datetime(2017, 5, 2, 1, 2, 3, 456000, tzinfo=tzutc())
+    """
+    if value is None:
+        return None
+    return datetime.strptime(value, _DB_TIME_FORMAT).replace(tzinfo=tz.tzutc())
+
+
+def _uuid_list(value):
+    return [UUID(id_) for id_ in json.loads(value)] if value else []
+
+
+def _uri_list(value):
+    return json.loads(value) if value else []
+
+
+_TYPE_CONVERTERS = {
+    'definition': _from_json,
+    'metadata': _from_json,
+    'added': _parse_db_time,
+}
+
+_DATASET_CONVERTERS = {
+    'id': UUID,
+    'metadata': _from_json,
+    'archived': _parse_db_time,
+    'added': _parse_db_time,
+    'uris': _uri_list,
+}
+
+
+class _Row(tuple):
+    """
+    A result row. Columns can be read by position, by name (`row['id']`) or as attributes (`row.id`).
+    """
+
+    def __new__(cls, index, values):
+        row = super(_Row, cls).__new__(cls, values)
+        row._index = index
+        return row
+
+    def __getitem__(self, item):
+        if isinstance(item, compat.string_types):
+            item = self._index[item]
+        return tuple.__getitem__(self, item)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def keys(self):
+        return sorted(self._index, key=self._index.get)
+
+
+def _read_rows(cursor, converters=None):
+    """
+    Convert cursor rows to :class:`_Row`s, applying any per-column converters.
+
+    :type converters: dict[str, callable] or list[callable]
+    """
+    names = [d[0] for d in cursor.description]
+    index = {name: i for i, name in enumerate(names)}
+    if converters is None or isinstance(converters, dict):
+        converters = [(converters or {}).get(name) for name in names]
+
+    for values in cursor:
+        yield _Row(index, [value if convert is None or value is None else convert(value)
+                           for convert, value in zip(converters, values)])
+
+
+def _first(rows):
+    return next(iter(rows), None)
+
+
+def _contains(doc, sub):
+    """
+    Does the document contain the given sub-document? (following postgres' jsonb @> semantics)
+
+    >>> _contains({'a': {'b': 1, 'c': 2}}, {'a': {'b': 1}})
+    True
+    >>> _contains({'a': [1, 2, 3]}, {'a': [3, 1]})
+    True
+    >>> _contains({'a': {'b': 1}}, {'a': {'b': 2}})
+    False
+    """
+    if isinstance(sub, dict):
+        return isinstance(doc, dict) and all(k in doc and _contains(doc[k], v) for k, v in sub.items())
+    if isinstance(sub, list):
+        return isinstance(doc, list) and all(any(_contains(d, s) for d in doc) for s in sub)
+    return doc == sub
+
+
+_PERIOD_UNITS = ('second', 'minute', 'hour', 'day', 'week', 'month', 'year')
+
+
+def _parse_period(period):
+    """
+    Parse a postgres-style interval string.
+
+    >>> _parse_period('1 month')
+    relativedelta(months=+1)
+    >>> _parse_period('2 days')
+    relativedelta(days=+2)
+    """
+    match = re.match(r'^\s*(\d+)\s*([a-z]+?)s?\s*$', period.lower())
+    if not match or match.group(2) not in _PERIOD_UNITS:
+        raise ValueError('Unsupported time period: %r' % period)
+    return relativedelta(**{match.group(2) + 's': int(match.group(1))})
+
+
+def _time_periods(start, end, period):
+    """
+    Consecutive time ranges of the given period, between start and end.
+    (The same ranges as postgres' generate_series(start, end, period))
+
+    >>> list(_time_periods(datetime(2017, 1, 1), datetime(2017, 3, 1), '1 month'))  # doctest: +NORMALIZE_WHITESPACE
+    [(datetime.datetime(2017, 1, 1, 0, 0), datetime.datetime(2017, 2, 1, 0, 0)),
+     (datetime.datetime(2017, 2, 1, 0, 0), datetime.datetime(2017, 3, 1, 0, 0))]
+    """
+    step = _parse_period(period)
+    i = 0
+    period_start = start
+    while True:
+        period_end = start + step * (i + 1)
+        if period_end > end:
+            return
+        yield period_start, period_end
+        i += 1
+        period_start = period_end
+
+
+def get_native_fields():
+    # Native fields (hard-coded into the schema)
+    fields = {
+        'id': NativeField(
+            'id',
+            None,
+            'id',
+            from_sql=UUID
+        ),
+        'product': NativeField(
+            'product',
+            'Dataset type name',
+            'dataset_type_ref',
+            sql_expression='(select name from dataset_type where id = {alias}.dataset_type_ref)'
+        ),
+        'dataset_type_id': NativeField(
+            'dataset_type_id',
+            'ID of a dataset type',
+            'dataset_type_ref'
+        ),
+        'metadata_type': NativeField(
+            'metadata_type',
+            'Metadata type of dataset',
+            'metadata_type_ref',
+            sql_expression='(select name from metadata_type where id = {alias}.metadata_type_ref)'
+        ),
+        'metadata_type_id': NativeField(
+            'metadata_type_id',
+            'ID of a metadata type',
+            'metadata_type_ref'
+        ),
+        'metadata_doc': NativeField(
+            'metadata_doc',
+            'Full metadata document',
+            'metadata',
+            from_sql=json.loads
+        ),
+        # Fields that can affect row selection
+
+        # Note that this field is a single uri: selecting it will result in one-result per uri.
+        # (ie. duplicate datasets if multiple uris, no dataset if no uris)
+        'uri': NativeField(
+            'uri',
+            "Dataset URI",
+            'uri_body',
+            sql_expression="{alias}_location.uri_scheme || ':' || {alias}_location.uri_body",
+            affects_row_selection=True,
+            requires_location=True
+        ),
+    }
+    return fields
+
+
+def get_dataset_fields(dataset_search_fields):
+    fields = get_native_fields()
+
+    # noinspection PyTypeChecker
+    fields.update(
+        parse_fields(
+            dataset_search_fields,
+            'metadata'
+        )
+    )
+    return fields
+
+
+def _flatten(expressions):
+    for expression in expressions:
+        if isinstance(expression, OrExpression):
+            for expr in _flatten(expression.exprs):
+                yield expr
+        else:
+            yield expression
+
+
+def _expression_sql(expression, alias):
+    # type: (Expression, str) -> (str, list)
+    if isinstance(expression, OrExpression):
+        parts = [_expression_sql(expr, alias) for expr in expression.exprs]
+        return '(%s)' % ' OR '.join(sql for sql, _ in parts), [p for _, params in parts for p in params]
+    sql, params = expression.sql(alias)
+    return '(%s)' % sql, params
+
+
+def _extent_sql(expressions, alias):
+    """
+    An R-tree condition narrowing the candidate datasets for the given expressions, if any can use it.
+
+    The R-tree stores 32-bit floats rounded outwards, so it's only a pre-filter: the exact
+    expression conditions are still applied.
+    """
+    bounds = {}
+    for expression in expressions:
+        # Only top-level (ANDed) expressions can narrow the search.
+        if isinstance(expression, OrExpression):
+            continue
+        extent = expression.extent_bounds()
+        if extent is None:
+            continue
+        dimension, low, high = extent
+        old_low, old_high = bounds.get(dimension, (RTREE_MIN, RTREE_MAX))
+        bounds[dimension] = max(low, old_low), min(high, old_high)
+
+    if not bounds:
+        return None, []
+
+    clauses, params = [], []
+    for dimension, (low, high) in sorted(bounds.items()):
+        clauses.append('max_{0} >= ? and min_{0} <= ?'.format(dimension))
+        params.extend((low, high))
+    return '{alias}.rid in (select id from dataset_extent where {clauses})'.format(
+        alias=alias, clauses=' and '.join(clauses)
+    ), params
+
+
+def _where_sql(expressions, alias):
+    clauses = ['{}.archived is null'.format(alias)]
+    params = []
+
+    extent_clause, extent_params = _extent_sql(expressions, alias)
+    if extent_clause:
+        clauses.append(extent_clause)
+        params.extend(extent_params)
+
+    for expression in expressions:
+        sql, expression_params = _expression_sql(expression, alias)
+        clauses.append(sql)
+        params.extend(expression_params)
+    return ' and '.join(clauses), params
+
+
+def _from_sql(alias, expressions=None, fields=None):
+    needs_location = any(expression.field.requires_location for expression in _flatten(expressions or ())) or \
+        any(field.requires_location for field in fields or ())
+
+    from_sql = 'dataset {}'.format(alias)
+    if needs_location:
+        from_sql += ' join dataset_location {alias}_location on {alias}_location.dataset_ref = {alias}.id'.format(
+            alias=alias
+        )
+    return from_sql
+
+
+class SqliteDbAPI(object):
+    def __init__(self, connection, username, product_fields, state, record_cells=False):
+        """
+        :type connection: sqlite3.Connection
+        :param str username: recorded as 'added_by' for new records
+        :param dict product_fields: (shared) cache of search fields for each product id
+        :param state: (thread local) state of the connection, holding whether it's `in_transaction`
+        :param bool record_cells: Whether to record dataset cells (if the schema has the cell tables)
+        """
+        self.connection = connection
+        self._username = username
+        self._product_fields = product_fields
+        self._record_cells = record_cells
+        # Tracked ourselves: sqlite3.Connection.in_transaction is Python 3 only.
+        self._state = state
+
+    @property
+    def in_transaction(self):
+        return self._state.in_transaction
+
+    def begin(self):
+        self.connection.execute('BEGIN')
+        self._state.in_transaction = True
+
+    def commit(self):
+        self._state.in_transaction = False
+        self.connection.execute('COMMIT')
+
+    def rollback(self):
+        self._state.in_transaction = False
+        self.connection.execute('ROLLBACK')
+
+    def _execute(self, sql, params=()):
+        return self.connection.execute(sql, params)
+
+    def _product_search_fields(self, dataset_type_id):
+        fields = self._product_fields.get(dataset_type_id)
+        if fields is None:
+            row = self._execute(
+                'select mt.definition from dataset_type dt '
+                'join metadata_type mt on mt.id = dt.metadata_type_ref '
+                'where dt.id = ?', (dataset_type_id,)
+            ).fetchone()
+            fields = get_dataset_fields(json.loads(row[0])['dataset']['search_fields']) if row else {}
+            self._product_fields[dataset_type_id] = fields
+        return fields
+
+    def _index_extent(self, rid, metadata_doc, dataset_type_id):
+        """
+        Record the spatial/temporal extent of a dataset in the R-tree.
+        """
+        fields = self._product_search_fields(dataset_type_id)
+        values = {}
+        for name, dimension in EXTENT_DIMENSIONS:
+            field = fields.get(name)
+            if field is None or not hasattr(field, 'extent_value'):
+                continue
+            try:
+                value = field.extent_value(metadata_doc)
+            except (AttributeError, KeyError, ValueError):
+                value = None
+            if value is not None:
+                values[dimension] = value
+
+        self._execute('delete from dataset_extent where id = ?', (rid,))
+        if not values:
+            return
+
+        params = [rid]
+        for _, dimension in EXTENT_DIMENSIONS:
+            params.extend(values.get(dimension, (RTREE_MIN, RTREE_MAX)))
+        self._execute('insert into dataset_extent values (?, ?, ?, ?, ?, ?, ?)', params)
+
+    def _rebuild_extents(self, dataset_type_id=None):
+        if dataset_type_id is None:
+            self._product_fields.clear()
+            rows = self._execute('select rid, metadata, dataset_type_ref from dataset').fetchall()
+        else:
+            self._product_fields.pop(dataset_type_id, None)
+            rows = self._execute('select rid, metadata, dataset_type_ref from dataset where dataset_type_ref = ?',
+                                 (dataset_type_id,)).fetchall()
+        for rid, metadata, type_id in rows:
+            self._index_extent(rid, json.loads(metadata), type_id)
+
+    def insert_dataset(self, metadata_doc, dataset_id, dataset_type_id):
+        """
+        Insert dataset if not already indexed.
+        :type metadata_doc: dict
+        :type dataset_id: str or uuid.UUID
+        :type dataset_type_id: int
+        :return: whether it was inserted
+        :rtype: bool
+        """
+        try:
+            res = self._execute(
+                'insert into dataset (id, dataset_type_ref, metadata_type_ref, metadata, added_by) '
+                'select ?, id, metadata_type_ref, ?, ? from dataset_type where id = ?',
+                (_dataset_id(dataset_id), _to_json(metadata_doc), self._username, dataset_type_id)
+            )
+        except sqlite3.IntegrityError as e:
+            if 'UNIQUE' in str(e):
+                raise DuplicateRecordError('Duplicate dataset, not inserting: %s' % dataset_id)
+            raise
+        if res.rowcount > 0:
+            self._index_extent(res.lastrowid, metadata_doc, dataset_type_id)
+            self._increment_dataset_changes('id = ?', (dataset_type_id,))
+            return True
+        return False
+
+    def update_dataset(self, metadata_doc, dataset_id, dataset_type_id):
+        """
+        Update dataset
+        :type metadata_doc: dict
+        :type dataset_id: str or uuid.UUID
+        :type dataset_type_id: int
+        """
+        dataset_id = _dataset_id(dataset_id)
+        res = self._execute(
+            'update dataset set metadata = ? where id = ? and dataset_type_ref = ?',
+            (_to_json(metadata_doc), dataset_id, dataset_type_id)
+        )
+        if res.rowcount > 0:
+            rid = self._execute('select rid from dataset where id = ?', (dataset_id,)).fetchone()[0]
+            self._index_extent(rid, metadata_doc, dataset_type_id)
+            self._increment_dataset_changes('id = ?', (dataset_type_id,))
+            return True
+        return False
+
+    def ensure_dataset_locations(self, dataset_id, uris):
+        """
+        Add a location to a dataset if it is not already recorded.
+        :type dataset_id: str or uuid.UUID
+        :type uris: list[str]
+        """
+        for uri in uris:
+            scheme, body = _split_uri(uri)
+            try:
+                self._execute(
+                    'insert into dataset_location (dataset_ref, uri_scheme, uri_body, added_by) values (?, ?, ?, ?)',
+                    (_dataset_id(dataset_id), scheme, body, self._username)
+                )
+            except sqlite3.IntegrityError as e:
+                if 'UNIQUE' in str(e):
+                    raise DuplicateRecordError('Location already exists: %s' % uri)
+                raise
+            self._dataset_changed(dataset_id)
+
+    def contains_dataset(self, dataset_id):
+        return self._execute('select 1 from dataset where id = ?', (_dataset_id(dataset_id),)).fetchone() is not None
+
+    def _select_datasets(self, where, params=(), from_='dataset d', extra_columns='', converters=None):
+        all_converters = dict(_DATASET_CONVERTERS)
+        all_converters.update(converters or {})
+        return _read_rows(self._execute(
+            'select {columns}{extra} from {from_} where {where}'.format(
+                columns=_DATASET_COLUMNS.format(alias='d'), extra=extra_columns, from_=from_, where=where
+            ),
+            params
+        ), all_converters)
+
+    def get_datasets_for_location(self, uri):
+        scheme, body = _split_uri(uri)
+        return list(self._select_datasets(
+            'l.uri_scheme = ? and l.uri_body = ?', (scheme, body),
+            from_='dataset_location l join dataset d on d.id = l.dataset_ref'
+        ))
+
+    def insert_dataset_source(self, classifier, dataset_id, source_dataset_id):
+        try:
+            self._execute(
+                'insert into dataset_source (classifier, dataset_ref, source_dataset_ref) values (?, ?, ?)',
+                (classifier, _dataset_id(dataset_id), _dataset_id(source_dataset_id))
+            )
+        except sqlite3.IntegrityError as e:
+            if 'UNIQUE' in str(e):
+                raise DuplicateRecordError('Source already exists')
+            if 'FOREIGN KEY' in str(e):
+                raise MissingRecordError("Referenced source dataset doesn't exist")
+            raise
+
+    def archive_dataset(self, dataset_id):
+        res = self._execute(
+            'update dataset set archived = {now} where id = ? and archived is null'.format(now=_NOW_SQL),
+            (_dataset_id(dataset_id),)
+        )
+        if res.rowcount > 0:
+            self._dataset_changed(dataset_id)
+
+    def restore_dataset(self, dataset_id):
+        res = self._execute('update dataset set archived = null where id = ?', (_dataset_id(dataset_id),))
+        if res.rowcount > 0:
+            self._dataset_changed(dataset_id)
+
+    def get_dataset_type_changes(self, dataset_type_ids):
+        """
+        The change counter of each dataset type: it increases whenever one of
+        the type's datasets is added, updated, archived, restored or has its locations changed.
+
+        :type dataset_type_ids: list[int]
+        :rtype: dict[int, int]
+        """
+        dataset_type_ids = list(dataset_type_ids)
+        if not dataset_type_ids:
+            return {}
+        return dict(self._execute(
+            'select id, dataset_changes from dataset_type where id in ({})'.format(
+                ', '.join('?' * len(dataset_type_ids))
+            ),
+            dataset_type_ids
+        ).fetchall())
+
+    def _dataset_changed(self, dataset_id):
+        self._increment_dataset_changes('id = (select dataset_type_ref from dataset where id = ?)',
+                                        (_dataset_id(dataset_id),))
+
+    def _increment_dataset_changes(self, where, params):
+        self._execute('update dataset_type set dataset_changes = dataset_changes + 1 where ' + where, params)
+
+    @property
+    def records_cells(self):
+        """
+        Does the database record dataset cells? (The tables are optional: they're added by `system init`)
+        """
+        return self._record_cells
+
+    def set_dataset_cells(self, dataset_id, cell_indexes):
+        """
+        Record the cells of its product's grid that a dataset overlaps, replacing any recorded before.
+
+        (Ignored if the database doesn't record cells)
+
+        :type dataset_id: str or uuid.UUID
+        :type cell_indexes: list[(int,int)]
+        """
+        if not self._record_cells:
+            return
+        dataset_id = _dataset_id(dataset_id)
+        self._execute('delete from dataset_cell where dataset_ref = ?', (dataset_id,))
+        self.connection.executemany(
+            'insert into dataset_cell (dataset_ref, cell_x, cell_y) values (?, ?, ?)',
+            [(dataset_id, int(x), int(y)) for x, y in cell_indexes]
+        )
+        self._execute('insert or ignore into dataset_cell_recorded (dataset_ref) values (?)', (dataset_id,))
+
+    def get_datasets_without_cells(self, dataset_type_id, limit=None, after_id=None):
+        """
+        Datasets of the type (including archived) that haven't had their cells recorded, in id order.
+
+        :type dataset_type_id: int
+        :type limit: int
+        :param after_id: Only datasets with an id greater than this
+        """
+        return list(self._select_datasets(
+            'd.dataset_type_ref = ? and d.id > ? '
+            'and not exists (select 1 from dataset_cell_recorded c where c.dataset_ref = d.id) '
+            'order by d.id limit ?',
+            (dataset_type_id, '' if after_id is None else _dataset_id(after_id), -1 if limit is None else limit)
+        ))
+
+    def get_dataset(self, dataset_id):
+        return _first(self._select_datasets('d.id = ?', (_dataset_id(dataset_id),)))
+
+    def get_derived_datasets(self, dataset_id):
+        return list(self._select_datasets(
+            's.source_dataset_ref = ?', (_dataset_id(dataset_id),),
+            from_='dataset d join dataset_source s on s.dataset_ref = d.id'
+        ))
+
+    def get_dataset_sources(self, dataset_id):
+        """
+        The dataset and all of its (recursive) sources, each with lists of its direct
+        'sources' ids and their 'classes' (classifiers).
+        """
+        lineage = (
+            'd.id in ('
+            '  with recursive sources(dataset_ref) as ('
+            '    select ?'
+            '    union'
+            '    select s.source_dataset_ref from dataset_source s join sources on s.dataset_ref = sources.dataset_ref'
+            '  )'
+            '  select dataset_ref from sources'
+            ')'
+        )
+        links = (
+            ', (select json_group_array(json_array(s.source_dataset_ref, s.classifier)) '
+            '   from dataset_source s where s.dataset_ref = d.id) as links'
+        )
+        for row in self._select_datasets(lineage, (_dataset_id(dataset_id),), extra_columns=links,
+                                         converters={'links': json.loads}):
+            row_links = row['links']
+            yield _Row(
+                dict(row._index, sources=len(row), classes=len(row) + 1),  # pylint: disable=protected-access
+                tuple(row) + ([UUID(source) for source, _ in row_links], [classifier for _, classifier in row_links])
+            )
+
+    def search_datasets_by_metadata(self, metadata):
+        """
+        Find any datasets that have the given metadata.
+
+        Checked in python against each document: slow.
+
+        :type metadata: dict
+        :rtype: dict
+        """
+        metadata = json.loads(_to_json(metadata))
+        return [row for row in self._select_datasets('1') if _contains(row.metadata, metadata)]
+
+    def search_datasets(self, expressions, source_exprs=None, select_fields=None, with_source_ids=False,
+                        cell_index=None):
+        """
+        :type with_source_ids: bool
+        :type select_fields: tuple[datacube.index.sqlite._fields.SqliteField]
+        :type expressions: tuple[datacube.index.sqlite._fields.SqliteExpression]
+        :param (int,int) cell_index: Only datasets recorded in this cell of their product's grid
+        """
+        alias = 'd'
+        if select_fields:
+            columns = ', '.join('{} as "{}"'.format(f.sql(alias), f.name) for f in select_fields)
+            converters = [f.from_sql_value for f in select_fields]
+        else:
+            columns = _DATASET_COLUMNS.format(alias=alias)
+            converters = _DATASET_CONVERTERS
+
+        if with_source_ids:
+            # Include the IDs of source datasets
+            columns += (', (select json_group_array(s.source_dataset_ref) from dataset_source s '
+                        'where s.dataset_ref = {}.id) as dataset_refs'.format(alias))
+            if isinstance(converters, dict):
+                converters = dict(converters, dataset_refs=lambda v: _uuid_list(v) or None)
+            else:
+                converters = converters + [lambda v: _uuid_list(v) or None]
+
+        where, params = _where_sql(expressions, alias)
+
+        if cell_index is not None:
+            where += (' and {alias}.id in ('
+                      '  select c.dataset_ref from dataset_cell c where c.cell_x = ? and c.cell_y = ?'
+                      ')').format(alias=alias)
+            params += [int(cell_index[0]), int(cell_index[1])]
+
+        if source_exprs:
+            source_where, source_params = _where_sql(source_exprs, 'src')
+            where += (
+                ' and {alias}.id in ('
+                '  with recursive derived(id) as ('
+                '    select s.dataset_ref from dataset_source s'
+                '    where s.source_dataset_ref in (select src.id from {source_from} where {source_where})'
+                '    union'
+                '    select s.dataset_ref from dataset_source s join derived on s.source_dataset_ref = derived.id'
+                '  )'
+                '  select id from derived'
+                ')'
+            ).format(alias=alias, source_from=_from_sql('src', source_exprs), source_where=source_where)
+            params += source_params
+
+        return _read_rows(self._execute(
+            'select {columns} from {from_} where {where}'.format(
+                columns=columns, from_=_from_sql(alias, expressions, select_fields), where=where
+            ),
+            params
+        ), converters)
+
+    def get_duplicates(self, match_fields, expressions):
+        alias = 'd'
+        group_columns = ', '.join(f.sql(alias) for f in match_fields)
+        where, params = _where_sql(expressions, alias)
+        rows = self._execute(
+            'select json_group_array({alias}.id), {group} from {from_} where {where} '
+            'group by {group} having count({alias}.id) > 1'.format(
+                alias=alias, group=group_columns, from_=_from_sql(alias, expressions, match_fields), where=where
+            ),
+            params
+        )
+        return _read_rows(rows, [_uuid_list] + [f.from_sql_value for f in match_fields])
+
+    def count_datasets(self, expressions):
+        """
+        :type expressions: tuple[datacube.index.sqlite._fields.SqliteExpression]
+        :rtype: int
+        """
+        where, params = _where_sql(expressions, 'd')
+        return self._execute(
+            'select count(*) from {from_} where {where}'.format(from_=_from_sql('d', expressions), where=where),
+            params
+        ).fetchone()[0]
+
+    def count_datasets_through_time(self, start, end, period, time_field, expressions):
+        """
+        :type period: str
+        :type start: datetime.datetime
+        :type end: datetime.datetime
+        :type expressions: tuple[datacube.index.sqlite._fields.SqliteExpression]
+        :rtype: list[((datetime.datetime, datetime.datetime), int)]
+        """
+        for period_start, period_end in _time_periods(start, end, period):
+            count = self.count_datasets(tuple(expressions) + (time_field.between(period_start, period_end),))
+            yield Range(period_start, period_end), count
+
+    def _select_type(self, table, where, params):
+        return _read_rows(self._execute('select * from {} where {}'.format(table, where), params),
+                          _TYPE_CONVERTERS)
+
+    def get_dataset_type(self, id_):
+        return _first(self._select_type('dataset_type', 'id = ?', (id_,)))
+
+    def get_metadata_type(self, id_):
+        return _first(self._select_type('metadata_type', 'id = ?', (id_,)))
+
+    def get_dataset_type_by_name(self, name):
+        return _first(self._select_type('dataset_type', 'name = ?', (name,)))
+
+    def get_metadata_type_by_name(self, name):
+        return _first(self._select_type('metadata_type', 'name = ?', (name,)))
+
+    def add_dataset_type(self,
+                         name,
+                         metadata,
+                         metadata_type_id,
+                         search_fields,
+                         definition, concurrently=True):
+        res = self._execute(
+            'insert into dataset_type (name, metadata, metadata_type_ref, definition, added_by) '
+            'values (?, ?, ?, ?, ?)',
+            (name, _to_json(metadata), metadata_type_id, _to_json(definition), self._username)
+        )
+        return res.lastrowid
+
+    def update_dataset_type(self,
+                            name,
+                            metadata,
+                            metadata_type_id,
+                            search_fields,
+                            definition, update_metadata_type=False, concurrently=False):
+        self._execute(
+            'update dataset_type set metadata = ?, metadata_type_ref = ?, definition = ?, '
+            'dataset_changes = dataset_changes + 1 where name = ?',
+            (_to_json(metadata), metadata_type_id, _to_json(definition), name)
+        )
+        type_id = self._execute('select id from dataset_type where name = ?', (name,)).fetchone()[0]
+
+        if update_metadata_type:
+            if not self.in_transaction:
+                raise RuntimeError('Must update metadata types in transaction')
+
+            self._execute('update dataset set metadata_type_ref = ? where dataset_type_ref = ?',
+                          (metadata_type_id, type_id))
+            self._rebuild_extents(type_id)
+
+        self._product_fields.pop(type_id, None)
+        return type_id
+
+    def add_metadata_type(self, name, definition, concurrently=False):
+        self._execute(
+            'insert into metadata_type (name, definition, added_by) values (?, ?, ?)',
+            (name, _to_json(definition), self._username)
+        )
+
+    def update_metadata_type(self, name, definition, concurrently=False):
+        self._execute('update metadata_type set definition = ? where name = ?', (_to_json(definition), name))
+        type_id = self._execute('select id from metadata_type where name = ?', (name,)).fetchone()[0]
+        # Its search fields may have changed, and so the search results of its dataset types.
+        self._increment_dataset_changes('metadata_type_ref = ?', (type_id,))
+
+        # Search fields may have been added: datasets' extents may change.
+        for (dataset_type_id,) in self._execute('select id from dataset_type where metadata_type_ref = ?',
+                                                (type_id,)).fetchall():
+            self._rebuild_extents(dataset_type_id)
+
+        return type_id
+
+    def check_dynamic_fields(self, concurrently=False, rebuild_views=False, rebuild_indexes=False):
+        # There are no per-field views or indexes: only the extent R-tree needs maintenance.
+        if rebuild_indexes:
+            _LOG.info('Rebuilding dataset extent index.')
+            self._rebuild_extents()
+
+    def get_all_dataset_types(self):
+        return list(self._select_type('dataset_type', '1 order by name asc', ()))
+
+    def get_all_metadata_types(self):
+        return list(self._select_type('metadata_type', '1 order by name asc', ()))
+
+    def _select_locations(self, dataset_id, archived):
+        return [
+            record[0]
+            for record in self._execute(
+                "select uri_scheme || ':' || uri_body from dataset_location "
+                "where dataset_ref = ? and archived is {} null "
+                "order by added desc, id desc".format('not' if archived else ''),
+                (_dataset_id(dataset_id),)
+            ).fetchall()
+        ]
+
+    def get_locations(self, dataset_id):
+        return self._select_locations(dataset_id, archived=False)
+
+    def get_archived_locations(self, dataset_id):
+        return self._select_locations(dataset_id, archived=True)
+
+    def remove_location(self, dataset_id, uri):
+        """
+        Remove the given location for a dataset
+
+        :returns bool: Was the location deleted?
+        """
+        scheme, body = _split_uri(uri)
+        res = self._execute(
+            'delete from dataset_location where dataset_ref = ? and uri_scheme = ? and uri_body = ?',
+            (_dataset_id(dataset_id), scheme, body)
+        )
+        if res.rowcount > 0:
+            self._dataset_changed(dataset_id)
+            return True
+        return False
+
+    def archive_location(self, dataset_id, uri):
+        scheme, body = _split_uri(uri)
+        res = self._execute(
+            'update dataset_location set archived = {now} '
+            'where dataset_ref = ? and uri_scheme = ? and uri_body = ? and archived is null'.format(now=_NOW_SQL),
+            (_dataset_id(dataset_id), scheme, body)
+        )
+        if res.rowcount > 0:
+            self._dataset_changed(dataset_id)
+            return True
+        return False
+
+    def restore_location(self, dataset_id, uri):
+        scheme, body = _split_uri(uri)
+        res = self._execute(
+            'update dataset_location set archived = null '
+            'where dataset_ref = ? and uri_scheme = ? and uri_body = ? and archived is not null',
+            (_dataset_id(dataset_id), scheme, body)
+        )
+        if res.rowcount > 0:
+            self._dataset_changed(dataset_id)
+            return True
+        return False
+
+    def __repr__(self):
+        return "SqliteDb<connection={!r}>".format(self.connection)
+
+    def list_users(self):
+        # An embedded database has no users.
+        return iter(())
+
+    def create_user(self, username, password, role, description=None):
+        """
+        :raises UnsupportedOperationError: An embedded database has no users.
+        """
+        raise UnsupportedOperationError(_NO_USERS)
+
+    def drop_users(self, users):
+        """
+        :raises UnsupportedOperationError: An embedded database has no users.
+        """
+        raise UnsupportedOperationError(_NO_USERS)
+
+    def grant_role(self, role, users):
+        """
+        :raises UnsupportedOperationError: An embedded database has no users.
+        """
+        raise UnsupportedOperationError(_NO_USERS)
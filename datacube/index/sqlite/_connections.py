@@ -0,0 +1,202 @@
+# coding=utf-8
+"""
+SQLite connection and setup
+"""
+from __future__ import absolute_import
+
+import getpass
+import logging
+import os
+import sqlite3
+import threading
+
+from datacube.config import LocalConfig
+from datacube.index.exceptions import IndexSetupError
+from . import _api, _schema
+from ._fields import SQL_FUNCTIONS
+
+_LOG = logging.getLogger(__name__)
+
+_DEFAULT_DB_PATH = os.path.expanduser('~/.datacube.db')
+
+
+class SqliteDb(object):
+    """
+    An embedded, serverless index database, with the same interface as
+    :class:`datacube.index.postgres.PostgresDb`.
+
+    Thread safe: each thread uses its own connection to the database file.
+
+    Not multiprocess safe once connections are made: call close() before forking.
+    """
+
+    def __init__(self, path):
+        # Use static methods SqliteDb.create() or SqliteDb.from_config()
+        self._path = path
+        self._local = threading.local()
+        self._username = _current_username()
+
+        # Search fields of each product, keyed by product id. Used to maintain the extent R-tree.
+        self._product_fields = {}
+        # Whether the schema has the (optional) cell tables. Checked on first connection.
+        self._has_dataset_cells = None
+
+    def __getstate__(self):
+        return {'path': self._path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    @property
+    def url(self):
+        return 'sqlite:///{}'.format(self._path)
+
+    @classmethod
+    def create(cls, path, validate=True):
+        db = SqliteDb(path)
+        if validate:
+            connection = db._connection()
+            if not _schema.database_exists(connection):
+                raise IndexSetupError('\n\nNo DB schema exists. Have you run init?\n\t{init_command}'.format(
+                    init_command='datacube system init'
+                ))
+            if not _schema.schema_is_latest(connection):
+                raise IndexSetupError(
+                    '\n\nDB schema is out of date. '
+                    'An administrator must run init:\n\t{init_command}'.format(
+                        init_command='datacube -v system init'
+                    ))
+        return db
+
+    @classmethod
+    def from_config(cls, config=LocalConfig.find(), application_name=None, validate_connection=True):
+        # (application_name is only meaningful to server databases)
+        return SqliteDb.create(config.db_path or _DEFAULT_DB_PATH, validate=validate_connection)
+
+    def _connection(self):
+        """
+        This thread's connection to the database, opened on first use.
+
+        :rtype: sqlite3.Connection
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = _open(self._path)
+            self._local.connection = connection
+            self._local.in_transaction = False
+        return connection
+
+    def close(self):
+        """
+        Close this thread's connection.
+
+        Connections should not be shared between processes, so this should be called
+        before forking if the same instance will be used.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+            self._local.in_transaction = False
+
+    def init(self, with_permissions=True):
+        """
+        Init a new database (if not already set up).
+
+        (There are no permissions in an embedded database: with_permissions is ignored)
+
+        :return: If it was newly created.
+        """
+        connection = self._connection()
+        is_new = _schema.ensure_db(connection)
+        self._has_dataset_cells = None
+        return is_new
+
+    def connect(self):
+        """
+        Borrow this thread's connection.
+        """
+        return _SqliteDbConnection(self)
+
+    def begin(self):
+        """
+        Start a transaction.
+
+        Call commit() or rollback() to complete the transaction or use a context manager:
+
+            with db.begin() as trans:
+                trans.insert_dataset(...)
+
+        :rtype: _SqliteDbInTransaction
+        """
+        return _SqliteDbInTransaction(self)
+
+    def get_dataset_fields(self, search_fields_definition):
+        return _api.get_dataset_fields(search_fields_definition)
+
+    def _api(self):
+        connection = self._connection()
+        if self._has_dataset_cells is None:
+            self._has_dataset_cells = _schema.has_dataset_cells(connection)
+        return _api.SqliteDbAPI(connection, self._username, self._product_fields, self._local,
+                                record_cells=self._has_dataset_cells)
+
+    def __repr__(self):
+        return "SqliteDb<path={!r}>".format(self._path)
+
+
+class _SqliteDbConnection(object):
+    def __init__(self, db):
+        self._db = db
+
+    def __enter__(self):
+        return self._db._api()  # pylint: disable=protected-access
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class _SqliteDbInTransaction(object):
+    """
+    Identical to SqliteDb class, but all operations
+    are run in a transaction.
+
+    (Don't share an instance between threads)
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._api = None
+
+    def __enter__(self):
+        self._api = self._db._api()  # pylint: disable=protected-access
+        self._api.begin()
+        return self._api
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # (It may already have been rolled back)
+        if self._api.in_transaction:
+            if exc_type:
+                self._api.rollback()
+            else:
+                self._api.commit()
+        self._api = None
+
+
+def _open(path):
+    # Autocommit: when a transaction is needed we will do an explicit begin/commit.
+    connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    connection.execute('pragma foreign_keys = on')
+    # Readers don't block the writer (and vice versa)
+    if path != ':memory:':
+        connection.execute('pragma journal_mode = wal')
+    for name, (num_params, function) in SQL_FUNCTIONS.items():
+        connection.create_function(name, num_params, function)
+    return connection
+
+
+def _current_username():
+    try:
+        return getpass.getuser()
+    except (KeyError, ImportError, OSError):
+        return 'unknown'
@@ -0,0 +1,678 @@
+# coding=utf-8
+# pylint: disable=abstract-method
+"""
+Build and index fields within documents, for the embedded SQLite index.
+
+Fields produce SQL fragments over the JSON ``metadata`` column of a dataset table alias.
+Range fields named in :data:`EXTENT_DIMENSIONS` are also mirrored into the R-tree
+``dataset_extent`` table, which is used to prune spatial and temporal searches.
+"""
+from __future__ import absolute_import
+
+import calendar
+import json
+from collections import namedtuple
+from datetime import datetime, date
+from decimal import Decimal
+from uuid import UUID
+
+from dateutil import tz
+from psycopg2.extras import NumericRange, DateTimeTZRange
+
+from datacube import compat
+from datacube import utils
+from datacube.index.fields import Expression, Field
+from datacube.model import Range
+from datacube.utils import get_doc_offset_safe
+
+#: Range field names that are mirrored into the R-tree, and their dimension column prefix.
+EXTENT_DIMENSIONS = (
+    ('lon', 'lon'),
+    ('lat', 'lat'),
+    ('time', 'time'),
+)
+
+# Stand-in bounds for an R-tree dimension a dataset has no value for.
+# (R-tree coordinates are 32-bit floats.)
+RTREE_MIN = -3.0e38
+RTREE_MAX = 3.0e38
+
+
+def to_timestamp(value):
+    """
+    Convert a datetime (naive values are assumed UTC) to seconds since the epoch.
+
+    >>> to_timestamp(datetime(1970, 1, 2))
+    86400.0
+    >>> to_timestamp(datetime(1970, 1, 1, 10, tzinfo=tz.tzoffset(None, 36000)))
+    0.0
+    """
+    value = _default_utc(value)
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+
+def from_timestamp(value):
+    """
+    >>> from_timestamp(86400.5)
+    datetime.datetime(1970, 1, 2, 0, 0, 0, 500000, tzinfo=tzutc())
+    """
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, tz.tzutc())
+
+
+def sql_parse_time(value):
+    """
+    SQL function `agdc_time(text)`: parse a document time string into epoch seconds.
+    """
+    if value is None:
+        return None
+    try:
+        parsed = utils.parse_time(value)
+    except ValueError:
+        return None
+    if not isinstance(parsed, datetime):
+        return None
+    return to_timestamp(parsed)
+
+
+def sql_least(*values):
+    """
+    SQL function `agdc_least(...)`: smallest non-null value (like postgres' least()).
+
+    >>> sql_least(3, None, 1)
+    1
+    >>> sql_least(None, None)
+    """
+    values = [v for v in values if v is not None]
+    return min(values) if values else None
+
+
+def sql_greatest(*values):
+    """
+    SQL function `agdc_greatest(...)`: largest non-null value (like postgres' greatest()).
+
+    >>> sql_greatest(3, None, 1)
+    3
+    """
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+#: Application-defined functions registered on every connection: name -> (arg count, function)
+SQL_FUNCTIONS = {
+    'agdc_time': (1, sql_parse_time),
+    'agdc_least': (-1, sql_least),
+    'agdc_greatest': (-1, sql_greatest),
+}
+
+
+def _json_path(offset):
+    """
+    Convert a document offset to an SQLite JSON path.
+
+    >>> _json_path(['platform', 'code'])
+    '$."platform"."code"'
+    >>> _json_path(['image', 'bands', 0])
+    '$."image"."bands"[0]'
+    """
+    path = '$'
+    for key in offset:
+        if isinstance(key, compat.integer_types):
+            path += '[%d]' % key
+        else:
+            path += '.' + json.dumps(key)
+    return path
+
+
+def _quote(s):
+    """
+    Quote a string as an SQL literal.
+
+    >>> _quote("it's")
+    "'it''s'"
+    """
+    return "'%s'" % s.replace("'", "''")
+
+
+class SqliteField(Field):
+    """
+    SQLite implementation of a searchable field. May be a value inside
+    the JSON document column.
+    """
+
+    def __init__(self, name, description, column, indexed):
+        super(SqliteField, self).__init__(name, description)
+
+        # Name of the underlying column in the dataset table (eg. 'metadata')
+        self.column = column
+        self.indexed = indexed
+
+        # Does this field need the dataset_location table joined?
+        self.requires_location = False
+
+    def sql(self, alias):
+        """
+        Get an SQL expression for this field, reading from the given dataset table alias.
+        :rtype: str
+        """
+        raise NotImplementedError('sql expression')
+
+    def to_sql_value(self, value):
+        """
+        Convert a python value to the form this field's sql expression is compared against.
+        """
+        if isinstance(value, UUID):
+            return str(value)
+        if isinstance(value, Decimal):
+            return float(value)
+        return value
+
+    def from_sql_value(self, value):
+        """
+        Convert a value selected from this field's sql expression back to a python value.
+        """
+        return value
+
+    def __eq__(self, value):
+        """
+        :rtype: Expression
+        """
+        return EqualsExpression(self, value)
+
+    def between(self, low, high):
+        """
+        :rtype: Expression
+        """
+        raise NotImplementedError('between expression')
+
+
+class NativeField(SqliteField):
+    """
+    Fields hard-coded into the schema. (not user configurable)
+    """
+
+    def __init__(self, name, description, column, sql_expression=None,
+                 affects_row_selection=False, requires_location=False, from_sql=None):
+        super(NativeField, self).__init__(name, description, column, False)
+        self._sql_expression = sql_expression or '{alias}.%s' % column
+        self.affects_row_selection = affects_row_selection
+        self.requires_location = requires_location
+        self._from_sql = from_sql
+
+    def sql(self, alias):
+        return self._sql_expression.format(alias=alias)
+
+    def from_sql_value(self, value):
+        if self._from_sql is not None and value is not None:
+            return self._from_sql(value)
+        return value
+
+
+class DocField(SqliteField):
+    """
+    A field extracted from inside a (json) document.
+    """
+
+    def extract(self, document):
+        """
+        Extract a value from the given document in pure python (no sql).
+        """
+        raise NotImplementedError("extract()")
+
+    def value_to_sql(self, sql):
+        """
+        Wrap the given raw json value expression with any necessary casts for this field.
+        """
+        return sql
+
+    def parse_value(self, value):
+        """
+        Parse the value from a string. May be overridden by subclasses.
+        """
+        return value
+
+    def _sql_offset_value(self, alias, doc_offsets, sql_function):
+        """
+        Get an sql expression for the given offsets of this field's json column.
+        If there are multiple they will be combined using the given sql function.
+        """
+        if not doc_offsets:
+            raise ValueError("Value requires at least one offset")
+
+        if isinstance(doc_offsets[0], compat.string_types):
+            # It's a single offset.
+            doc_offsets = [doc_offsets]
+
+        values = [
+            self.value_to_sql('json_extract({alias}.{column}, {path})'.format(
+                alias=alias, column=self.column, path=_quote(_json_path(offset))
+            ))
+            for offset in doc_offsets
+        ]
+        if len(values) == 1:
+            return values[0]
+        return '%s(%s)' % (sql_function, ', '.join(values))
+
+    def _extract_offset_value(self, doc, doc_offsets, agg_function):
+        """
+        Extract a value for the given document offsets.
+
+        Same as _sql_offset_value(), but returns the value instead of an sql expression to calc the value.
+        """
+        if not doc_offsets:
+            raise ValueError("Value requires at least one offset")
+
+        if isinstance(doc_offsets[0], compat.string_types):
+            # It's a single offset.
+            doc_offsets = [doc_offsets]
+
+        values = (get_doc_offset_safe(offset, doc) for offset in doc_offsets)
+        values = [self.parse_value(v) for v in values if v is not None]
+
+        if not values:
+            return None
+        if len(values) == 1:
+            return values[0]
+        return agg_function(*values)
+
+
+class SimpleDocField(DocField):
+    """
+    A field with a single value (eg. String, int) calculated as an offset inside a (json) document.
+    """
+
+    def __init__(self, name, description, column, indexed, offset=None, selection='first'):
+        super(SimpleDocField, self).__init__(name, description, column, indexed)
+        self.offset = offset
+        if selection not in SELECTION_TYPES:
+            raise ValueError(
+                "Unknown field selection type %s. Expected one of: %r" % (
+                    selection, (SELECTION_TYPES.keys(),),)
+            )
+        self.aggregation = SELECTION_TYPES[selection]
+
+    def sql(self, alias):
+        return self._sql_offset_value(alias, self.offset, self.aggregation.sql_calc)
+
+    def between(self, low, high):
+        raise NotImplementedError('Simple field between expression')
+
+    def extract(self, document):
+        return self._extract_offset_value(document, self.offset, self.aggregation.calc)
+
+    def evaluate(self, ctx):
+        return self.extract(ctx)
+
+
+class IntDocField(SimpleDocField):
+    def value_to_sql(self, sql):
+        return 'CAST(%s AS INTEGER)' % sql
+
+    def between(self, low, high):
+        return ValueBetweenExpression(self, low, high)
+
+    def parse_value(self, s):
+        return int(s)
+
+
+class NumericDocField(SimpleDocField):
+    def value_to_sql(self, sql):
+        return 'CAST(%s AS REAL)' % sql
+
+    def between(self, low, high):
+        return ValueBetweenExpression(self, low, high)
+
+    def parse_value(self, s):
+        return Decimal(s)
+
+    def from_sql_value(self, value):
+        return None if value is None else Decimal(str(value))
+
+
+class DoubleDocField(SimpleDocField):
+    def value_to_sql(self, sql):
+        return 'CAST(%s AS REAL)' % sql
+
+    def between(self, low, high):
+        return ValueBetweenExpression(self, low, high)
+
+    def parse_value(self, s):
+        return float(s)
+
+
+class DateDocField(SimpleDocField):
+    """
+    Times are compared as seconds since the epoch (UTC).
+    """
+
+    def value_to_sql(self, sql):
+        return 'agdc_time(%s)' % sql
+
+    def to_sql_value(self, value):
+        if isinstance(value, compat.string_types):
+            value = utils.parse_time(value)
+        if isinstance(value, datetime):
+            return to_timestamp(value)
+        raise ValueError("Value not readable as date: %r" % (value,))
+
+    def from_sql_value(self, value):
+        return from_timestamp(value)
+
+    def between(self, low, high):
+        return ValueBetweenExpression(self, low, high)
+
+    def parse_value(self, s):
+        return utils.parse_time(s)
+
+
+class RangeDocField(DocField):
+    """
+    A range of values. Has min and max values, which may be calculated from multiple
+    values in the document.
+    """
+    FIELD_CLASS = SimpleDocField
+    RANGE_CLASS = NumericRange
+
+    def __init__(self, name, description, column, indexed, min_offset=None, max_offset=None):
+        super(RangeDocField, self).__init__(name, description, column, indexed)
+        self.lower = self.FIELD_CLASS(
+            name + '_lower',
+            description,
+            column,
+            indexed=False,
+            offset=min_offset,
+            selection='least'
+        )
+        self.greater = self.FIELD_CLASS(
+            name + '_greater',
+            description,
+            column,
+            indexed=False,
+            offset=max_offset,
+            selection='greatest'
+        )
+
+    def sql(self, alias):
+        # Selected as a two-element json array, unpacked by from_sql_value()
+        return 'json_array(%s, %s)' % (self.lower.sql(alias), self.greater.sql(alias))
+
+    def from_sql_value(self, value):
+        if value is None:
+            return None
+        low, high = json.loads(value)
+        if low is None and high is None:
+            return None
+        return self.RANGE_CLASS(self.lower.from_sql_value(low), self.greater.from_sql_value(high), bounds='[]')
+
+    def to_sql_value(self, value):
+        return self.lower.to_sql_value(value)
+
+    @property
+    def extent_dimension(self):
+        """
+        The R-tree dimension mirroring this field, if any.
+        :rtype: str or None
+        """
+        return dict(EXTENT_DIMENSIONS).get(self.name)
+
+    def extent_value(self, document):
+        """
+        The (min, max) of this field in the given document, as R-tree coordinates.
+        :rtype: (float, float) or None
+        """
+        low, high = self.lower.extract(document), self.greater.extract(document)
+        if low is None and high is None:
+            return None
+        return (
+            RTREE_MIN if low is None else self.lower.to_sql_value(low),
+            RTREE_MAX if high is None else self.greater.to_sql_value(high)
+        )
+
+    def __eq__(self, value):
+        """
+        :rtype: Expression
+        """
+        return RangeContainsExpression(self, value)
+
+    def between(self, low, high):
+        """
+        :rtype: Expression
+        """
+        return RangeBetweenExpression(self, low, high)
+
+    def extract(self, document):
+        min_val = self.lower.extract(document)
+        max_val = self.greater.extract(document)
+        if not min_val and not max_val:
+            return None
+        return Range(min_val, max_val)
+
+
+class NumericRangeDocField(RangeDocField):
+    FIELD_CLASS = NumericDocField
+
+
+class IntRangeDocField(RangeDocField):
+    FIELD_CLASS = IntDocField
+
+
+class DoubleRangeDocField(RangeDocField):
+    FIELD_CLASS = DoubleDocField
+
+
+class DateRangeDocField(RangeDocField):
+    FIELD_CLASS = DateDocField
+    RANGE_CLASS = DateTimeTZRange
+
+    def between(self, low, high):
+        """
+        :rtype: Expression
+        """
+        low = _number_implies_year(low)
+        high = _number_implies_year(high)
+
+        if isinstance(low, datetime) and isinstance(high, datetime):
+            return RangeBetweenExpression(self, _default_utc(low), _default_utc(high))
+        else:
+            raise ValueError("Unknown comparison type for date range: "
+                             "expecting datetimes, got: (%r, %r)" % (low, high))
+
+
+def _number_implies_year(v):
+    """
+    >>> _number_implies_year(1994)
+    datetime.datetime(1994, 1, 1, 0, 0)
+    >>> _number_implies_year(datetime(1994, 4, 4))
+    datetime.datetime(1994, 4, 4, 0, 0)
+    """
+    if isinstance(v, compat.integer_types):
+        return datetime(v, 1, 1)
+    # The expression module parses all number ranges as floats.
+    if isinstance(v, float):
+        return datetime(int(v), 1, 1)
+
+    return v
+
+
+class SqliteExpression(Expression):
+    def __init__(self, field):
+        super(SqliteExpression, self).__init__()
+        #: :type: SqliteField
+        self.field = field
+
+    def sql(self, alias):
+        """
+        Get an SQL condition for this expression against the given dataset table alias.
+        :rtype: (str, list)
+        """
+        raise NotImplementedError('sql expression')
+
+    def extent_bounds(self):
+        """
+        Bounds this expression places on an R-tree dimension, used to prune candidates
+        before the exact condition is checked.
+
+        :return: (dimension, min, max) or None if it cannot use the R-tree
+        """
+        return None
+
+
+class ValueBetweenExpression(SqliteExpression):
+    def __init__(self, field, low_value, high_value):
+        super(ValueBetweenExpression, self).__init__(field)
+        self.low_value = low_value
+        self.high_value = high_value
+
+    def sql(self, alias):
+        field_sql = self.field.sql(alias)
+        clauses, params = [], []
+        if self.low_value is not None:
+            clauses.append('%s >= ?' % field_sql)
+            params.append(self.field.to_sql_value(self.low_value))
+        if self.high_value is not None:
+            clauses.append('%s < ?' % field_sql)
+            params.append(self.field.to_sql_value(self.high_value))
+        return ' AND '.join(clauses) or '1', params
+
+
+class RangeBetweenExpression(SqliteExpression):
+    """
+    Does the (inclusive) field range overlap the half-open range [low, high)?
+    """
+
+    def __init__(self, field, low_value, high_value):
+        super(RangeBetweenExpression, self).__init__(field)
+        self.low_value = low_value
+        self.high_value = high_value
+
+    def _bounds(self):
+        low = None if self.low_value is None else self.field.to_sql_value(self.low_value)
+        high = None if self.high_value is None else self.field.to_sql_value(self.high_value)
+        return low, high
+
+    def sql(self, alias):
+        low, high = self._bounds()
+        clauses, params = [], []
+        if high is not None:
+            clauses.append('%s < ?' % self.field.lower.sql(alias))
+            params.append(high)
+        if low is not None:
+            clauses.append('%s >= ?' % self.field.greater.sql(alias))
+            params.append(low)
+        if not clauses:
+            # Unbounded: matches anything with a value.
+            return '%s IS NOT NULL' % self.field.lower.sql(alias), []
+        return ' AND '.join(clauses), params
+
+    def extent_bounds(self):
+        if self.field.extent_dimension is None:
+            return None
+        low, high = self._bounds()
+        return (self.field.extent_dimension,
+                RTREE_MIN if low is None else low,
+                RTREE_MAX if high is None else high)
+
+
+class RangeContainsExpression(SqliteExpression):
+    def __init__(self, field, value):
+        super(RangeContainsExpression, self).__init__(field)
+        self.value = value
+
+    def sql(self, alias):
+        value = self.field.to_sql_value(self.value)
+        return '%s <= ? AND %s >= ?' % (self.field.lower.sql(alias), self.field.greater.sql(alias)), [value, value]
+
+    def extent_bounds(self):
+        if self.field.extent_dimension is None:
+            return None
+        value = self.field.to_sql_value(self.value)
+        return self.field.extent_dimension, value, value
+
+
+class EqualsExpression(SqliteExpression):
+    def __init__(self, field, value):
+        super(EqualsExpression, self).__init__(field)
+        self.value = value
+
+    def sql(self, alias):
+        return '%s = ?' % self.field.sql(alias), [self.field.to_sql_value(self.value)]
+
+    def evaluate(self, ctx):
+        return self.field.evaluate(ctx) == self.value
+
+
+def parse_fields(doc, column):
+    """
+    Parse a field spec document into objects.
+
+    See :func:`datacube.index.postgres._fields.parse_fields` for the document format.
+
+    :param column: Name of the json column in the dataset table we're reading fields from.
+    :type doc: dict
+    :rtype: dict[str, SqliteField]
+    """
+
+    def _get_field(name, descriptor, column):
+        type_map = {
+            'numeric-range': NumericRangeDocField,
+            'double-range': DoubleRangeDocField,
+            'integer-range': IntRangeDocField,
+            'datetime-range': DateRangeDocField,
+            'string': SimpleDocField,
+            'integer': IntDocField,
+            'double': DoubleDocField,
+            # For backwards compatibility
+            'float-range': NumericRangeDocField,
+        }
+        ctorargs = descriptor.copy()
+        type_name = ctorargs.pop('type', 'string')
+        description = ctorargs.pop('description', None)
+        indexed_val = ctorargs.pop('indexed', "true")
+        indexed = indexed_val.lower() == 'true' if isinstance(indexed_val, compat.string_types) else indexed_val
+
+        field_class = type_map.get(type_name)
+        if not field_class:
+            raise ValueError(('Field %r has unknown type %r.'
+                              ' Available types are: %r') % (name, type_name, list(type_map.keys())))
+        try:
+            return field_class(name, description, column, indexed, **ctorargs)
+        except TypeError as e:
+            raise RuntimeError(
+                'Field {name} has unexpected argument for a {type}'.format(
+                    name=name, type=type_name
+                ), e
+            )
+
+    return {name: _get_field(name, descriptor, column) for name, descriptor in doc.items()}
+
+
+def _coalesce(*values):
+    """
+    Return first non-none value.
+
+    >>> _coalesce(None, 2, 3)
+    2
+    """
+    for v in values:
+        if v is not None:
+            return v
+
+
+def _default_utc(d):
+    if isinstance(d, date) and not isinstance(d, datetime):
+        d = datetime(d.year, d.month, d.day)
+    if d.tzinfo is None:
+        return d.replace(tzinfo=tz.tzutc())
+    return d
+
+
+# How to choose/combine multiple doc values.
+ValueAggregation = namedtuple('ValueAggregation', ('calc', 'sql_calc'))
+SELECTION_TYPES = {
+    # First non-null
+    'first': ValueAggregation(_coalesce, 'coalesce'),
+    # min/max, ignoring nulls
+    'least': ValueAggregation(min, 'agdc_least'),
+    'greatest': ValueAggregation(max, 'agdc_greatest'),
+}
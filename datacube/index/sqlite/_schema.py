@@ -0,0 +1,138 @@
+# coding=utf-8
+"""
+Tables for the embedded SQLite index.
+
+Mirrors the postgres schema (:mod:`datacube.index.postgres.tables`), with documents stored as
+json text and an R-tree virtual table holding each dataset's lon/lat/time extent.
+"""
+from __future__ import absolute_import
+
+import logging
+
+_LOG = logging.getLogger(__name__)
+
+#: Stored in the database's `user_version` pragma.
+SCHEMA_VERSION = 1
+
+_SCHEMA_SQL = """
+-- Times are stored as UTC text: 'YYYY-MM-DD HH:MM:SS.SSS'
+create table metadata_type (
+    id integer primary key autoincrement,
+    name text unique not null,
+    definition text not null,
+    added text not null default (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    added_by text not null
+);
+
+create table dataset_type (
+    id integer primary key autoincrement,
+    name text unique not null,
+    metadata text not null,
+    metadata_type_ref integer not null references metadata_type (id),
+    definition text not null,
+    added text not null default (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    added_by text not null,
+    -- Incremented whenever a dataset of this type is added, changed, archived or restored.
+    dataset_changes integer not null default 0
+);
+
+create table dataset (
+    -- Integer key for joining against the R-tree. The dataset's uuid is `id`.
+    rid integer primary key,
+    id text unique not null,
+    metadata_type_ref integer not null references metadata_type (id),
+    dataset_type_ref integer not null references dataset_type (id),
+    metadata text not null,
+    archived text,
+    added text not null default (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    added_by text not null
+);
+create index ix_dataset_dataset_type_ref on dataset (dataset_type_ref);
+
+create table dataset_location (
+    id integer primary key autoincrement,
+    dataset_ref text not null references dataset (id),
+    uri_scheme text not null,
+    uri_body text not null,
+    added text not null default (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+    added_by text not null,
+    archived text,
+    unique (uri_scheme, uri_body, dataset_ref)
+);
+create index ix_dataset_location_dataset_ref on dataset_location (dataset_ref);
+
+create table dataset_source (
+    dataset_ref text not null references dataset (id),
+    classifier text not null,
+    source_dataset_ref text not null references dataset (id),
+    primary key (dataset_ref, classifier),
+    unique (source_dataset_ref, dataset_ref)
+);
+
+-- Spatial/temporal extent of each dataset, keyed by dataset.rid.
+-- (time is in seconds since the epoch)
+create virtual table dataset_extent using rtree (
+    id,
+    min_lon, max_lon,
+    min_lat, max_lat,
+    min_time, max_time
+);
+
+-- The cells of its product's grid that each dataset overlaps.
+-- (only for products that declare a grid)
+create table dataset_cell (
+    dataset_ref text not null references dataset (id),
+    cell_x integer not null,
+    cell_y integer not null,
+    primary key (dataset_ref, cell_x, cell_y)
+);
+create index ix_dataset_cell_cell on dataset_cell (cell_x, cell_y);
+
+-- Datasets whose cells have been recorded in dataset_cell.
+-- (a dataset may overlap no cells: it has no dataset_cell rows, but is still recorded here)
+create table dataset_cell_recorded (
+    dataset_ref text primary key references dataset (id)
+);
+"""
+
+
+def database_exists(connection):
+    """
+    Have they init'd this database?
+    """
+    return connection.execute(
+        "select 1 from sqlite_master where type = 'table' and name = 'dataset'"
+    ).fetchone() is not None
+
+
+def schema_is_latest(connection):
+    """
+    Is the schema up-to-date enough to use?
+    """
+    return connection.execute('pragma user_version').fetchone()[0] >= SCHEMA_VERSION
+
+
+def has_dataset_cells(connection):
+    """
+    Are the cells of datasets recorded? (The tables are created with the schema. Without them, datasets can't be
+    looked up by cell)
+    """
+    return len(connection.execute(
+        "select 1 from sqlite_master where type = 'table' and name in ('dataset_cell', 'dataset_cell_recorded')"
+    ).fetchall()) == 2
+
+
+def ensure_db(connection):
+    """
+    Create the schema if it doesn't exist.
+
+    :return: If it was newly created.
+    """
+    if database_exists(connection):
+        return False
+
+    _LOG.info('Creating tables.')
+    connection.executescript(
+        'begin;\n' + _SCHEMA_SQL + '\npragma user_version = %d;\ncommit;' % SCHEMA_VERSION
+    )
+    return True
@@ -4,14 +4,20 @@ Core classes used across modules.
 """
 from __future__ import absolute_import, division
 
+import hashlib
+import importlib
+import json
 import logging
 import math
+import threading
 import warnings
 from collections import namedtuple, OrderedDict, Sequence
 from pathlib import Path
 from uuid import UUID
 
+import numpy
 from affine import Affine
+from cachetools import LRUCache
 
 from datacube.utils import geometry
 from datacube.utils import parse_time, cached_property, uri_to_local_path, intersects, schema_validated, DocReader
@@ -278,6 +284,11 @@ class Dataset(object):
     def __hash__(self):
         return hash(self.id)
 
+    def __reduce__(self):
+        # Without the cached properties (such as the extent geometry), which are cheap to recompute.
+        return Dataset, (self.type, self.metadata_doc, None, self.uris, self.sources,
+                         self.indexed_by, self.indexed_time, self.archived_time)
+
     def __str__(self):
         return "Dataset <id={id} type={type} location={loc}>".format(id=self.id,
                                                                      type=self.type.name,
@@ -330,6 +341,10 @@ class MetadataType(object):
     def dataset_reader(self, dataset_doc):
         return DocReader(self.definition['dataset'], self.dataset_fields, dataset_doc)
 
+    def __reduce__(self):
+        # The search fields are rebuilt from the definition by the index driver that made them, rather than pickled.
+        return _unpickle_metadata_type, (self.definition, self.id, _fields_driver(self.dataset_fields))
+
     def __str__(self):
         return "MetadataType(name={name!r}, id_={id!r})".format(id=self.id, name=self.name)
 
@@ -447,6 +462,9 @@ class DatasetType(object):
     def dataset_reader(self, dataset_doc):
         return self.metadata_type.dataset_reader(dataset_doc)
 
+    def __reduce__(self):
+        return _unpickle_product, (self.metadata_type, self.definition, self.id)
+
     def __str__(self):
         return "DatasetType(name={name!r}, id_={id!r})".format(id=self.id, name=self.name)
 
@@ -468,6 +486,92 @@ class DatasetType(object):
         return hash(self.name)
 
 
+#: Most products and metadata types to remember once unpickled (the least recently used are forgotten).
+_UNPICKLED_TYPES_MAX = 256
+
+#: Products and metadata types unpickled by this process, by :func:`pickled_type_key`.
+#: Datasets unpickled with the same product share one instance, and pickle streams can refer
+#: to one already unpickled by its key.
+_UNPICKLED_TYPES = LRUCache(maxsize=_UNPICKLED_TYPES_MAX)
+_UNPICKLED_TYPES_LOCK = threading.Lock()
+
+
+def pickled_type_key(obj):
+    """
+    A key identifying a product or metadata type in a pickle stream, or None for other objects.
+
+    The key covers the whole type: its name, id and definition (and a product's metadata type), so
+    differing types of the same name are never confused.
+
+    A stream (such as a task file) can pickle each product in full once, then refer to it by key
+    (as a pickle `persistent_id`). Unpickle the references with :func:`unpickled_type`.
+    """
+    if isinstance(obj, MetadataType):
+        return _type_key(obj.definition, obj.id, None)
+    if isinstance(obj, DatasetType):
+        return _type_key(obj.definition, obj.id, obj.metadata_type)
+    return None
+
+
+def _type_key(definition, id_, metadata_type):
+    digest = hashlib.sha1(json.dumps(definition, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    if metadata_type is None:
+        return 'MetadataType', definition['name'], id_, digest
+    return 'DatasetType', definition['name'], id_, digest, pickled_type_key(metadata_type)
+
+
+def unpickled_type(key):
+    """
+    The product or metadata type unpickled by this process with the given key.
+
+    :param tuple key: from :func:`pickled_type_key`
+    :rtype: DatasetType or MetadataType
+    """
+    with _UNPICKLED_TYPES_LOCK:
+        try:
+            return _UNPICKLED_TYPES[tuple(key)]
+        except KeyError:
+            raise ValueError('%s %r (id %s) has not been unpickled by this process' % tuple(key[:3]))
+
+
+def _unpickled(key, make):
+    with _UNPICKLED_TYPES_LOCK:
+        existing = _UNPICKLED_TYPES.get(key)
+    if existing is not None:
+        return existing
+    made = make()
+    with _UNPICKLED_TYPES_LOCK:
+        _UNPICKLED_TYPES[key] = made
+    return made
+
+
+def _unpickle_product(metadata_type, definition, id_):
+    return _unpickled(_type_key(definition, id_, metadata_type),
+                      lambda: DatasetType(metadata_type, definition, id_))
+
+
+def _unpickle_metadata_type(definition, id_, fields_driver):
+    def make():
+        fields = {}
+        if fields_driver:
+            driver_api = importlib.import_module(fields_driver + '._api')
+            fields = driver_api.get_dataset_fields(definition['dataset']['search_fields'])
+        return MetadataType(definition, fields, id_)
+
+    return _unpickled(_type_key(definition, id_, None), make)
+
+
+def _fields_driver(dataset_fields):
+    """
+    The index driver package whose `_api.get_dataset_fields()` made the fields, if any.
+    """
+    for field in dataset_fields.values():
+        module = type(field).__module__
+        if module.startswith('datacube.index.') and module.endswith('._fields'):
+            return module[:-len('._fields')]
+    return None
+
+
 def GeoPolygon(coordinates, crs):  # pylint: disable=invalid-name
     warnings.warn("GeoPolygon is depricated. Use 'datacube.utils.geometry.polygon'", DeprecationWarning)
     if not isinstance(coordinates, Sequence):
@@ -627,16 +731,60 @@ class GridSpec(object):
         :param tile_buffer:
         :return: iterator of grid cells with :py:class:`GeoBox` tiles
         """
-        result = []
-        geopolygon = geopolygon.to_crs(self.crs)
-        for tile_index, tile_geobox in self.tiles(geopolygon.boundingbox.buffered(*tile_buffer)):
-            if tile_buffer:
-                tile_geobox = tile_geobox.buffered(*tile_buffer)
+        return [(tile_index, self._tile_geobox(tile_index, tile_buffer))
+                for tile_index in self.tile_indexes([geopolygon], tile_buffer)[0]]
 
-            if intersects(tile_geobox.extent, geopolygon):
-                result.append((tile_index, tile_geobox))
+    def tile_indexes(self, geopolygons, tile_buffer=(0, 0)):
+        """
+        The indexes of the tiles intersecting each of many polygons.
+
+        Gives the same tiles as :meth:`tiles_inside_geopolygon`, but candidate tiles for all polygons are found
+        with array arithmetic, and the exact (slow) intersection test is only needed for tiles that are crossed
+        by a polygon's edge. No :py:class:`GeoBox` is created: use :meth:`tile_geobox` for the tiles needed.
+
+        :param list[geometry.Geometry] geopolygons: Polygons to tile
+        :param (float,float) tile_buffer: buffer tiles by (y, x) in CRS units
+        :return: for each polygon, the (x, y) indexes of the tiles it intersects
+        :rtype: list[list[(int,int)]]
+        """
+        geopolygons = [geopolygon.to_crs(self.crs) for geopolygon in geopolygons]
+        if not geopolygons:
+            return []
+
+        ybuff, xbuff = tile_buffer
+        tile_size_y, tile_size_x = self.tile_size
+        tile_origin_y, tile_origin_x = self.origin
+        bounds = numpy.array([tuple(geopolygon.boundingbox) for geopolygon in geopolygons], dtype='float64')
+        lefts, bottoms, rights, tops = bounds.T
+        x_starts, x_stops = _grid_index_ranges(lefts - xbuff - tile_origin_x, rights + xbuff - tile_origin_x,
+                                               tile_size_x)
+        y_starts, y_stops = _grid_index_ranges(bottoms - ybuff - tile_origin_y, tops + ybuff - tile_origin_y,
+                                               tile_size_y)
+
+        # Every tile's extent is the (0, 0) tile's extent, offset by a whole number of tiles.
+        extent = self._tile_geobox((0, 0), tile_buffer).extent.boundingbox
+        margin = 1e-9 * max(abs(tile_size_x), abs(tile_size_y))
+
+        result = []
+        for geopolygon, x_start, x_stop, y_start, y_stop in zip(geopolygons, x_starts, x_stops, y_starts, y_stops):
+            # Candidates in the same (y, x) order as tiles()
+            ys, xs = numpy.meshgrid(numpy.arange(y_start, y_stop), numpy.arange(x_start, x_stop), indexing='ij')
+            ys, xs = ys.ravel(), xs.ravel()
+            offset_y, offset_x = ys * tile_size_y, xs * tile_size_x
+            overlapping = _certainly_overlapping(geopolygon,
+                                                 offset_x + extent.left, offset_y + extent.bottom,
+                                                 offset_x + extent.right, offset_y + extent.top,
+                                                 margin)
+            result.append([(int(x), int(y)) for x, y, overlaps in zip(xs, ys, overlapping)
+                           if overlaps or intersects(self._tile_geobox((x, y), tile_buffer).extent, geopolygon)])
         return result
 
+    def _tile_geobox(self, tile_index, tile_buffer):
+        geobox = self.tile_geobox(tile_index)
+        if tile_buffer:
+            geobox = geobox.buffered(*tile_buffer)
+        return geobox
+
     @staticmethod
     def grid_range(lower, upper, step):
         """
@@ -670,3 +818,79 @@ class GridSpec(object):
 
     def __repr__(self):
         return self.__str__()
+
+
+def _grid_index_ranges(lower, upper, step):
+    """
+    :meth:`GridSpec.grid_range` for arrays of bounds: the start and stop indexes of each.
+
+    >>> [a.tolist() for a in _grid_index_ranges(numpy.array([-4.0, 1.0]), numpy.array([-1.0, 4.0]), 3.0)]
+    [[-2, 0], [0, 2]]
+    >>> [a.tolist() for a in _grid_index_ranges(numpy.array([1.0]), numpy.array([4.0]), -3.0)]
+    [[-2], [0]]
+    """
+    if step < 0.0:
+        lower, upper, step = -upper, -lower, -step
+    assert step > 0.0
+    return numpy.floor(lower / step).astype('int64'), numpy.ceil(upper / step).astype('int64')
+
+
+def _certainly_overlapping(geopolygon, lefts, bottoms, rights, tops, margin):
+    """
+    Which of the given rectangles certainly share some interior with the polygon.
+
+    Cheap tests: either a polygon vertex is inside the rectangle, or a rectangle corner is inside the polygon,
+    further than `margin` from any edge. Others may or may not overlap, and need an exact test.
+
+    :rtype: numpy.ndarray[bool]
+    """
+    overlapping = numpy.zeros(len(lefts), dtype=bool)
+    geojson = geopolygon.json
+    # (Holes and multiple parts are left for the exact test)
+    if geojson['type'] != 'Polygon' or len(geojson['coordinates']) != 1:
+        return overlapping
+    ring = numpy.array([point[:2] for point in geojson['coordinates'][0]], dtype='float64')
+    if len(ring) < 4 or _ring_area(ring) == 0:
+        return overlapping
+
+    x, y = ring[:-1, 0], ring[:-1, 1]
+    overlapping |= ((x > lefts[:, None] + margin) & (x < rights[:, None] - margin) &
+                    (y > bottoms[:, None] + margin) & (y < tops[:, None] - margin)).any(axis=1)
+
+    corners_x = numpy.stack([lefts, rights, rights, lefts], axis=1)
+    corners_y = numpy.stack([bottoms, bottoms, tops, tops], axis=1)
+    overlapping |= _points_inside_ring(corners_x.ravel(), corners_y.ravel(), ring, margin).reshape(-1, 4).any(axis=1)
+    return overlapping
+
+
+def _ring_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return abs(numpy.dot(x[:-1], y[1:]) - numpy.dot(x[1:], y[:-1])) / 2
+
+
+def _points_inside_ring(xs, ys, ring, margin):
+    """
+    Which points are inside the closed ring, and further than `margin` from its edges.
+
+    >>> square = numpy.array([(0, 0), (0, 2), (2, 2), (2, 0), (0, 0)], dtype='float64')
+    >>> _points_inside_ring(numpy.array([1.0, 3.0, 2.0, 1.999]), numpy.array([1.0] * 4), square, 0.01).tolist()
+    [True, False, False, False]
+    """
+    xs, ys = xs[:, None], ys[:, None]
+    x1, y1, x2, y2 = ring[:-1, 0], ring[:-1, 1], ring[1:, 0], ring[1:, 1]
+    dx, dy = x2 - x1, y2 - y1
+
+    # Even-odd rule: count the edges crossed by a ray in the +x direction.
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        crossing_x = x1 + (ys - y1) * dx / dy
+    crossings = ((y1 > ys) != (y2 > ys)) & (xs < crossing_x)
+    inside = crossings.sum(axis=1) % 2 == 1
+
+    # Distance to the nearest edge
+    length2 = dx * dx + dy * dy
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        t = numpy.where(length2 > 0, ((xs - x1) * dx + (ys - y1) * dy) / length2, 0)
+    t = numpy.clip(t, 0, 1)
+    distance = numpy.hypot(xs - (x1 + t * dx), ys - (y1 + t * dy)).min(axis=1)
+
+    return inside & (distance > margin)
@@ -30,12 +30,16 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+import itertools
 import math
 import operator
 import inspect
 import sys
 import ctypes
+from collections import OrderedDict
 from pprint import pprint
+import dask.array as da
+import numexpr
 import numpy as np
 import xarray as xr
 from xarray import ufuncs
@@ -47,6 +51,202 @@ from pyparsing import Literal, CaselessLiteral, Word, Combine, Group,\
 
 ParserElement.enablePackrat()
 
+# Operators numexpr evaluates the same as xarray, and their numexpr spelling
+_NUMEXPR_OPS = {"+": "+",
+                "-": "-",
+                "*": "*",
+                "/": "/",
+                "^": "**",
+                "**": "**",
+                ">": ">",
+                ">=": ">=",
+                "<": "<",
+                "<=": "<=",
+                "==": "==",
+                "!=": "!=",
+                "|": "|",
+                "&": "&"}
+
+_LOGICAL_OPS = frozenset([">", ">=", "<", "<=", "==", "!=", "|", "&"])
+
+# Pixels the cloud and cloud shadow masks are dilated by, in `get_pqa_mask`
+_PQA_DILATION = 3
+
+# Whether each value of a (dilated) pqa array is a known good pixel value, in `get_pqa_mask`
+_GOOD_PIXELS = np.zeros(1 << 17, dtype=bool)
+_GOOD_PIXELS[[32767, 16383, 2457]] = True
+
+_NUMEXPR_DTYPES = frozenset(np.dtype(dtype) for dtype in ('bool', 'int32', 'int64', 'float32', 'float64'))
+
+
+class _Term(object):
+    """
+    A compiled element-wise expression, which can be evaluated in a single numexpr call.
+
+    Its inputs are the non-element-wise expressions it is made of.
+    """
+
+    def __init__(self, text, apply, inputs, constants, ops, logical=False):
+        """
+        :param str text: numexpr expression
+        :param apply: evaluates it operator by operator, given the values of the inputs by name
+        :param collections.OrderedDict inputs: callables evaluating each input, by name
+        :param dict constants: value of each constant, by name
+        :param frozenset ops: operators in it
+        :param bool logical: whether it is a comparison or logical operator
+        """
+        self.text = text
+        self.apply = apply
+        self.inputs = inputs
+        self.constants = constants
+        self.ops = ops
+        self.logical = logical
+
+    @classmethod
+    def input(cls, name, fn):
+        return cls(name, lambda values: values[name], OrderedDict([(name, fn)]), {}, frozenset())
+
+    @classmethod
+    def constant(cls, name, value):
+        return cls(name, lambda values: value, OrderedDict(), {name: value}, frozenset())
+
+    @classmethod
+    def unary(cls, op, fn, op1):
+        return cls('(%s%s)' % (op, op1.text),
+                   lambda values: fn(op1.apply(values)),
+                   op1.inputs, op1.constants, op1.ops | frozenset(['unary ' + op]),
+                   logical=op == '~' and op1.logical)
+
+    @classmethod
+    def binary(cls, op, fn, op1, op2):
+        def apply(values):
+            val2 = op2.apply(values)
+            val1 = op1.apply(values)
+            if op == '+':
+                return _add(val1, val2)
+            return fn(val1, val2)
+
+        inputs = OrderedDict(op2.inputs)
+        inputs.update(op1.inputs)
+        constants = dict(op2.constants, **op1.constants)
+        return cls('(%s %s %s)' % (op1.text, _NUMEXPR_OPS[op], op2.text), apply, inputs, constants,
+                   op1.ops | op2.ops | frozenset([op]), logical=op in _LOGICAL_OPS)
+
+
+def _numexpr_evaluate(term, values):
+    """
+    Evaluate an element-wise term with numexpr.
+
+    Only DataArrays of the same dimensions and coordinates (and float scalars) are handled, where numexpr gives the
+    same result as xarray. Dask-backed arrays are evaluated block by block, lazily.
+
+    :param _Term term: term to evaluate
+    :param dict values: values of its inputs, by name
+    :return: the result, or None if numexpr can't evaluate it
+    """
+    names = [name for name, value in values.items() if isinstance(value, xr.DataArray)]
+    if not names or len(names) + sum(isinstance(value, float) for value in values.values()) != len(values):
+        return None
+    arrays = [values[name] for name in names]
+    template = arrays[0]
+    if any(array.dims != template.dims or array.shape != template.shape or
+           not isinstance(array.data, (np.ndarray, da.Array)) for array in arrays):
+        return None
+    dtypes = set(array.dtype for array in arrays)
+    if not dtypes <= _NUMEXPR_DTYPES:
+        return None
+    if '+' in term.ops and np.dtype(bool) in dtypes:
+        # (adding a boolean array masks with it)
+        return None
+    try:
+        xr.align(*arrays, join='exact', copy=False)
+    except ValueError:
+        return None
+
+    # Constants don't promote float32 arrays to float64, as in numpy
+    float_type = np.float32 if dtypes == {np.dtype('float32')} else np.float64
+    scalars = dict((name, float_type(value)) for name, value in values.items() if name not in names)
+    scalars.update((name, float_type(value)) for name, value in term.constants.items())
+
+    def evaluate(*blocks):
+        local_dict = dict(zip(names, blocks))
+        local_dict.update(scalars)
+        return numexpr.evaluate(term.text, local_dict=local_dict)
+
+    try:
+        if any(isinstance(array.data, da.Array) for array in arrays):
+            # (evaluated on a pixel, for the type of the result)
+            dtype = evaluate(*[np.zeros(1, array.dtype) for array in arrays]).dtype
+            result = da.map_blocks(evaluate, *[da.asarray(array.data) for array in arrays], dtype=dtype)
+        else:
+            result = evaluate(*[array.data for array in arrays])
+    except NotImplementedError:
+        # (numexpr has no opcode for these types, eg. negating booleans)
+        return None
+    return xr.DataArray(result, coords=template.coords, dims=template.dims)
+
+
+def _dask_median(data, axis=None):
+    """
+    Median of a dask array: the median of each block, once the reduced axes are each a single chunk.
+    """
+    if axis is None:
+        axis = tuple(range(data.ndim))
+    axis = tuple(a % data.ndim for a in (axis if isinstance(axis, (tuple, list)) else (axis,)))
+    dtype = np.nanmedian(np.ones(1, data.dtype)).dtype
+    data = data.rechunk(dict((a, -1) for a in axis))
+    return data.map_blocks(np.nanmedian, axis=axis, drop_axis=axis, dtype=dtype)
+
+
+# Chunk-aware dask reductions (skipping nans), for reducing dask-backed arrays with xarray reductions
+_DASK_REDUCTIONS = {xr.DataArray.all: da.all,
+                    xr.DataArray.any: da.any,
+                    xr.DataArray.argmax: da.nanargmax,
+                    xr.DataArray.argmin: da.nanargmin,
+                    xr.DataArray.max: da.nanmax,
+                    xr.DataArray.mean: da.nanmean,
+                    xr.DataArray.median: _dask_median,
+                    xr.DataArray.min: da.nanmin,
+                    xr.DataArray.prod: da.prod,
+                    xr.DataArray.sum: da.nansum,
+                    xr.DataArray.std: da.nanstd,
+                    xr.DataArray.var: da.nanvar}
+
+
+def reduce_array(fn, array, axis=None, **kwargs):
+    """
+    Reduce an array with an xarray reduction, eg. ``xr.DataArray.median``.
+
+    Dask-backed arrays are reduced lazily, chunk by chunk, with the equivalent dask reduction (which skips nans).
+
+    :param fn: xarray reduction
+    :param array: array to reduce
+    :param axis: axis or axes to reduce along, or all of them if None
+    :param kwargs: other arguments of the reduction, eg. `skipna`
+    """
+    array = xr.DataArray(array)
+    if isinstance(array.data, da.Array) and fn in _DASK_REDUCTIONS:
+        return array.reduce(_DASK_REDUCTIONS[fn], axis=axis)
+    if axis is not None:
+        kwargs['axis'] = axis
+    return fn(array, **kwargs)
+
+
+def _add(op1, op2):
+    if isinstance(op2, xr.DataArray) and op2.dtype.type == np.bool_:
+        return xr.DataArray.where(op1, op2)
+    return op1 + op2
+
+
+def _as_array(val):
+    if isinstance(val, tuple) or isinstance(val, np.ndarray):
+        return xr.DataArray(val)
+    return val
+
+
+def _num_args(fn):
+    return len(getattr(inspect, 'getfullargspec', inspect.getargspec)(fn).args)
+
 
 class NDexpr(object):
 
@@ -61,6 +261,10 @@ class NDexpr(object):
         self.expr_stack = []
         self.texpr_stack = []
 
+        # Compiled expressions, and the frame of the caller evaluating one
+        self._compiled = {}
+        self.caller = None
+
         # Define constants
         self.constants = {}
 
@@ -315,144 +519,185 @@ class NDexpr(object):
         self.texpr_stack.append(self.expr_stack)
         self.expr_stack = []
 
-    def evaluate_stack(self, s):
+    def compile(self, s):
+        """
+        Compile an expression into a callable, which evaluates it.
+
+        Compiled expressions are cached, keyed by their text (and the user functions they could call), so each
+        expression is only parsed once.
+        """
+        key = (s, tuple(sorted((name, _num_args(fn)) for name, fn in (self.user_functions or {}).items())))
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            self.expr_stack = []
+            self.parser.parseString(s)
+            compiled = self._callable(self._compile(self.expr_stack[:], itertools.count()))
+            self._compiled[key] = compiled
+        return compiled
+
+    def _compile(self, s, names):
+        """
+        Compile the expression at the top of a token stack, consuming its tokens.
+
+        :param list s: postfix token stack, as built by the parser
+        :param names: counter for naming the inputs of element-wise terms
+        :return: a callable, or an :class:`_Term` if the expression is element-wise
+        """
         op = s.pop()
         if op == 'unary -':
-            return -self.evaluate_stack(s)
+            return _Term.unary('-', operator.neg, self._term(self._compile(s, names), names))
         elif op == 'unary ~':
-            return ~self.evaluate_stack(s)
+            return _Term.unary('~', operator.inv, self._term(self._compile(s, names), names))
         elif op == 'unary !':
-            return xr.ufuncs.logical_not(self.evaluate_stack(s))
+            op1 = self._callable(self._compile(s, names))
+            return lambda: xr.ufuncs.logical_not(op1())
         elif op == "=":
-            op1 = s.pop()
-            op2 = self.evaluate_stack(s)
-            self.f.f_globals[op1] = op2
+            name = s.pop()
+            op2 = self._callable(self._compile(s, names))
 
-            # code to write to locals, need to sort out when to write to locals/globals.
-            # self.f.f_locals[op1] = op2
-            # ctypes.pythonapi.PyFrame_LocalsToFast(ctypes.py_object(self.f), ctypes.c_int(1))
+            def assign():
+                self.f.f_globals[name] = op2()
+
+                # code to write to locals, need to sort out when to write to locals/globals.
+                # self.f.f_locals[op1] = op2
+                # ctypes.pythonapi.PyFrame_LocalsToFast(ctypes.py_object(self.f), ctypes.c_int(1))
+            return assign
         elif op in self.opn.keys():
-            op2 = self.evaluate_stack(s)
-            op1 = self.evaluate_stack(s)
-            if op == '+' and isinstance(op2, xr.DataArray) and \
-               op2.dtype.type == np.bool_:
-                return xr.DataArray.where(op1, op2)
+            op2 = self._compile(s, names)
+            op1 = self._compile(s, names)
+            if op in _NUMEXPR_OPS and not (op == '+' and isinstance(op2, _Term) and op2.logical):
+                return _Term.binary(op, self.opn[op], self._term(op1, names), self._term(op2, names))
+
+            fn = self.opn[op]
+            op1 = self._callable(op1)
+            op2 = self._callable(op2)
+            if op == '+':
+                return lambda: _add(op1(), op2())
             elif op == "<<" or op == ">>":
-                return self.opn[op](op1, int(op2))
-            return self.opn[op](op1, op2)
+                return lambda: fn(op1(), int(op2()))
+            return lambda: fn(op1(), op2())
         elif op == "::":
-            return slice(None, None, None)
+            return lambda: slice(None, None, None)
         elif op == "()":
-            num_args = int(self.evaluate_stack(s))
-            fn_args = ()
-            for i in range(0, num_args):
-                fn_args += self.evaluate_stack(s),
-            fn_args = fn_args[::-1]
-            return fn_args
+            num_args = int(s.pop())
+            fn_args = [self._callable(self._compile(s, names)) for i in range(0, num_args)][::-1]
+            return lambda: tuple(arg() for arg in fn_args)
         elif op in self.xrfn:
-            dim = int(self.evaluate_stack(s))
-            dims = ()
-            for i in range(1, dim):
-                dims += int(self.evaluate_stack(s)),
-            op1 = self.evaluate_stack(s)
-
-            args = {}
-            if op == 'argmax' or op == 'argmin':
-                if dim != 1:
-                    args['axis'] = dims[0]
-            elif dim != 1:
-                args['axis'] = dims
+            fn = self.xrfn[op]
+            dim = int(s.pop())
+            dims = [self._callable(self._compile(s, names)) for i in range(1, dim)]
+            op1 = self._callable(self._compile(s, names))
 
             if sys.version_info >= (3, 0):
-                if 'skipna' in list(inspect.signature(self.xrfn[op]).parameters.keys()) and \
-                   op != 'prod':
-                    args['skipna'] = True
+                skipna = 'skipna' in list(inspect.signature(fn).parameters.keys()) and op != 'prod'
             else:
-                if 'skipna' in inspect.getargspec(self.xrfn[op])[0] and \
-                   op != 'prod':
+                skipna = 'skipna' in inspect.getargspec(fn)[0] and op != 'prod'
+
+            def reduce():
+                args = {}
+                axes = tuple(int(axis()) for axis in dims)
+                if op == 'argmax' or op == 'argmin':
+                    if dim != 1:
+                        args['axis'] = axes[0]
+                elif dim != 1:
+                    args['axis'] = axes
+                if skipna:
                     args['skipna'] = True
-
-            val = self.xrfn[op](xr.DataArray(op1), **args)
-            return val
+                return reduce_array(fn, op1(), **args)
+            return reduce
         elif op in self.xfn1:
-            val = self.xfn1[op](self.evaluate_stack(s))
-
-            if isinstance(val, tuple) or isinstance(val, np.ndarray):
-                return xr.DataArray(val)
-            return val
-        elif op in self.xfn2:
-            op2 = self.evaluate_stack(s)
-            op1 = self.evaluate_stack(s)
-            val = self.xfn2[op](op1, op2)
-
-            if isinstance(val, tuple) or isinstance(val, np.ndarray):
-                return xr.DataArray(val)
-            return val
-        elif op in self.fn2:
-            op2 = self.evaluate_stack(s)
-            op1 = self.evaluate_stack(s)
-            val = self.fn2[op](op1, op2)
-
-            if isinstance(val, tuple) or isinstance(val, np.ndarray):
-                return xr.DataArray(val)
-            return val
+            fn = self.xfn1[op]
+            op1 = self._callable(self._compile(s, names))
+            return lambda: _as_array(fn(op1()))
+        elif op in self.xfn2 or op in self.fn2:
+            fn = self.xfn2[op] if op in self.xfn2 else self.fn2[op]
+            op2 = self._callable(self._compile(s, names))
+            op1 = self._callable(self._compile(s, names))
+            return lambda: _as_array(fn(op1(), op2()))
         elif self.user_functions is not None and op in self.user_functions:
-            fn = self.user_functions[op]
-            num_args = len(inspect.getargspec(fn).args)
-
-            fn_args = ()
-            for i in range(0, num_args):
-                fn_args += self.evaluate_stack(s),
-            fn_args = fn_args[::-1]
-
-            val = self.user_functions[op](*fn_args)
-            return val
+            num_args = _num_args(self.user_functions[op])
+            fn_args = [self._callable(self._compile(s, names)) for i in range(0, num_args)][::-1]
+            return lambda: self.user_functions[op](*[arg() for arg in fn_args])
         elif op in ":":
-            op2 = int(self.evaluate_stack(s))
-            op1 = int(self.evaluate_stack(s))
-
-            return slice(op1, op2, None)
+            op2 = self._callable(self._compile(s, names))
+            op1 = self._callable(self._compile(s, names))
+            return lambda: slice(int(op1()), int(op2()), None)
         elif op in "[]":
-            op1 = self.evaluate_stack(s)
-            ops = ()
-            i = 0
-            dims = len(s)
+            op1 = self._callable(self._compile(s, names))
+            ops = []
             while len(s) > 0:
-                val = self.evaluate_stack(s)
-                if not isinstance(val, slice):
-                    val = int(val)
-                ops += val,
-                i = i+1
+                ops.append(self._callable(self._compile(s, names)))
             ops = ops[::-1]
-            return op1[ops]
-        elif op in "{}":
-            op1 = self.evaluate_stack(s)
-            op2 = self.evaluate_stack(s)
-            if op2.dtype != bool:
-                op2 = self.get_pqa_mask(op2.astype(np.int64).values)
 
-            val = xr.DataArray.where(op1, op2)
-            return val
+            def index():
+                array = op1()
+                return array[tuple(val if isinstance(val, slice) else int(val) for val in (o() for o in ops))]
+            return index
+        elif op in "{}":
+            op1 = self._callable(self._compile(s, names))
+            op2 = self._callable(self._compile(s, names))
+
+            def mask():
+                array = op1()
+                pqa = op2()
+                if pqa.dtype != bool:
+                    pqa = pqa.astype(np.int64)
+                    if isinstance(pqa.data, da.Array):
+                        # (each block overlapping its neighbours by the dilation of the cloud masks)
+                        pqa = pqa.copy(data=pqa.data.map_overlap(self.get_pqa_mask,
+                                                                 depth={0: 0, 1: _PQA_DILATION, 2: _PQA_DILATION},
+                                                                 boundary='none', dtype=bool))
+                    else:
+                        pqa = self.get_pqa_mask(pqa.values)
+                return xr.DataArray.where(array, pqa)
+            return mask
         elif op == "?":
-            op1 = s.pop()
-            op2 = s.pop()
-            op3 = s.pop()
-
-            ifval = self.evaluate_stack(op1)
-            if ifval:
-                return self.evaluate_stack(op2)
-            else:
-                return self.evaluate_stack(op3)
+            op1 = self._callable(self._compile(s.pop(), names))
+            op2 = self._callable(self._compile(s.pop(), names))
+            op3 = self._callable(self._compile(s.pop(), names))
+            return lambda: op2() if op1() else op3()
         elif op[0].isalpha():
-            if self.local_dict is not None and op in self.local_dict:
-                return self.local_dict[op]
-            frame = self.getframe(op)
-            if op in frame.f_locals:
-                return frame.f_locals[op]
-            if op in frame.f_globals:
-                return frame.f_globals[op]
+            return lambda: self.lookup(op)
         else:
-            return float(op)
+            return _Term.constant('c%d' % next(names), float(op))
+
+    def _term(self, compiled, names):
+        """
+        An element-wise term of a compiled expression: a non-element-wise expression becomes an input of it.
+        """
+        if isinstance(compiled, _Term):
+            return compiled
+        return _Term.input('v%d' % next(names), compiled)
+
+    def _callable(self, compiled):
+        """
+        A callable of a compiled expression: element-wise terms are evaluated by numexpr where possible.
+        """
+        if not isinstance(compiled, _Term):
+            return compiled
+        if not compiled.ops:
+            # a bare input or constant
+            return lambda: compiled.apply(dict((name, fn()) for name, fn in compiled.inputs.items()))
+
+        def evaluate():
+            values = dict((name, fn()) for name, fn in compiled.inputs.items())
+            result = _numexpr_evaluate(compiled, values)
+            if result is None:
+                result = compiled.apply(values)
+            return result
+        return evaluate
+
+    def lookup(self, var):
+        """
+        Value of a variable: from the local dictionary, or else the calling frames
+        """
+        if self.local_dict is not None and var in self.local_dict:
+            return self.local_dict[var]
+        frame = self.getframe(var)
+        if var in frame.f_locals:
+            return frame.f_locals[var]
+        if var in frame.f_globals:
+            return frame.f_globals[var]
 
     def is_number(self, s):
         try:
@@ -465,15 +710,12 @@ class NDexpr(object):
         return [item for sublist in l for item in sublist]
 
     def getframe(self, var):
-        try:
-            limit = sys.getrecursionlimit()
-            for i in range(0, limit):
-                frame = sys._getframe(i)
-                if var in frame.f_locals or var in frame.f_globals:
-                    return frame
-            return self.f
-        except ValueError:
-            return self.f
+        frame = self.caller
+        while frame is not None:
+            if var in frame.f_locals or var in frame.f_globals:
+                return frame
+            frame = frame.f_back
+        return self.f
 
     def evaluate(self, s, local_dict=None, user_functions=None):
         if local_dict is None:
@@ -484,11 +726,11 @@ class NDexpr(object):
             self.local_dict = local_dict
         if user_functions is not None:
             self.user_functions = user_functions
-        self.expr_stack = []
-        results = self.parser.parseString(s)
-        #print(self.expr_stack)
-        val = self.evaluate_stack(self.expr_stack[:])
-        return val
+        self.caller = sys._getframe(1)
+        try:
+            return self.compile(s)()
+        finally:
+            self.caller = None
 
     def test(self, s, e):
         result = self.evaluate(s)
@@ -515,11 +757,8 @@ class NDexpr(object):
 
         Parameters:
             pqa_ndarray: input pqa array
-            good_pixel_masks: known good pixel values
-            dilation: amount of dilation to apply
         '''
-        good_pixel_masks = [32767, 16383, 2457]
-        dilation = 3
+        dilation = _PQA_DILATION
         pqa_mask = np.zeros(pqa_ndarray.shape, dtype=np.bool)
         for i in range(len(pqa_ndarray)):
             pqa_array = pqa_ndarray[i]
@@ -552,8 +791,7 @@ class NDexpr(object):
             dif[dif < 0] = 1
             pqa_array += (dif << 13)
 
-            for good_pixel_mask in good_pixel_masks:
-                pqa_mask[i][pqa_array == good_pixel_mask] = True
+            pqa_mask[i] = _GOOD_PIXELS.take(pqa_array, mode='clip')
         return pqa_mask
 
     def plot_3d(self, array_result):
@@ -1,7 +1,10 @@
 from __future__ import absolute_import
 
+import math
+import shutil
 import time
 import logging
+import threading
 import click
 import cachetools
 import itertools
@@ -9,19 +12,32 @@ try:
     import cPickle as pickle
 except ImportError:
     import pickle
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from collections import OrderedDict, namedtuple
 from copy import deepcopy
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
+import numpy
 from pandas import to_datetime
 from datetime import datetime
+from dateutil import tz
 
 import datacube
 from datacube.api.core import Datacube
+from datacube.api.query import Query, query_group_by
+from datacube.executor import InstrumentedExecutor
 from datacube.model import DatasetType, Range, GeoPolygon
 from datacube.model.utils import make_dataset, xr_apply, datasets_to_doc
-from datacube.storage.storage import write_dataset_to_netcdf
+from datacube.storage.storage import write_dataset_to_netcdf, create_netcdf_storage_unit, NETCDF_LOCK
+from datacube.storage import geotiff_writer
+from datacube.storage.netcdf_writer import netcdfy_data
 from datacube.ui import click as ui
-from datacube.utils import read_documents, changes
-from datacube.ui.task_app import check_existing_files, load_tasks as load_tasks_, save_tasks as save_tasks_
+from datacube.utils import read_documents, changes, geometry
+from datacube.ui.task_app import check_existing_files, load_tasks as load_tasks_, save_tasks as save_tasks_, \
+    task_shard_option
 
 from datacube.ui.click import cli
 
@@ -29,24 +45,95 @@ _LOG = logging.getLogger('agdc-ingest')
 
 FUSER_KEY = 'fuse_data'
 
+DEFAULT_STORAGE_DRIVER = 'NetCDF CF'
+
 
 def find_diff(input_type, output_type, index, **query):
+    """
+    Find the tiles of the input product that are missing from the output product.
+
+    Only the (cell, time) keys of the output product are fetched from the index, and
+    input tiles are only built for keys that are missing.
+
+    :rtype: list[dict]
+    """
     from datacube.api.grid_workflow import GridWorkflow
     workflow = GridWorkflow(index, output_type.grid_spec)
+    group_by = query_group_by(**query)
+
+    existing = _tile_keys(index, output_type, **query)
 
-    tiles_in = workflow.list_tiles(product=input_type.name, **query)
-    tiles_out = workflow.list_tiles(product=output_type.name, **query)
+    observations = workflow.cell_observations(product=input_type.name, **query)
+    for cell_index, observation in observations.items():
+        observation['datasets'] = [dataset for dataset in observation['datasets']
+                                   if cell_index + (_time_key(group_by.group_by_func(dataset)),) not in existing]
+    tiles_in = workflow.tile_sources({cell_index: observation for cell_index, observation in observations.items()
+                                      if observation['datasets']},
+                                     group_by)
 
-    tasks = [{'tile': tile, 'tile_index': key} for key, tile in tiles_in.items() if key not in tiles_out]
+    tasks = [{'tile': tile, 'tile_index': key} for key, tile in tiles_in.items()]
     return tasks
 
 
+def _tile_keys(index, output_type, **query):
+    """
+    The (x, y, time) tile keys of the ingested datasets of a product.
+
+    The cell of each dataset is found from the centre of its lat/lon extent, rather than
+    loading its full document and geometry.
+
+    :rtype: set[(int, int, numpy.datetime64)]
+    """
+    grid_spec = output_type.grid_spec
+    latlon = geometry.CRS('EPSG:4326')
+    tile_size_y, tile_size_x = grid_spec.tile_size
+    origin_y, origin_x = grid_spec.origin
+
+    @cachetools.cached(cache={})
+    def cell_of(lat, lon):
+        centre = geometry.point((lon.lower + lon.upper) / 2, (lat.lower + lat.upper) / 2, latlon).to_crs(grid_spec.crs)
+        x, y = centre.coords[0]
+        return int(math.floor((x - origin_x) / tile_size_x)), int(math.floor((y - origin_y) / tile_size_y))
+
+    search_terms = Query(index, product=output_type.name, **query).search_terms
+    return set(cell_of(_range_key(result.lat), _range_key(result.lon)) + (_dataset_time_key(result.time),)
+               for result in index.datasets.search_returning(('time', 'lat', 'lon'), **search_terms))
+
+
+def _range_key(range_):
+    return Range(float(range_.lower), float(range_.upper))
+
+
+def _time_key(time):
+    """
+    Normalise a tile time to a naive UTC numpy.datetime64[ns], for comparison.
+
+    :param time: a time label of an input tile (a datetime, or a numpy.datetime64 day if grouped by
+                 solar day), or the time of an ingested dataset (a timezone-aware datetime)
+    """
+    if isinstance(time, numpy.datetime64):
+        return time.astype('datetime64[ns]')
+    if time.tzinfo is not None:
+        time = time.astimezone(tz.tzutc()).replace(tzinfo=None)
+    return numpy.datetime64(time, 'ns')
+
+
+def _dataset_time_key(time_range):
+    """
+    The time key of an ingested dataset, from its time range.
+
+    Ingested datasets are given the time label of their tile (see make_dataset()) as both
+    the start and end of their range: this is the same key as :func:`_time_key` of that label.
+    """
+    return _time_key(time_range.lower + (time_range.upper - time_range.lower) // 2)
+
+
 def morph_dataset_type(source_type, config):
     output_type = DatasetType(source_type.metadata_type, deepcopy(source_type.definition))
     output_type.definition['name'] = config['output_type']
     output_type.definition['managed'] = True
     output_type.definition['description'] = config['description']
-    output_type.metadata_doc['format'] = {'name': 'NetCDF'}
+    output_type.metadata_doc['format'] = {'name': get_storage_driver(config).format}
 
     output_type.definition['storage'] = {k: v for (k, v) in config['storage'].items()
                                          if k in ('crs', 'tile_size', 'resolution', 'origin')}
@@ -207,32 +294,268 @@ def create_task_list(index, output_type, year, source_type, config):
     return tasks
 
 
+def get_blocks(config, geobox):
+    """
+    Spatial slices of the tile to load and write at a time, when the storage `block_size` is configured.
+
+    Blocks are rounded to a whole number of storage chunks (at least one) along each dimension.
+
+    :rtype: list[tuple[slice]]
+    """
+    chunking = config['storage'].get('chunking', {})
+    block_size = config['storage']['block_size']
+
+    dimension_slices = []
+    for dim, size in zip(geobox.dimensions, geobox.shape):
+        chunk = chunking.get(dim, size)
+        block = max(block_size.get(dim, size) // chunk, 1) * chunk
+        dimension_slices.append([slice(start, min(start + block, size)) for start in range(0, size, block)])
+    return list(itertools.product(*dimension_slices))
+
+
+def _write_blocks(config, tile, measurements, fuse_func, namemap, datasets, file_path,
+                  global_attributes, variable_params):
+    """
+    Fuse and write the tile one spatial block at a time, so memory use is bounded by the block size
+    rather than the tile size.
+    """
+    def empty_func(measurement):
+        # An unallocated, read-only view: only the structure of the storage unit is needed.
+        return numpy.broadcast_to(numpy.array(measurement['nodata'], dtype=measurement['dtype']),
+                                  tile.sources.shape + tile.geobox.shape)
+
+    coords = OrderedDict((dim, tile.sources.coords[dim]) for dim in tile.sources.dims)
+    template = Datacube.create_storage(coords, tile.geobox, measurements, empty_func).rename(namemap)
+    template['dataset'] = datasets_to_doc(datasets)
+
+    # Other tasks may be using the NetCDF library in other threads: it's only used while holding the NETCDF_LOCK.
+    # (Not while loading: NetCDF sources take it themselves as they're read)
+    with NETCDF_LOCK:
+        nco = create_netcdf_storage_unit(file_path, template.crs, template.coords, template.data_vars,
+                                         variable_params, global_attributes)
+    try:
+        with NETCDF_LOCK:
+            nco['dataset'][:] = netcdfy_data(template['dataset'].values)
+
+        for block in get_blocks(config, tile.geobox):
+            data = Datacube.load_data(tile.sources, tile.geobox[block], measurements, fuse_func=fuse_func,
+                                      reproject_threads=1)
+            with NETCDF_LOCK:
+                for name, variable in data.rename(namemap).data_vars.items():
+                    nco[name][(Ellipsis,) + block] = netcdfy_data(variable.values)
+    except Exception:
+        with NETCDF_LOCK:
+            nco.close()
+        # Don't leave an incomplete file behind to block a re-run.
+        file_path.unlink()
+        raise
+    with NETCDF_LOCK:
+        nco.close()
+
+
+def _write_netcdf(config, tile, measurements, fuse_func, namemap, datasets, file_path, global_attributes):
+    """
+    Write the tile to a single NetCDF CF file.
+    """
+    variable_params = get_variable_params(config)
+    if 'block_size' in config['storage']:
+        _write_blocks(config, tile, measurements, fuse_func, namemap, datasets, file_path,
+                      global_attributes, variable_params)
+    else:
+        data = Datacube.load_data(tile.sources, tile.geobox, measurements, fuse_func=fuse_func, reproject_threads=1)
+        nudata = data.rename(namemap)
+        nudata['dataset'] = datasets_to_doc(datasets)
+
+        write_dataset_to_netcdf(nudata, file_path, global_attributes, variable_params)
+
+
+def _single_file_bands(config, file_path):
+    return None
+
+
+def _geotiff_bands(config, file_path):
+    """
+    The file and band number of each measurement: a file per measurement, unless the storage is `multiband`.
+
+    :rtype: dict[str, dict]
+    """
+    names = [spec['name'] for spec in config['measurements']]
+    if config['storage'].get('multiband', False):
+        return {name: {'path': file_path.name, 'layer': number} for number, name in enumerate(names, start=1)}
+    return {name: {'path': file_path.stem + '_' + name + file_path.suffix, 'layer': 1} for name in names}
+
+
+def _geotiff_blockshape(config, geobox):
+    chunking = config['storage'].get('chunking', {})
+    blockshape = tuple(chunking.get(dim, default)
+                       for dim, default in zip(geobox.dimensions, geotiff_writer.DEFAULT_BLOCKSHAPE))
+    if any(size % 16 for size in blockshape):
+        raise ValueError('GeoTIFF chunking must be a multiple of 16: %s' % (blockshape,))
+    return blockshape
+
+
+def _write_geotiff(config, tile, measurements, fuse_func, namemap, datasets, file_path, global_attributes):
+    """
+    Write the tile as Cloud Optimised GeoTIFFs: one per measurement, or a single multi-band file.
+
+    Blocks are fused `write_threads` at a time (and written to the files one at a time), then the files
+    are finalised (overviews built and compressed) `write_threads` at a time.
+    """
+    if tile.sources.shape != (1,):
+        raise ValueError('GeoTIFF storage holds one time per file, tile has %s' % (tile.sources.shape,))
+    storage = config['storage']
+    bands = _geotiff_bands(config, file_path)
+    blockshape = _geotiff_blockshape(config, tile.geobox)
+    compress = storage.get('compress', geotiff_writer.DEFAULT_COMPRESSION)
+    measurements_by_name = {namemap[measurement['name']]: measurement for measurement in measurements}
+
+    units = OrderedDict()
+    try:
+        for name, band in bands.items():
+            if band['path'] in units:
+                continue
+            file_measurements = [measurements_by_name[other] for other, other_band in bands.items()
+                                 if other_band['path'] == band['path']]
+            if len(set((m['dtype'], m.get('nodata')) for m in file_measurements)) > 1:
+                raise ValueError('Measurements of a multiband GeoTIFF must share a dtype and nodata value')
+            units[band['path']] = geotiff_writer.COGStorageUnit(file_path.with_name(band['path']), tile.geobox,
+                                                                count=len(file_measurements),
+                                                                dtype=file_measurements[0]['dtype'],
+                                                                nodata=file_measurements[0].get('nodata'),
+                                                                blockshape=blockshape,
+                                                                compress=compress)
+            units[band['path']].update_tags(**global_attributes)
+
+        if 'block_size' in storage:
+            blocks = get_blocks(config, tile.geobox)
+        else:
+            blocks = [tuple(slice(0, size) for size in tile.geobox.shape)]
+        # (A file being written can't be shared between threads: it's written by one at a time)
+        write_lock = threading.Lock()
+
+        def write_block(block):
+            data = Datacube.load_data(tile.sources, tile.geobox[block], measurements, fuse_func=fuse_func,
+                                      reproject_threads=1)
+            with write_lock:
+                for name, variable in data.rename(namemap).data_vars.items():
+                    units[bands[name]['path']].write(variable.values[0], bands[name]['layer'], window=block)
+
+        def close(unit):
+            unit.close(storage.get('overview_levels', geotiff_writer.DEFAULT_OVERVIEW_LEVELS),
+                       storage.get('overview_resampling', geotiff_writer.DEFAULT_OVERVIEW_RESAMPLING))
+
+        pool = ThreadPool(storage.get('write_threads', 1))
+        try:
+            pool.map(write_block, blocks)
+            pool.map(close, list(units.values()))
+        finally:
+            pool.close()
+    except Exception:
+        # Don't leave incomplete files behind to block a re-run.
+        for unit in units.values():
+            unit.abort()
+        raise
+
+
+def _write_zarr(config, tile, measurements, fuse_func, namemap, datasets, file_path, global_attributes):
+    """
+    Write the tile to a Zarr Storage Unit.
+
+    Blocks are fused and written `write_threads` at a time. They're whole chunks, so concurrent writes never
+    touch the same chunk file.
+    """
+    from datacube.storage.zarr_storage import create_zarr_storage_unit
+
+    storage = config['storage']
+    times = [to_datetime(time_).to_pydatetime() for time_ in tile.sources.time.values]
+    group = create_zarr_storage_unit(file_path, tile.geobox, times,
+                                     [dict(measurement, name=namemap[measurement['name']])
+                                      for measurement in measurements],
+                                     storage.get('chunking', {}), global_attributes, storage.get('compressor'))
+
+    def write_block(block):
+        data = Datacube.load_data(tile.sources, tile.geobox[block], measurements, fuse_func=fuse_func,
+                                  reproject_threads=1)
+        for name, variable in data.rename(namemap).data_vars.items():
+            group[name][(slice(None),) + block] = variable.values
+
+    if 'block_size' in storage:
+        blocks = get_blocks(config, tile.geobox)
+    else:
+        blocks = [tuple(slice(0, size) for size in tile.geobox.shape)]
+    pool = ThreadPool(storage.get('write_threads', 1))
+    try:
+        pool.map(write_block, blocks)
+    except Exception:
+        # Don't leave an incomplete storage unit behind to block a re-run.
+        shutil.rmtree(str(file_path))
+        raise
+    finally:
+        pool.close()
+
+
+#: An ingestion output format.
+#:  - `format`: format name recorded in the output datasets, for reading them back.
+#:  - `write`: writes a tile to storage
+#:  - `bands`: the file and band of each measurement, relative to the tile's filename (None if it's the same file)
+StorageDriver = namedtuple('StorageDriver', ('format', 'write', 'bands'))
+
+#: Output formats, by their `storage.driver` name in the ingest config
+STORAGE_DRIVERS = {
+    'NetCDF CF': StorageDriver('NetCDF', _write_netcdf, _single_file_bands),
+    'GeoTIFF': StorageDriver('GeoTIFF', _write_geotiff, _geotiff_bands),
+    'Zarr': StorageDriver('Zarr', _write_zarr, _single_file_bands),
+}
+
+
+def get_output_files(config, file_path):
+    """
+    The files written for a tile: the tile's filename, or the file of each band if they're separate.
+
+    :param pathlib.Path file_path: filename of the tile (see :func:`get_filename`)
+    :rtype: list[pathlib.Path]
+    """
+    bands = get_storage_driver(config).bands(config, file_path)
+    if not bands:
+        return [file_path]
+    return sorted(set(file_path.with_name(band['path']) for band in bands.values()))
+
+
+def get_storage_driver(config):
+    """
+    :rtype: StorageDriver
+    """
+    name = config['storage'].get('driver', DEFAULT_STORAGE_DRIVER)
+    if name not in STORAGE_DRIVERS:
+        raise ValueError('Unknown storage driver %r: expected one of %s' % (name, ', '.join(sorted(STORAGE_DRIVERS))))
+    return STORAGE_DRIVERS[name]
+
+
 def ingest_work(config, source_type, output_type, tile, tile_index):
     _LOG.info('Starting task %s', tile_index)
+    driver = get_storage_driver(config)
     namemap = get_namemap(config)
     measurements = get_measurements(source_type, config)
-    variable_params = get_variable_params(config)
     global_attributes = config['global_attributes']
-
-    with datacube.set_options(reproject_threads=1):
-        fuse_func = {'copy': None}[config.get(FUSER_KEY, 'copy')]
-        data = Datacube.load_data(tile.sources, tile.geobox, measurements, fuse_func=fuse_func)
-    nudata = data.rename(namemap)
+    fuse_func = {'copy': None}[config.get(FUSER_KEY, 'copy')]
     file_path = get_filename(config, tile_index, tile.sources)
+    bands = driver.bands(config, file_path)
 
     def _make_dataset(labels, sources):
-        return make_dataset(product=output_type,
-                            sources=sources,
-                            extent=tile.geobox.extent,
-                            center_time=labels['time'],
-                            uri=file_path.absolute().as_uri(),
-                            app_info=get_app_metadata(config, config['filename']),
-                            valid_data=GeoPolygon.from_sources_extents(sources, tile.geobox))
+        dataset = make_dataset(product=output_type,
+                               sources=sources,
+                               extent=tile.geobox.extent,
+                               center_time=labels['time'],
+                               uri=file_path.absolute().as_uri(),
+                               app_info=get_app_metadata(config, config['filename']),
+                               valid_data=GeoPolygon.from_sources_extents(sources, tile.geobox))
+        if bands:
+            dataset.metadata_doc['image']['bands'] = deepcopy(bands)
+        return dataset
 
     datasets = xr_apply(tile.sources, _make_dataset, dtype='O')  # Store in Dataarray to associate Time -> Dataset
-    nudata['dataset'] = datasets_to_doc(datasets)
 
-    write_dataset_to_netcdf(nudata, file_path, global_attributes, variable_params)
+    driver.write(config, tile, measurements, fuse_func, namemap, datasets, file_path, global_attributes)
     _LOG.info('Finished task %s', tile_index)
 
     return datasets
@@ -247,6 +570,90 @@ def _index_datasets(index, results, skip_sources):
     return n
 
 
+class _IndexBacklog(object):
+    """
+    Indexes the output datasets of completed tasks on a separate thread, in batches.
+
+    Batches that fail to index are retried, so tiles are never recomputed because of (eg.) a lost
+    database connection. Re-adding datasets is harmless, so a partially-indexed batch can be retried whole.
+    """
+
+    def __init__(self, index, batch_size=100, max_retries=3, retry_delay=5, max_backlog=None):
+        """
+        :param int batch_size: Maximum number of task results to index at once.
+        :param int max_retries: Attempts to index a batch after the first before giving up on its tasks.
+        :param float retry_delay: Seconds to wait before retrying, doubled after each attempt.
+        :param int max_backlog: Block adding results when this many are waiting to be indexed. (default: unlimited)
+        """
+        self._index = index
+        self._batch_size = batch_size
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._backlog = queue.Queue(maxsize=max_backlog or 0)
+
+        self.n_successful = 0
+        self.n_failed = 0
+
+        self._thread = threading.Thread(target=self._run, name='ingest-index-backlog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, results):
+        """
+        Queue task results (arrays of datasets) for indexing.
+        """
+        for datasets in results:
+            self._backlog.put(datasets)
+
+    def __len__(self):
+        return self._backlog.qsize()
+
+    def close(self):
+        """
+        Wait for the backlog to be indexed.
+
+        :return: number of datasets indexed, number of tasks whose datasets failed to index
+        """
+        self._backlog.put(None)
+        self._thread.join()
+        return self.n_successful, self.n_failed
+
+    def _next_batch(self):
+        batch = [self._backlog.get()]
+        while batch[-1] is not None and len(batch) < self._batch_size:
+            try:
+                batch.append(self._backlog.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        finished = False
+        while not finished:
+            batch = self._next_batch()
+            if batch[-1] is None:
+                finished = True
+                batch.pop()
+            if batch:
+                self._index_batch(batch)
+
+    def _index_batch(self, batch):
+        delay = self._retry_delay
+        for attempt in range(self._max_retries + 1):
+            try:
+                self.n_successful += _index_datasets(self._index, batch, skip_sources=True)
+                _LOG.info('Indexed results of %s tasks, %s waiting', len(batch), len(self))
+                return
+            except Exception:  # pylint: disable=broad-except
+                if attempt == self._max_retries:
+                    _LOG.exception('Indexing failed, giving up on %s tasks', len(batch))
+                    self.n_failed += len(batch)
+                    return
+                _LOG.exception('Indexing failed, retrying %s tasks in %ss', len(batch), delay)
+                time.sleep(delay)
+                delay *= 2
+
+
 def process_tasks(index, config, source_type, output_type, tasks, queue_size, executor):
     def submit_task(task):
         _LOG.info('Submitting task: %s', task['tile_index'])
@@ -256,39 +663,46 @@ def process_tasks(index, config, source_type, output_type, tasks, queue_size, ex
                                output_type=output_type,
                                **task)
 
-    pending = []
-    n_successful = n_failed = 0
+    completions = executor.completion_queue()
+    n_failed = 0
+    backlog = _IndexBacklog(index, max_backlog=queue_size)
 
     tasks = iter(tasks)
-    while True:
-        pending += [submit_task(task) for task in itertools.islice(tasks, max(0, queue_size-len(pending)))]
-        if not pending:
-            break
-
-        completed, failed, pending = executor.get_ready(pending)
-        _LOG.info('completed %s, failed %s, pending %s', len(completed), len(failed), len(pending))
+    try:
+        while True:
+            for task in itertools.islice(tasks, max(0, queue_size - len(completions))):
+                completions.add(submit_task(task))
+            if not completions:
+                break
+
+            # Blocks until at least one task finishes, then takes all those that have.
+            completed, failed, pending = executor.get_ready(completions.wait())
+            for future in pending:
+                completions.add(future)
+            _LOG.info('completed %s, failed %s, pending %s, indexing %s',
+                      len(completed), len(failed), len(completions), len(backlog))
+
+            for future in failed:
+                try:
+                    executor.result(future)
+                except Exception:  # pylint: disable=broad-except
+                    _LOG.exception('Task failed')
+                    n_failed += 1
+
+            if not completed:
+                continue
 
-        for future in failed:
             try:
-                executor.result(future)
+                # Indexing happens in the background, so we can go straight back to filling the queue.
+                backlog.add(executor.results(completed))
             except Exception:  # pylint: disable=broad-except
-                _LOG.exception('Task failed')
-                n_failed += 1
-
-        if not completed:
-            time.sleep(1)
-            continue
-
-        try:
-            # TODO: ideally we wouldn't block here indefinitely
-            # maybe limit gather to 50-100 results and put the rest into a index backlog
-            # this will also keep the queue full
-            n_successful += _index_datasets(index, executor.results(completed), skip_sources=True)
-        except Exception:  # pylint: disable=broad-except
-            _LOG.exception('Gather failed')
-            pending += completed
+                _LOG.exception('Gather failed')
+                for future in completed:
+                    completions.add(future)
+    finally:
+        n_successful, n_index_failed = backlog.close()
 
-    return n_successful, n_failed
+    return n_successful, n_failed + n_index_failed
 
 
 def _validate_year(ctx, param, value):
@@ -314,24 +728,28 @@ def _validate_year(ctx, param, value):
               type=click.Path(exists=False))
 @click.option('--load-tasks', help='Load tasks from the specified file',
               type=click.Path(exists=True, readable=True, writable=False, dir_okay=False))
+@task_shard_option
 @click.option('--dry-run', '-d', is_flag=True, default=False, help='Check if everything is ok')
 @ui.executor_cli_options
 @ui.pass_index(app_name='agdc-ingest')
-def ingest_cmd(index, config_file, year, queue_size, save_tasks, load_tasks, dry_run, executor):
+def ingest_cmd(index, config_file, year, queue_size, save_tasks, load_tasks, task_shard, dry_run, executor):
     if config_file:
         config = load_config_from_file(index, config_file)
         source_type, output_type = make_output_type(index, config)
 
         tasks = create_task_list(index, output_type, year, source_type, config)
     elif load_tasks:
-        config, tasks = load_tasks_(load_tasks)
+        config, tasks = load_tasks_(load_tasks, *(task_shard or ()))
         source_type, output_type = make_output_type(index, config)
     else:
         click.echo('Must specify exactly one of --config-file, --load-tasks')
         return 1
 
     if dry_run:
-        check_existing_files(get_filename(config, task['tile_index'], task['tile'].sources) for task in tasks)
+        check_existing_files(path
+                             for task in tasks
+                             for path in get_output_files(config, get_filename(config, task['tile_index'],
+                                                                               task['tile'].sources)))
         return 0
 
     if save_tasks:
@@ -340,4 +758,6 @@ def ingest_cmd(index, config_file, year, queue_size, save_tasks, load_tasks, dry
 
     successful, failed = process_tasks(index, config, source_type, output_type, tasks, queue_size, executor)
     click.echo('%d successful, %d failed' % (successful, failed))
+    if isinstance(executor, InstrumentedExecutor):
+        click.echo(executor.close())
     return 0
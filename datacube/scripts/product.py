@@ -9,6 +9,7 @@ from click import echo
 
 from datacube import Datacube
 from datacube.index._api import Index
+from datacube.index.exceptions import IndexSetupError
 from datacube.ui import click as ui
 from datacube.ui.click import cli
 from datacube.utils import read_documents, InvalidDocException
@@ -132,3 +133,35 @@ def show_product(index, product_name):
     """
     product_def = index.products.get_by_name(product_name)
     click.echo_via_pager(json.dumps(product_def.definition, indent=4))
+
+
+@product.command('index-cells')
+@click.argument('product_names', nargs=-1)
+@ui.pass_index()
+def index_cells(index, product_names):
+    """
+    Record the grid cells of existing datasets in the index
+
+    Cells are recorded as datasets are added, but datasets indexed by older versions
+    need this before GridWorkflow can look them up by cell. Applies to all products
+    with a grid if none are named.
+    """
+    if product_names:
+        products = []
+        for name in product_names:
+            product_ = index.products.get_by_name(name)
+            if product_ is None:
+                raise click.BadParameter('Unknown product: %s' % name)
+            products.append(product_)
+    else:
+        products = [product_ for product_ in index.products.get_all()
+                    if product_.grid_spec is not None and product_.grid_spec.tile_size is not None]
+
+    for product_ in products:
+        try:
+            count = index.datasets.add_missing_cells(product_)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        except IndexSetupError as e:
+            raise click.ClickException(str(e))
+        echo('Recorded cells of %s datasets of "%s"' % (count, product_.name))
@@ -0,0 +1,143 @@
+# coding=utf-8
+"""
+Create Cloud Optimised GeoTIFF (COG) Storage Units and write data to them
+
+A COG is a tiled, compressed GeoTIFF with internal overviews, laid out so that a window
+(or an overview) can be read with few requests.
+
+Data is first written to an uncompressed, tiled temporary file next to the output. Its overviews are
+then built, and it is copied into the final COG layout.
+"""
+from __future__ import absolute_import
+
+import logging
+
+import rasterio
+
+try:
+    from rasterio.shutil import copy as _rasterio_copy
+except ImportError:
+    _rasterio_copy = None
+
+_LOG = logging.getLogger(__name__)
+
+DEFAULT_BLOCKSHAPE = (512, 512)
+DEFAULT_COMPRESSION = 'deflate'
+DEFAULT_OVERVIEW_LEVELS = (2, 4, 8, 16, 32)
+DEFAULT_OVERVIEW_RESAMPLING = 'nearest'
+
+
+class COGStorageUnit(object):
+    """
+    A COG being written.
+
+    Write the bands with :meth:`write` (whole, or a window at a time), then :meth:`close` to build
+    the overviews and create the file. Use :meth:`abort` to discard it instead.
+    """
+
+    def __init__(self, filename, geobox, count, dtype, nodata=None,
+                 blockshape=DEFAULT_BLOCKSHAPE, compress=DEFAULT_COMPRESSION):
+        """
+        :param pathlib.Path filename: filename to write to
+        :param datacube.utils.geometry.GeoBox geobox: spatial extent and resolution of the bands
+        :param int count: number of bands
+        :param str dtype: data type of the bands
+        :param nodata: nodata value of the bands, if any
+        :param (int,int) blockshape: (height, width) of the internal tiles, in pixels. Multiples of 16.
+        :param str compress: GDAL compression method, eg. 'deflate' or 'lzw'
+        """
+        if filename.exists():
+            raise RuntimeError('Storage Unit already exists: %s' % filename)
+        if not filename.parent.exists():
+            filename.parent.mkdir(parents=True)
+
+        self.filename = filename
+        self.blockshape = tuple(blockshape)
+        self.compress = compress
+        self._temp_filename = filename.with_name('.' + filename.name + '.tmp')
+
+        height, width = geobox.shape
+        self._dataset = rasterio.open(str(self._temp_filename), 'w',
+                                      driver='GTiff',
+                                      width=width,
+                                      height=height,
+                                      count=count,
+                                      dtype=dtype,
+                                      nodata=nodata,
+                                      crs=geobox.crs.crs_str,
+                                      transform=geobox.affine,
+                                      tiled=True,
+                                      blockysize=self.blockshape[0],
+                                      blockxsize=self.blockshape[1])
+
+    def write(self, data, band=1, window=None):
+        """
+        Write data to a band.
+
+        :param numpy.ndarray data: 2D array of the band, or of the window
+        :param int band: band number, starting from 1
+        :param tuple[slice] window: (y, x) slices of the band to write, if not the whole band
+        """
+        if window is not None:
+            height, width = self._dataset.shape
+            window = tuple(dim_slice.indices(size)[:2] for dim_slice, size in zip(window, (height, width)))
+        self._dataset.write(data, band, window=window)
+
+    def update_tags(self, **tags):
+        """
+        Set file metadata tags.
+        """
+        self._dataset.update_tags(**{key: str(value) for key, value in tags.items()})
+
+    def close(self, overview_levels=DEFAULT_OVERVIEW_LEVELS, overview_resampling=DEFAULT_OVERVIEW_RESAMPLING):
+        """
+        Build overviews and create the COG.
+
+        :param list[int] overview_levels: decimation factors of the overviews. Those that would be smaller than
+                                          a pixel are skipped.
+        :param str overview_resampling: resampling method for the overviews, eg. 'nearest' or 'average'
+        """
+        from datacube.storage.storage import RESAMPLING_METHODS
+
+        try:
+            levels = [level for level in overview_levels if level < max(self._dataset.shape)]
+            if levels:
+                self._dataset.build_overviews(levels, RESAMPLING_METHODS[overview_resampling])
+                self._dataset.update_tags(ns='rio_overview', resampling=overview_resampling)
+            self._dataset.close()
+
+            _copy_as_cog(self._temp_filename, self.filename, self.blockshape, self.compress)
+        except Exception:
+            self.abort()
+            raise
+        self._temp_filename.unlink()
+        _LOG.debug('Created %s with overviews %s', self.filename, levels)
+
+    def abort(self):
+        """
+        Discard the file.
+        """
+        if not self._dataset.closed:
+            self._dataset.close()
+        for filename in (self._temp_filename, self.filename):
+            if filename.exists():
+                filename.unlink()
+
+
+def _copy_as_cog(source, destination, blockshape, compress):
+    """
+    Copy a tiled GeoTIFF with overviews into COG layout: overviews first, then the tiles of each.
+    """
+    blockysize, blockxsize = blockshape
+    if _rasterio_copy is not None:
+        _rasterio_copy(str(source), str(destination), driver='GTiff', tiled=True,
+                       blockxsize=blockxsize, blockysize=blockysize, compress=compress, copy_src_overviews=True)
+        return
+
+    # (rasterio < 1.0)
+    from osgeo import gdal
+    gdal.GetDriverByName('GTiff').CreateCopy(
+        str(destination), gdal.Open(str(source)),
+        options=['TILED=YES', 'BLOCKXSIZE=%d' % blockxsize, 'BLOCKYSIZE=%d' % blockysize,
+                 'COMPRESS=%s' % compress.upper(), 'COPY_SRC_OVERVIEWS=YES']
+    )
@@ -2,10 +2,18 @@
 Tools for masking data based on a bit-mask variable with attached definition.
 
 The main functions are `make_mask(variable)` `describe_flags(variable)`
+
+Masks of 8 and 16 bit variables are made with a lookup table of every value of the variable, so a mask of any
+combination of flags takes a single pass over the data.
 """
 import collections
+import functools
+import operator
 import warnings
 
+import dask.array as da
+import numpy
+
 from datacube.utils import generate_table
 
 from xarray import DataArray, Dataset
@@ -90,11 +98,113 @@ def make_mask(variable, **flags):
     :param flags: list of boolean flags
     :return: boolean xarray.DataArray or xarray.Dataset
     """
+    return make_any_mask(variable, [flags])
+
+
+def make_any_mask(variable, flag_sets, packed=False):
+    """
+    Returns a mask array, of where any of several sets of flags match
+
+    The flags in each set are combined in a logical AND fashion, as in `make_mask`, and the sets in a
+    logical OR fashion.
+
+    For example, pixels that are either clear, or are water:
+
+    make_any_mask(pqa, [dict(cloud_acca='no_cloud', cloud_fmask='no_cloud'), dict(land_sea='sea')])
+
+    Dask-backed variables are masked block by block, lazily.
+
+    :param variable:
+    :type variable: xarray.Dataset or xarray.DataArray
+    :param list[dict] flag_sets: sets of flags
+    :param bool packed: Return the mask packed 8 pixels to a byte along the last dimension (see `unpack_mask`),
+                        for an eighth of the memory.
+    :return: boolean (or packed uint8) xarray.DataArray or xarray.Dataset
+    """
     flags_def = get_flags_def(variable)
 
-    mask, mask_value = create_mask_value(flags_def, **flags)
+    if isinstance(variable, DataArray) and _has_mask_table(variable.dtype):
+        table = make_mask_table(flags_def, flag_sets, variable.dtype)
+        mask = DataArray(_lookup(variable.data, table), coords=variable.coords, dims=variable.dims,
+                         name=variable.name)
+    else:
+        mask_values = [create_mask_value(flags_def, **flags) for flags in flag_sets]
+        mask = functools.reduce(operator.or_, (variable & mask == mask_value for mask, mask_value in mask_values))
+
+    if packed:
+        return mask.apply(pack_mask) if isinstance(mask, Dataset) else pack_mask(mask)
+    return mask
+
+
+def make_mask_table(flags_def, flag_sets, dtype):
+    """
+    Returns a lookup table, of whether each value of an 8 or 16 bit variable matches any of several sets of flags
+
+    :param dict flags_def: flags definition of the variable
+    :param list[dict] flag_sets: sets of flags, as for `make_any_mask`
+    :param numpy.dtype dtype: type of the variable
+    :return: boolean numpy array, indexed by the value of the variable (viewed as unsigned)
+    """
+    values = numpy.arange(2 ** (8 * numpy.dtype(dtype).itemsize), dtype=_table_index_type(dtype))
+    table = numpy.zeros(values.shape, dtype=bool)
+    for flags in flag_sets:
+        mask, mask_value = create_mask_value(flags_def, **flags)
+        table |= values & mask == mask_value
+    return table
 
-    return variable & mask == mask_value
+
+def _has_mask_table(dtype):
+    return dtype.kind in 'iu' and dtype.itemsize <= 2
+
+
+def _table_index_type(dtype):
+    return numpy.dtype('u%d' % numpy.dtype(dtype).itemsize)
+
+
+def _lookup(data, table):
+    """
+    Look up each value of a numpy or dask array in a table
+    """
+    def lookup(block):
+        return table.take(block.view(_table_index_type(block.dtype)))
+
+    if isinstance(data, da.Array):
+        return data.map_blocks(lookup, dtype=table.dtype)
+    return lookup(numpy.asarray(data))
+
+
+def pack_mask(mask):
+    """
+    Pack a boolean mask into bits, 8 pixels to a byte along its last dimension
+
+    :param xarray.DataArray mask:
+    :return: uint8 xarray.DataArray, without coordinates along the last dimension
+    """
+    data = mask.data
+    if isinstance(data, da.Array):
+        # Every block but the last needs a multiple of 8 pixels
+        last_axis = data.ndim - 1
+        if any(size % 8 for size in data.chunks[-1][:-1]):
+            data = data.rechunk({last_axis: max(8, data.chunks[-1][0] // 8 * 8)})
+        packed = data.map_blocks(numpy.packbits, axis=last_axis, dtype=numpy.uint8,
+                                 chunks=data.chunks[:-1] + (tuple((size + 7) // 8 for size in data.chunks[-1]),))
+    else:
+        packed = numpy.packbits(data, axis=-1)
+    last_dim = mask.dims[-1]
+    coords = dict((name, coord) for name, coord in mask.coords.items() if last_dim not in coord.dims)
+    return DataArray(packed, coords=coords, dims=mask.dims, name=mask.name)
+
+
+def unpack_mask(packed, like):
+    """
+    Unpack a mask packed by `pack_mask`
+
+    :param xarray.DataArray packed: packed mask
+    :param xarray.DataArray like: array of the shape and coordinates of the mask
+    :return: boolean xarray.DataArray
+    """
+    data = numpy.unpackbits(numpy.asarray(packed), axis=-1)[..., :like.shape[-1]].astype(bool)
+    return DataArray(data, coords=like.coords, dims=like.dims, name=packed.name)
 
 
 def valid_data_mask(data):
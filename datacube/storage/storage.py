@@ -6,9 +6,12 @@ from __future__ import absolute_import, division, print_function
 
 import logging
 import math
+import threading
 from contextlib import contextmanager
 from pathlib import Path
 
+import dask.array as da
+
 from datacube.compat import urlparse, urljoin, url_parse_module
 from datacube.config import OPTIONS
 from datacube.model import Dataset
@@ -35,6 +38,11 @@ except ImportError:
 
 _LOG = logging.getLogger(__name__)
 
+#: Held while using the NetCDF (and HDF) libraries, which aren't thread safe. It's shared by every thread of the
+#: process, such as concurrent tasks of a threads executor: NetCDF and HDF sources hold it while they're read, and
+#: writers of NetCDF files should hold it for each call to the library. (Re-entrant, so a writer can also read)
+NETCDF_LOCK = threading.RLock()
+
 RESAMPLING_METHODS = {
     'nearest': Resampling.nearest,
     'cubic': Resampling.cubic,
@@ -125,13 +133,34 @@ def _no_fractional_translate(affine, eps=0.01):
     return abs(affine.c % 1.0) < eps and abs(affine.f % 1.0) < eps
 
 
-def read_from_source(source, dest, dst_transform, dst_nodata, dst_projection, resampling):
+def _scale_into(dest, src, where, scale_offset):
+    """
+    Write ``src * scale + offset`` into `dest`, computing in the type of `dest`.
+    """
+    scale, offset = scale_offset
+    numpy.multiply(src, scale, out=dest, where=where, dtype=dest.dtype, casting='unsafe')
+    numpy.add(dest, offset, out=dest, where=where, dtype=dest.dtype, casting='unsafe')
+
+
+def _is_nan(value):
+    return value != value
+
+
+def read_from_source(source, dest, dst_transform, dst_nodata, dst_projection, resampling, scale_offset=None,
+                     reproject_threads=None):
     """
     Read from `source` into `dest`, reprojecting if necessary.
 
+    Values are converted to the type of `dest` as they are read, and nodata pixels are set to `dst_nodata`
+    (which can be NaN).
+
     :param BaseRasterDataSource source: Data source
     :param numpy.ndarray dest: Data destination
+    :param (float,float) scale_offset: (scale, offset) to apply to the valid data values, if any
+    :param int reproject_threads: number of threads GDAL uses to reproject (default: `OPTIONS['reproject_threads']`)
     """
+    if reproject_threads is None:
+        reproject_threads = OPTIONS['reproject_threads']
     with source.open() as src:
         array_transform = ~src.transform * dst_transform
         # if the CRS is the same use decimated reads if possible (NN or 1:1 scaling)
@@ -142,7 +171,10 @@ def read_from_source(source, dest, dst_transform, dst_nodata, dst_projection, re
             if tmp is None:
                 return
             dest = dest[offset[0]:offset[0] + tmp.shape[0], offset[1]:offset[1] + tmp.shape[1]]
-            numpy.copyto(dest, tmp, where=(tmp != src.nodata))
+            if scale_offset is None:
+                numpy.copyto(dest, tmp, where=(tmp != src.nodata))
+            else:
+                _scale_into(dest, tmp, tmp != src.nodata, scale_offset)
         else:
             if dest.dtype == numpy.dtype('int8'):
                 dest = dest.view(dtype='uint8')
@@ -152,7 +184,10 @@ def read_from_source(source, dest, dst_transform, dst_nodata, dst_projection, re
                           dst_crs=str(dst_projection),
                           dst_nodata=dst_nodata,
                           resampling=resampling,
-                          NUM_THREADS=OPTIONS['reproject_threads'])
+                          NUM_THREADS=reproject_threads)
+            if scale_offset is not None:
+                # (NaN nodata stays NaN)
+                _scale_into(dest, dest, True if _is_nan(dst_nodata) else dest != dst_nodata, scale_offset)
 
 
 @contextmanager
@@ -168,7 +203,8 @@ def ignore_exceptions_if(ignore_errors):
 
 
 def reproject_and_fuse(sources, destination, dst_transform, dst_projection, dst_nodata,
-                       resampling='nearest', fuse_func=None, skip_broken_datasets=False):
+                       resampling='nearest', fuse_func=None, skip_broken_datasets=False, scale_offset=None,
+                       reproject_threads=None):
     """
     Reproject and fuse `sources` into a 2D numpy array `destination`.
 
@@ -177,6 +213,8 @@ def reproject_and_fuse(sources, destination, dst_transform, dst_projection, dst_
     :type resampling: str
     :type fuse_func: callable or None
     :param bool skip_broken_datasets: Carry on in the face of adversity and failing reads.
+    :param (float,float) scale_offset: (scale, offset) to apply to the data values as they are read, if any
+    :param int reproject_threads: number of threads GDAL uses to reproject (default: `OPTIONS['reproject_threads']`)
     """
     assert len(destination.shape) == 2
 
@@ -187,7 +225,7 @@ def reproject_and_fuse(sources, destination, dst_transform, dst_projection, dst_
         :type dest: numpy.ndarray
         :type src: numpy.ndarray
         """
-        numpy.copyto(dest, src, where=(dest == dst_nodata))
+        numpy.copyto(dest, src, where=(numpy.isnan(dest) if _is_nan(dst_nodata) else dest == dst_nodata))
 
     fuse_func = fuse_func or copyto_fuser
 
@@ -196,14 +234,16 @@ def reproject_and_fuse(sources, destination, dst_transform, dst_projection, dst_
         return destination
     elif len(sources) == 1:
         with ignore_exceptions_if(skip_broken_datasets):
-            read_from_source(sources[0], destination, dst_transform, dst_nodata, dst_projection, resampling)
+            read_from_source(sources[0], destination, dst_transform, dst_nodata, dst_projection, resampling,
+                             scale_offset, reproject_threads)
         return destination
     else:
         # Muitiple sources, we need to fuse them together into a single array
         buffer_ = numpy.empty(destination.shape, dtype=destination.dtype)
         for source in sources:
             with ignore_exceptions_if(skip_broken_datasets):
-                read_from_source(source, buffer_, dst_transform, dst_nodata, dst_projection, resampling)
+                read_from_source(source, buffer_, dst_transform, dst_nodata, dst_projection, resampling,
+                                 scale_offset, reproject_threads)
                 fuse_func(destination, buffer_)
 
         return destination
@@ -380,7 +420,7 @@ class BaseRasterDataSource(object):
         """Context manager which returns a `BandDataSource`"""
         try:
             _LOG.debug("opening %s", self.filename)
-            with rasterio.open(self.filename) as src:
+            with _library_lock(self.filename), rasterio.open(self.filename) as src:
                 override = False
 
                 transform = _rasterio_transform(src)
@@ -416,6 +456,16 @@ class BaseRasterDataSource(object):
             raise e
 
 
+@contextmanager
+def _library_lock(filename):
+    """Hold the :data:`NETCDF_LOCK` while using a NetCDF or HDF file (opened as eg. ``NetCDF:path:variable``)"""
+    if str(filename).lower().startswith(('netcdf:', 'hdf')):
+        with NETCDF_LOCK:
+            yield
+    else:
+        yield
+
+
 class RasterFileDataSource(BaseRasterDataSource):
     def __init__(self, filename, bandnumber, nodata=None, crs=None, transform=None):
         super(RasterFileDataSource, self).__init__(filename, nodata)
@@ -576,6 +626,20 @@ class DatasetSource(BaseRasterDataSource):
         return self._dataset.crs
 
 
+def new_datasource(dataset, measurement_id):
+    """
+    A data source for reading a measurement of a dataset, suited to the dataset's format.
+
+    :param Dataset dataset: dataset to read from
+    :param str measurement_id: measurement to read
+    :rtype: BaseRasterDataSource
+    """
+    if dataset.format.lower() == 'zarr':
+        from datacube.storage.zarr_storage import ZarrDataSource
+        return ZarrDataSource(dataset, measurement_id)
+    return DatasetSource(dataset, measurement_id)
+
+
 def create_netcdf_storage_unit(filename,
                                crs, coordinates, variables, variable_params, global_attributes=None,
                                netcdfparams=None):
@@ -625,12 +689,16 @@ def create_netcdf_storage_unit(filename,
 
 
 def write_dataset_to_netcdf(dataset, filename, global_attributes=None, variable_params=None,
-                            netcdfparams=None):
+                            netcdfparams=None, progress=None):
     """
     Write a Data Cube style xarray Dataset to a NetCDF file
 
     Requires a spatial Dataset, with attached coordinates and global crs attribute.
 
+    Variables backed by dask arrays are computed and written block by block, with blocks aligned
+    to the NetCDF chunks. Blocks may be computed in parallel (by the dask scheduler), but only one
+    is written at a time, holding the :data:`NETCDF_LOCK`.
+
     :param `xarray.Dataset` dataset:
     :param filename: Output filename
     :param global_attributes: Global file attributes. dict of attr_name: attr_value
@@ -639,6 +707,8 @@ def write_dataset_to_netcdf(dataset, filename, global_attributes=None, variable_
                             See the `netCDF4.Dataset.createVariable` for available
                             parameters.
     :param netcdfparams: Optional params affecting netCDF file creation
+    :param progress: Optional function called as blocks are written, with the number of blocks written so far and
+                     the total number of blocks
     """
     global_attributes = global_attributes or {}
     variable_params = variable_params or {}
@@ -650,15 +720,93 @@ def write_dataset_to_netcdf(dataset, filename, global_attributes=None, variable_
     if not hasattr(dataset, 'crs'):
         raise DatacubeException('Dataset does not contain CRS, cannot write to NetCDF file.')
 
-    nco = create_netcdf_storage_unit(filename,
-                                     dataset.crs,
-                                     dataset.coords,
-                                     dataset.data_vars,
-                                     variable_params,
-                                     global_attributes,
-                                     netcdfparams)
-
+    # (The lock isn't held while computing blocks: their sources may be NetCDF files read by dask's threads)
+    with NETCDF_LOCK:
+        nco = create_netcdf_storage_unit(filename,
+                                         dataset.crs,
+                                         dataset.coords,
+                                         dataset.data_vars,
+                                         variable_params,
+                                         global_attributes,
+                                         netcdfparams)
+
+    sources, targets = [], []
     for name, variable in dataset.data_vars.items():
-        nco[name][:] = netcdf_writer.netcdfy_data(variable.values)
+        if isinstance(variable.data, da.Array) and not _is_char_array(variable.data):
+            with NETCDF_LOCK:
+                chunking = nco[name].chunking()
+            sources.append(align_to_chunking(variable.data, chunking))
+            targets.append(nco[name])
+        else:
+            data = netcdf_writer.netcdfy_data(variable.values)
+            with NETCDF_LOCK:
+                nco[name][:] = data
+
+    if sources:
+        writer = _BlockWriter(sum(source.npartitions for source in sources), progress)
+        da.store(sources, [writer.target(target) for target in targets], lock=False)
+
+    with NETCDF_LOCK:
+        nco.close()
+
+
+def _is_char_array(data):
+    # Stored as an extra character dimension: not written in blocks.
+    return data.dtype.kind == 'S' and data.dtype.itemsize > 1
+
+
+def align_to_chunking(data, chunking):
+    """
+    Rechunk a dask array so each block covers whole storage chunks (except at the array edges)
+
+    :param dask.array.Array data:
+    :param chunking: storage (eg. NetCDF or GeoTIFF) chunk size of each dimension, or 'contiguous'
+    :rtype: dask.array.Array
+    """
+    if not isinstance(chunking, (list, tuple)):
+        return data
+
+    def aligned(dim_chunks, chunk_size):
+        if all(size % chunk_size == 0 for size in dim_chunks[:-1]):
+            return dim_chunks
+        # The largest multiple of the storage chunk no bigger than the current blocks.
+        return max(chunk_size, max(dim_chunks) // chunk_size * chunk_size)
+
+    return data.rechunk(tuple(aligned(dim_chunks, chunk_size)
+                              for dim_chunks, chunk_size in zip(data.chunks, chunking)))
+
+
+class _BlockWriter(object):
+    """
+    Serialises the writing of computed blocks to NetCDF variables, counting them as they're written.
+    """
+
+    def __init__(self, total_blocks, progress=None):
+        self.total_blocks = total_blocks
+        self.blocks_written = 0
+        self._progress = progress
+        self._lock = NETCDF_LOCK
+
+    def target(self, variable):
+        """
+        A :func:`dask.array.store` target that writes to the variable.
+        """
+        return _BlockTarget(self, variable)
+
+    def write(self, variable, index, block):
+        block = netcdf_writer.netcdfy_data(block)
+        with self._lock:
+            variable[index] = block
+            self.blocks_written += 1
+            _LOG.debug('Wrote block %s of %s', self.blocks_written, self.total_blocks)
+            if self._progress is not None:
+                self._progress(self.blocks_written, self.total_blocks)
+
+
+class _BlockTarget(object):
+    def __init__(self, writer, variable):
+        self._writer = writer
+        self._variable = variable
 
-    nco.close()
+    def __setitem__(self, index, block):
+        self._writer.write(self._variable, index, block)
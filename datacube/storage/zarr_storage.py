@@ -0,0 +1,209 @@
+# coding=utf-8
+"""
+Create Zarr Storage Units and read data from them
+
+A Zarr Storage Unit is a directory holding a Zarr group. Each array is stored as separately compressed chunk
+files, so chunks can be written concurrently by many workers, and reads only fetch the chunks they touch.
+
+Layout of the group:
+
+    - attributes: ``crs`` (WKT), ``transform`` (affine coefficients of the spatial grid), and any global attributes
+    - ``time``: seconds since 1970 of each time slice
+    - a coordinate array for each spatial dimension
+    - a ``(time, y, x)`` array for each measurement, filled with its ``nodata`` value
+"""
+from __future__ import absolute_import, division
+
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy
+import rasterio.warp
+import zarr
+from affine import Affine
+from numcodecs import Blosc
+
+from datacube.storage.storage import BaseRasterDataSource, _choose_location, _resolve_url
+from datacube.utils import datetime_to_seconds_since_1970, geometry, uri_to_local_path
+
+_LOG = logging.getLogger(__name__)
+
+#: Compression of the chunks, when not specified
+DEFAULT_COMPRESSOR = {'cname': 'lz4', 'clevel': 5, 'shuffle': Blosc.SHUFFLE}
+
+_TIME_UNITS = 'seconds since 1970-01-01 00:00:00'
+
+
+def create_zarr_storage_unit(path, geobox, times, measurements, chunking, global_attributes=None, compressor=None):
+    """
+    Create a Zarr Storage Unit on disk, with every measurement filled with nodata.
+
+    :param pathlib.Path path: directory to create
+    :param datacube.utils.geometry.GeoBox geobox: spatial extent and resolution of the measurements
+    :param list[datetime.datetime] times: times of the time slices
+    :param list[dict] measurements: measurement definitions, with `name`, `dtype` and `nodata`
+    :param dict chunking: chunk size of each dimension. Defaults to a chunk per time slice, and the whole extent.
+    :param dict global_attributes: named attributes of the group
+    :param dict compressor: Blosc compression parameters, eg. ``{'cname': 'zstd', 'clevel': 3}``
+    :return: the open zarr group, ready for writing to
+    :rtype: zarr.hierarchy.Group
+    """
+    path = Path(path)
+    if path.exists():
+        raise RuntimeError('Storage Unit already exists: %s' % path)
+    if not path.parent.exists():
+        path.parent.mkdir(parents=True)
+
+    _LOG.info('Creating storage unit: %s', path)
+
+    group = zarr.open_group(str(path), mode='w-')
+    group.attrs.update(global_attributes or {})
+    group.attrs.update(crs=geobox.crs.wkt, transform=list(geobox.affine)[:6])
+
+    time = group.create_dataset('time', data=numpy.array([datetime_to_seconds_since_1970(t) for t in times],
+                                                         dtype='float64'))
+    time.attrs.update(_ARRAY_DIMENSIONS=['time'], units=_TIME_UNITS)
+    for dim, coord in geobox.coordinates.items():
+        coord_array = group.create_dataset(dim, data=coord.values)
+        coord_array.attrs.update(_ARRAY_DIMENSIONS=[dim], units=coord.units)
+
+    dims = ('time',) + geobox.dimensions
+    shape = (len(times),) + geobox.shape
+    chunks = tuple(chunking.get(dim, 1 if dim == 'time' else size) for dim, size in zip(dims, shape))
+    blosc = Blosc(**dict(DEFAULT_COMPRESSOR, **(compressor or {})))
+    for measurement in measurements:
+        array = group.create_dataset(measurement['name'], shape=shape, chunks=chunks, dtype=measurement['dtype'],
+                                     fill_value=measurement['nodata'], compressor=blosc)
+        array.attrs.update(_ARRAY_DIMENSIONS=list(dims), nodata=measurement['nodata'],
+                           units=measurement.get('units', '1'))
+    return group
+
+
+class ZarrBandDataSource(object):
+    """
+    A time slice of a measurement array in a Zarr Storage Unit
+
+    Reads only fetch the chunks covering the window read.
+    """
+    def __init__(self, array, time_index, nodata, crs, transform):
+        """
+        :param zarr.core.Array array: (time, y, x) measurement array
+        :param int time_index: time slice to read
+        :param nodata: nodata value of the array
+        :param datacube.utils.geometry.CRS crs: spatial projection of the array
+        :param affine.Affine transform: pixel to crs coordinates transform
+        """
+        self.array = array
+        self.time_index = time_index
+        self.nodata = nodata
+        self.crs = crs
+        self.transform = transform
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    @property
+    def shape(self):
+        return self.array.shape[1:]
+
+    def read(self, window=None, out_shape=None):
+        """
+        Read data in the native format, returning a native array
+
+        :param window: ((row_start, row_stop), (col_start, col_stop)) to read, if not the whole slice
+        :param out_shape: shape to decimate the window to, by nearest neighbour (the same pixels as GDAL)
+        """
+        if window is None:
+            window = ((0, self.shape[0]), (0, self.shape[1]))
+        data_shape = tuple(stop - start for start, stop in window)
+        if out_shape is None or tuple(out_shape) == data_shape:
+            return self.array[(self.time_index,) + tuple(slice(start, stop) for start, stop in window)]
+
+        indexes = tuple(start + numpy.floor((numpy.arange(out_size) + 0.5) * (data_size / out_size)).astype('int')
+                        for (start, _), data_size, out_size in zip(window, data_shape, out_shape))
+        return self.array.get_orthogonal_selection((self.time_index,) + indexes)
+
+    def reproject(self, dest, dst_transform, dst_crs, dst_nodata, resampling, **kwargs):
+        window = self._covering_window(dest.shape, dst_transform, dst_crs)
+        if window is None:
+            return dest
+        (row_start, _), (col_start, _) = window
+        return rasterio.warp.reproject(self.read(window),
+                                       dest,
+                                       src_transform=self.transform * Affine.translation(col_start, row_start),
+                                       src_crs=str(self.crs),
+                                       src_nodata=self.nodata,
+                                       dst_transform=dst_transform,
+                                       dst_crs=str(dst_crs),
+                                       dst_nodata=dst_nodata,
+                                       resampling=resampling,
+                                       **kwargs)
+
+    def _covering_window(self, dst_shape, dst_transform, dst_crs, padding=2):
+        """
+        The window of the array covering the destination, or None if they don't overlap.
+        """
+        height, width = dst_shape
+        xs, ys = zip(*(dst_transform * corner for corner in ((0, 0), (width, 0), (0, height), (width, height))))
+        left, bottom, right, top = rasterio.warp.transform_bounds(str(dst_crs), str(self.crs),
+                                                                  min(xs), min(ys), max(xs), max(ys), densify_pts=21)
+        cols, rows = zip(*(~self.transform * corner for corner in ((left, bottom), (left, top),
+                                                                   (right, bottom), (right, top))))
+        window = tuple((int(max(numpy.floor(min(coords)) - padding, 0)),
+                        int(min(numpy.ceil(max(coords)) + padding, size)))
+                       for coords, size in zip((rows, cols), self.shape))
+        if any(start >= stop for start, stop in window):
+            return None
+        return window
+
+
+class ZarrDataSource(BaseRasterDataSource):
+    """
+    Data source for reading a measurement of a Data Cube Dataset stored as a Zarr Storage Unit
+    """
+
+    def __init__(self, dataset, measurement_id):
+        """
+        :param Dataset dataset: dataset to read from
+        :param str measurement_id: measurement to read
+        """
+        self._dataset = dataset
+        self._measurement = dataset.measurements[measurement_id]
+        self._array_name = self._measurement.get('layer') or measurement_id
+        url = _resolve_url(_choose_location(dataset), self._measurement.get('path'))
+        if not url.startswith('file:'):
+            raise RuntimeError("Can't access %s over %s" % (dataset.format, url.split(':', 1)[0]))
+        nodata = dataset.type.measurements[measurement_id].get('nodata')
+        super(ZarrDataSource, self).__init__(str(uri_to_local_path(url)), nodata=nodata)
+
+    def get_bandnumber(self, src):
+        """
+        Index of the dataset's time slice in the `time` array of the storage unit
+        """
+        times = src['time'][:]
+        return int(numpy.argmin(numpy.abs(times - datetime_to_seconds_since_1970(self._dataset.center_time))))
+
+    def get_transform(self, shape):
+        raise RuntimeError('Zarr Storage Units always have a transform')
+
+    def get_crs(self):
+        raise RuntimeError('Zarr Storage Units always have a CRS')
+
+    @contextmanager
+    def open(self):
+        """Context manager which returns a `ZarrBandDataSource`"""
+        try:
+            _LOG.debug("opening %s", self.filename)
+            group = zarr.open_group(self.filename, mode='r')
+            array = group[self._array_name]
+            nodata = array.attrs.get('nodata', self.nodata)
+            if nodata is not None:
+                nodata = array.dtype.type(nodata)
+            yield ZarrBandDataSource(array, self.get_bandnumber(group), nodata,
+                                     crs=geometry.CRS(group.attrs['crs']),
+                                     transform=Affine(*group.attrs['transform']))
+        except Exception as e:
+            _LOG.error("Error opening source dataset: %s", self.filename)
+            raise e
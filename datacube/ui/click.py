@@ -13,7 +13,7 @@ import sys
 import click
 
 from datacube import config, __version__
-from datacube.executor import get_executor
+from datacube.executor import get_executor, InstrumentedExecutor
 from datacube.index import index_connect
 from pathlib import Path
 
@@ -206,24 +206,44 @@ def parse_endpoint(value):
 EXECUTOR_TYPES = {
     'serial': lambda _: get_executor(None, None),
     'multiproc': lambda workers: get_executor(None, int(workers)),
+    'threads': lambda workers: get_executor(None, int(workers), use_threads=True),
     'distributed': lambda addr: get_executor(parse_endpoint(addr), True)
 }
 
 
 def _setup_executor(ctx, param, value):
     try:
-        return EXECUTOR_TYPES[value[0]](value[1])
+        executor = EXECUTOR_TYPES[value[0]](value[1])
     except ValueError:
         ctx.fail("Failed to create '%s' executor with '%s'" % value)
+    return InstrumentedExecutor(executor, trace_file=(ctx.obj or {}).get('executor_trace'))
 
 
-executor_cli_options = click.option('--executor',
-                                    type=(click.Choice(EXECUTOR_TYPES.keys()), str),
-                                    default=('serial', None),
-                                    help="Run parallelized, either locally or distributed. eg:\n"
-                                         "--executor multiproc 4 (OR)\n"
-                                         "--executor distributed 10.0.0.8:8888",
-                                    callback=_setup_executor)
+def _set_executor_trace(ctx, param, value):
+    if not ctx.obj:
+        ctx.obj = {}
+
+    ctx.obj['executor_trace'] = value
+
+
+#: pylint: disable=invalid-name
+executor_trace_option = click.option('--executor-trace', type=click.Path(dir_okay=False, writable=True),
+                                     callback=_set_executor_trace, is_eager=True, expose_value=False,
+                                     help="Write a JSON lines record of each task's timings and result size "
+                                          "to this file")
+
+#: pylint: disable=invalid-name
+executor_cli_options = compose(
+    click.option('--executor',
+                 type=(click.Choice(EXECUTOR_TYPES.keys()), str),
+                 default=('serial', None),
+                 help="Run parallelized, either locally or distributed. eg:\n"
+                      "--executor multiproc 4 (OR)\n"
+                      "--executor threads 8 (OR)\n"
+                      "--executor distributed 10.0.0.8:8888",
+                 callback=_setup_executor),
+    executor_trace_option,
+)
 
 
 def handle_exception(msg, e):
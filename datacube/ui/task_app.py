@@ -7,8 +7,11 @@ import time
 import click
 import cachetools
 import functools
+import io
 import itertools
 import re
+import struct
+from collections import OrderedDict
 from pathlib import Path
 
 import pandas as pd
@@ -18,6 +21,8 @@ try:
 except ImportError:
     import pickle
 
+from datacube.executor import InstrumentedExecutor
+from datacube.model import pickled_type_key, unpickled_type
 from datacube.ui import click as dc_ui
 from datacube.utils import read_documents
 
@@ -44,44 +49,226 @@ def load_config(index, app_config_file, make_config, make_tasks, *args, **kwargs
 
 
 def pickle_stream(objs, filename):
+    """
+    Pickle objects to a file, one after another.
+
+    Each product (and metadata type) is pickled in full only the first time, and referred to by key afterwards.
+    """
     idx = 0
+    written = set()
+
+    def persistent_id(obj):
+        key = pickled_type_key(obj)
+        if key is None:
+            return None
+        if key not in written:
+            written.add(key)
+            return None
+        return key
+
     with open(filename, 'wb') as stream:
         for idx, obj in enumerate(objs, start=1):
-            pickle.dump(obj, stream, pickle.HIGHEST_PROTOCOL)
+            pickler = pickle.Pickler(stream, pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = persistent_id
+            pickler.dump(obj)
     return idx
 
 
 def unpickle_stream(filename):
     with open(filename, 'rb') as stream:
         while True:
+            unpickler = pickle.Unpickler(stream)
+            unpickler.persistent_load = unpickled_type
             try:
-                yield pickle.load(stream)
+                yield unpickler.load()
             except EOFError:
                 break
 
 
+#: Identifies an indexed task file (as written by :func:`save_tasks`)
+_TASK_FILE_MAGIC = b'DCTASKS1'
+#: Magic, number of tasks, offset of the index
+_TASK_FILE_HEADER = struct.Struct('<8sQQ')
+_TASK_FILE_OFFSET = struct.Struct('<Q')
+
+
+class TaskFile(object):
+    """
+    Random access to a task file written by :func:`save_tasks`.
+
+    Layout of the file:
+
+        - a header: magic, number of tasks and the offset of the index
+        - the config, then each task, pickled separately. Products (and metadata types) are referred to by key.
+        - the products and metadata types referred to, pickled together
+        - the index: offset of each of those records, then of the index itself
+
+    So a task can be read, or the tasks counted, without unpickling any other task.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        magic, self._num_tasks, index_offset = _TASK_FILE_HEADER.unpack(self._file.read(_TASK_FILE_HEADER.size))
+        if magic != _TASK_FILE_MAGIC:
+            self._file.close()
+            raise ValueError('Not an indexed task file: %s' % filename)
+
+        # Offsets of: config, tasks, types, end.
+        num_offsets = self._num_tasks + 3
+        self._file.seek(index_offset)
+        self._offsets = struct.unpack('<%dQ' % num_offsets, self._file.read(_TASK_FILE_OFFSET.size * num_offsets))
+
+        # The products and metadata types the tasks refer to. (Kept here, rather than relying on
+        # the process's bounded cache of unpickled types)
+        self._types = dict((pickled_type_key(type_), type_)
+                           for type_ in self._read_record(self._num_tasks + 1, persistent_load=None))
+        self.config = self._read_record(0)
+
+    def __len__(self):
+        return self._num_tasks
+
+    def __getitem__(self, i):
+        if not -self._num_tasks <= i < self._num_tasks:
+            raise IndexError('Task %d of %d' % (i, self._num_tasks))
+        return self._read_record(i % self._num_tasks + 1)
+
+    def __iter__(self):
+        return self.shard(0, 1)
+
+    def shard(self, shard, num_shards):
+        """
+        Iterate over a contiguous slice of the tasks: the `shard`th of `num_shards` similar sized slices.
+
+        :param int shard: slice to read, from 0 to `num_shards` - 1
+        :param int num_shards: number of slices to split the tasks into
+        """
+        _check_shard(shard, num_shards)
+        start = shard * self._num_tasks // num_shards
+        stop = (shard + 1) * self._num_tasks // num_shards
+        return (self[i] for i in range(start, stop))
+
+    def _read_record(self, record, persistent_load=True):
+        start, stop = self._offsets[record], self._offsets[record + 1]
+        self._file.seek(start)
+        unpickler = pickle.Unpickler(io.BytesIO(self._file.read(stop - start)))
+        if persistent_load:
+            unpickler.persistent_load = self._type
+        return unpickler.load()
+
+    def _type(self, key):
+        type_ = self._types.get(tuple(key))
+        if type_ is None:
+            return unpickled_type(key)
+        return type_
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+
+def _write_task_file(config, tasks, taskfile):
+    types = OrderedDict()
+
+    def persistent_id(obj):
+        key = pickled_type_key(obj)
+        if key is not None:
+            types.setdefault(key, obj)
+        return key
+
+    def dump(obj, stream, persistent_id=None):
+        pickler = pickle.Pickler(stream, pickle.HIGHEST_PROTOCOL)
+        if persistent_id is not None:
+            pickler.persistent_id = persistent_id
+        pickler.dump(obj)
+
+    offsets = []
+    with open(taskfile, 'wb') as stream:
+        stream.write(_TASK_FILE_HEADER.pack(_TASK_FILE_MAGIC, 0, 0))
+        for obj in itertools.chain([config], tasks):
+            offsets.append(stream.tell())
+            dump(obj, stream, persistent_id)
+        num_tasks = len(offsets) - 1
+
+        offsets.append(stream.tell())
+        dump(list(types.values()), stream)
+
+        index_offset = stream.tell()
+        offsets.append(index_offset)
+        for offset in offsets:
+            stream.write(_TASK_FILE_OFFSET.pack(offset))
+
+        stream.seek(0)
+        stream.write(_TASK_FILE_HEADER.pack(_TASK_FILE_MAGIC, num_tasks, index_offset))
+    return num_tasks
+
+
 def save_tasks(config, tasks, taskfile):
-    """Saves the config
+    """Saves the config and tasks to an indexed task file, readable with :class:`TaskFile`
 
     :param config: dict of configuration options common to all tasks
     :param tasks:
     :param str taskfile: Name of output file
     :return: Number of tasks saved to the file
     """
-    i = pickle_stream(itertools.chain([config], tasks), taskfile)
-    if i <= 1:
+    num_tasks = _write_task_file(config, tasks, taskfile)
+    if num_tasks == 0:
         # Only saved the config, no tasks!
         os.remove(taskfile)
         return 0
     else:
-        _LOG.info('Saved config and %d tasks to %s', i, taskfile)
-    return i - 1
+        _LOG.info('Saved config and %d tasks to %s', num_tasks, taskfile)
+    return num_tasks
 
 
-def load_tasks(taskfile):
-    stream = unpickle_stream(taskfile)
-    config = next(stream)
-    return config, stream
+def load_tasks(taskfile, shard=0, num_shards=1):
+    """
+    Load the config and tasks from a task file
+
+    :param str taskfile: file written by :func:`save_tasks`
+    :param int shard: which of `num_shards` similar sized slices of the tasks to load, from 0
+    :param int num_shards: number of slices to split the tasks into
+    :return: the config, and an iterator over the tasks
+    """
+    with open(taskfile, 'rb') as stream:
+        indexed = stream.read(len(_TASK_FILE_MAGIC)) == _TASK_FILE_MAGIC
+
+    if not indexed:
+        # A sequential pickle stream, from an older version.
+        _check_shard(shard, num_shards)
+        stream = unpickle_stream(taskfile)
+        config = next(stream)
+        return config, (task for i, task in enumerate(stream) if i % num_shards == shard)
+
+    _check_shard(shard, num_shards)
+    task_file = TaskFile(taskfile)
+    return task_file.config, _read_and_close(task_file, task_file.shard(shard, num_shards))
+
+
+def _read_and_close(task_file, tasks):
+    with task_file:
+        for task in tasks:
+            yield task
+
+
+def _check_shard(shard, num_shards):
+    if not 0 <= shard < num_shards:
+        raise ValueError('Shard %d is not within %d shards' % (shard, num_shards))
+
+
+def validate_task_shard(ctx, param, value):
+    try:
+        if value is None:
+            return None
+        shard, num_shards = (int(i) for i in value.split('/'))
+        _check_shard(shard, num_shards)
+        return shard, num_shards
+    except ValueError:
+        raise click.BadParameter('task shard must be specified in the form "3/10", counting from 0')
 
 
 # This is a function, so it's valid to be lowercase.
@@ -95,6 +282,11 @@ load_tasks_option = click.option('--load-tasks', 'input_tasks_file', help='Load
 save_tasks_option = click.option('--save-tasks', 'output_tasks_file', help='Save tasks to the specified file',
                                  type=click.Path(exists=False))
 #: pylint: disable=invalid-name
+task_shard_option = click.option('--task-shard', 'task_shard', callback=validate_task_shard, default=None,
+                                 help='Run only one of a number of similar sized slices of the loaded tasks, '
+                                      'counting from 0 (e.g. 3/10, for the fourth of ten slices). '
+                                      'Requires --load-tasks')
+#: pylint: disable=invalid-name
 queue_size_option = click.option('--queue-size', help='Number of tasks to queue at the start',
                                  type=click.IntRange(1, 100000), default=3200)
 
@@ -102,6 +294,7 @@ queue_size_option = click.option('--queue-size', help='Number of tasks to queue
 task_app_options = dc_ui.compose(
     app_config_option,
     load_tasks_option,
+    task_shard_option,
     save_tasks_option,
 
     dc_ui.config_option,
@@ -204,16 +397,20 @@ def task_app(make_config, make_tasks):
     :return:
     """
     def decorate(app_func):
-        def with_app_args(index, app_config=None, input_tasks_file=None, output_tasks_file=None, *args, **kwargs):
+        def with_app_args(index, app_config=None, input_tasks_file=None, output_tasks_file=None, task_shard=None,
+                          *args, **kwargs):
             if (app_config is None) == (input_tasks_file is None):
                 click.echo('Must specify exactly one of --app-config, --load-tasks')
                 click.get_current_context().exit(1)
 
+            if task_shard is not None and input_tasks_file is None:
+                raise click.UsageError('--task-shard can only be used with --load-tasks')
+
             if app_config is not None:
                 config, tasks = load_config(index, app_config, make_config, make_tasks, *args, **kwargs)
 
             if input_tasks_file:
-                config, tasks = load_tasks(input_tasks_file)
+                config, tasks = load_tasks(input_tasks_file, *(task_shard or ()))
 
             if output_tasks_file:
                 num_tasks_saved = save_tasks(config, tasks, output_tasks_file)
@@ -276,35 +473,36 @@ def run_tasks(tasks, executor, run_task, process_result=None, queue_size=50):
     """
     click.echo('Starting processing...')
     process_result = process_result or do_nothing
-    results = []
+    completions = executor.completion_queue()
     task_queue = itertools.islice(tasks, queue_size)
     for task in task_queue:
         _LOG.info('Running task: %s', task.get('tile_index', str(task)))
-        results.append(executor.submit(run_task, task=task))
+        completions.add(executor.submit(run_task, task=task))
 
     click.echo('Task queue filled, waiting for first result...')
 
     successful = failed = 0
-    while results:
-        result, results = executor.next_completed(results, None)
-
-        # submit a new _task to replace the one we just finished
-        task = next(tasks, None)
-        if task:
-            _LOG.info('Running task: %s', task.get('tile_index', str(task)))
-            results.append(executor.submit(run_task, task=task))
-
-        # Process the result
-        try:
-            actual_result = executor.result(result)
-            process_result(actual_result)
-            successful += 1
-        except Exception as err:  # pylint: disable=broad-except
-            _LOG.exception('Task failed: %s', err)
-            failed += 1
-            continue
-        finally:
-            # Release the _task to free memory so there is no leak in executor/scheduler/worker process
-            executor.release(result)
+    while completions:
+        for result in completions.wait():
+            # submit a new _task to replace the one we just finished
+            task = next(tasks, None)
+            if task:
+                _LOG.info('Running task: %s', task.get('tile_index', str(task)))
+                completions.add(executor.submit(run_task, task=task))
+
+            # Process the result
+            try:
+                actual_result = executor.result(result)
+                process_result(actual_result)
+                successful += 1
+            except Exception as err:  # pylint: disable=broad-except
+                _LOG.exception('Task failed: %s', err)
+                failed += 1
+                continue
+            finally:
+                # Release the _task to free memory so there is no leak in executor/scheduler/worker process
+                executor.release(result)
 
     click.echo('%d successful, %d failed' % (successful, failed))
+    if isinstance(executor, InstrumentedExecutor):
+        click.echo(executor.close())
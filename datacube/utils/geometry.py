@@ -717,6 +717,10 @@ class GeoBox(object):
         #: :rtype: geometry.Geometry
         self.extent = polygon_from_transform(width, height, affine, crs=crs)
 
+    def __reduce__(self):
+        # The extent is recomputed rather than pickled.
+        return GeoBox, (self.width, self.height, self.affine, self.crs)
+
     @classmethod
     def from_geopolygon(cls, geopolygon, resolution, crs=None, align=None):
         """
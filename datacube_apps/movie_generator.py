@@ -132,6 +132,8 @@ def compute_mosaic(products, measurements, **parsed_expressions):
             dataset = dc.load(product=prodname,
                               measurements=measurements,
                               group_by='solar_day',
+                              dtype='float32',
+                              nodata_to_nan=True,
                               **parsed_expressions)
             if len(dataset) == 0:
                 continue
@@ -147,10 +149,7 @@ def compute_mosaic(products, measurements, **parsed_expressions):
                 click.echo('No PQ found, skipping')
                 continue
 
-            crs = dataset.attrs['crs']
-            dataset = dataset.where(dataset != -999)
             dataset.attrs['product'] = prodname
-            dataset.attrs['crs'] = crs
 
             cloud_free = make_mask(pq.pixelquality, ga_good_pixel=True)
             dataset = dataset.where(cloud_free)
@@ -162,6 +162,7 @@ command_options = datacube.ui.click.compose(
     task_app.cell_index_list_option,
     task_app.queue_size_option,
     task_app.load_tasks_option,
+    task_app.task_shard_option,
     task_app.save_tasks_option,
     datacube.ui.click.executor_cli_options,
     click.option('--export-path', 'export_path',
@@ -4,27 +4,26 @@ Create time-stacked NetCDF files
 """
 from __future__ import absolute_import, print_function
 
-import copy
 import datetime
 import itertools
 import logging
 import os
 import socket
+import zlib
 from functools import partial
 
 import click
 import dask.array as da
-import dask
+import netCDF4
 from dateutil import tz
 import pandas as pd
 from pathlib import Path
 
 import datacube
 from datacube.api import Tile
-from datacube.model import Dataset
 from datacube.model.utils import xr_apply, datasets_to_doc
 from datacube.storage import netcdf_writer
-from datacube.storage.storage import create_netcdf_storage_unit
+from datacube.storage.storage import create_netcdf_storage_unit, NETCDF_LOCK
 from datacube.ui import task_app
 from datacube.ui.click import to_pathlib
 
@@ -150,27 +149,30 @@ def do_stack_task(config, task):
     # 5 * 4000 * 4000 * 2bytes == 152MB, so mem usage is not an issue
     chunk_profile = {'time': config['storage']['chunking']['time']}
 
+    # The source files are read (by GDAL's NetCDF driver) while the output is written (by netCDF4), on
+    # dask's threads, and other tasks may be doing the same in other threads. The NetCDF library isn't thread
+    # safe, so the process-wide NETCDF_LOCK is held for both. (Sources take it themselves as they're read)
     data = datacube.api.GridWorkflow.load(tile, dask_chunks=chunk_profile)
 
     unwrapped_datasets = xr_apply(tile.sources, _unwrap_dataset_list, dtype='O')
     data['dataset'] = datasets_to_doc(unwrapped_datasets)
 
     try:
-        nco = create_netcdf_storage_unit(temp_filename,
-                                         data.crs,
-                                         data.coords,
-                                         data.data_vars,
-                                         variable_params,
-                                         global_attributes)
-        write_data_variables(data.data_vars, nco)
-        nco.close()
+        with NETCDF_LOCK:
+            nco = create_netcdf_storage_unit(temp_filename,
+                                             data.crs,
+                                             data.coords,
+                                             data.data_vars,
+                                             variable_params,
+                                             global_attributes)
+        checksums = write_data_variables(data.data_vars, nco, NETCDF_LOCK)
+        with NETCDF_LOCK:
+            nco.close()
 
         temp_filename.rename(output_filename)
 
         if config.get('check_data_identical', False):
-            new_tile = make_updated_tile(unwrapped_datasets, output_uri, tile.geobox)
-            new_data = datacube.api.GridWorkflow.load(new_tile, dask_chunks=chunk_profile)
-            check_identical(data, new_data, output_filename)
+            check_identical(output_filename, checksums)
 
     except Exception as e:
         if temp_filename.exists():
@@ -180,33 +182,80 @@ def do_stack_task(config, task):
     return unwrapped_datasets, output_uri
 
 
-def write_data_variables(data_vars, nco):
+def write_data_variables(data_vars, nco, lock):
+    """
+    Write variables to a NetCDF file.
+
+    The blocks of all dask-backed variables are computed together by dask's (threaded) scheduler. The
+    writes to the file are serialised by the lock, which should also be held while reading their sources.
+
+    :param dict data_vars: variables to write, by name
+    :param netCDF4.Dataset nco: open file, with the variables created
+    :param lock: held while writing, eg. :data:`datacube.storage.storage.NETCDF_LOCK`
+    :return: checksum of each block written, by variable name and block window (None if the whole variable)
+    :rtype: dict[(str, tuple), int]
+    """
+    checksums = {}
+
+    sources, targets = [], []
     for name, variable in data_vars.items():
-        try:
-            with dask.set_options(get=dask.async.get_sync):
-                da.store(variable.data, nco[name], lock=True)
-        except ValueError:
-            nco[name][:] = netcdf_writer.netcdfy_data(variable.values)
+        if isinstance(variable.data, da.Array):
+            sources.append(variable.data)
+            targets.append(_ChecksummedTarget(nco[name], name, checksums, lock))
+        else:
+            block = netcdf_writer.netcdfy_data(variable.values)
+            with lock:
+                nco[name][:] = block
+            checksums[(name, None)] = _checksum(block)
+
+    if sources:
+        da.store(sources, targets, lock=False)
+    with lock:
         nco.sync()
+    return checksums
 
 
-def check_identical(data1, data2, output_filename):
-    with dask.set_options(get=dask.async.get_sync):
-        if not all((data1 == data2).all().values()):
-            _LOG.error("Mismatch found for %s, not indexing", output_filename)
-            raise ValueError("Mismatch found for %s, not indexing" % output_filename)
-    return True
+class _ChecksummedTarget(object):
+    """
+    A :func:`dask.array.store` target that writes blocks to a NetCDF variable, recording their checksums.
+    """
+    def __init__(self, variable, name, checksums, lock):
+        self._variable = variable
+        self._name = name
+        self._checksums = checksums
+        self._lock = lock
 
+    def __setitem__(self, index, block):
+        window = tuple(dim_slice.indices(size)[:2] for dim_slice, size in zip(index, self._variable.shape))
+        block = netcdf_writer.netcdfy_data(block).astype(self._variable.dtype, copy=False)
+        checksum = _checksum(block)
+        with self._lock:
+            self._variable[index] = block
+            self._checksums[(self._name, window)] = checksum
 
-def make_updated_tile(old_datasets, new_uri, geobox):
-    def update_dataset_location(labels, dataset):
-        # type: (object, Dataset) -> list
-        new_dataset = copy.copy(dataset)
-        new_dataset.uris = [new_uri]
-        return [new_dataset]
 
-    updated_datasets = xr_apply(old_datasets, update_dataset_location, dtype='O')
-    return datacube.api.Tile(sources=updated_datasets, geobox=geobox)
+def _checksum(data):
+    return zlib.crc32(data.tobytes()) & 0xffffffff
+
+
+def check_identical(output_filename, checksums):
+    """
+    Check the data read back from a file matches the checksums of the blocks written to it.
+
+    This catches data lost or corrupted in writing. It doesn't re-read the sources: the checksums are
+    of the blocks as they were loaded from them.
+
+    :param Path output_filename: file written
+    :param dict checksums: from :func:`write_data_variables`
+    """
+    with NETCDF_LOCK, netCDF4.Dataset(str(output_filename)) as nco:
+        nco.set_auto_maskandscale(False)
+        for (name, window), checksum in checksums.items():
+            index = slice(None) if window is None else tuple(slice(start, stop) for start, stop in window)
+            if _checksum(nco[name][index]) != checksum:
+                _LOG.error("Mismatch found for %s, not indexing", output_filename)
+                raise ValueError("Mismatch found for %s, not indexing" % output_filename)
+    return True
 
 
 def process_result(index, result):
@@ -0,0 +1,559 @@
+"""
+Calculate per-pixel statistics over the full time depth of a product, for each cell
+
+Each cell is processed a spatial chunk at a time. Within a chunk, the time series is loaded a block of time slices
+at a time, and folded into online statistics, so memory use per worker depends on the chunk size, not the length of
+the time series.
+
+An example app config::
+
+    source_type: ls5_nbar_albers
+    measurements: [red, nir]
+    statistics: [count, mean, std, min, max, percentile_10, percentile_50, percentile_90]
+
+    # Optional: mask each observation with matching pixel quality, keeping pixels with these flags
+    pq_type: ls5_pq_albers
+    pq_flags:
+      ga_good_pixel: true
+
+    # Optional: range and number of the histogram bins used for percentiles
+    percentile_bins: {min: 0, max: 10000, bins: 200}
+
+    # Optional: limit the time range (also available as --year on the command line)
+    time: ['1987', '2017']
+
+    location: /g/data/u46/users/stats
+    file_path_template: 'LS5_NBAR_STATS/{tile_index[0]}_{tile_index[1]}/LS5_NBAR_STATS_{start_time}_{end_time}.nc'
+    output_format: NetCDF   # or GeoTIFF, for a Cloud Optimised GeoTIFF per statistic
+
+    computation:
+      # Spatial chunk, and number of time slices loaded together for it
+      chunking: {x: 200, y: 200, time: 16}
+
+    global_attributes:
+      title: Landsat 5 NBAR statistics
+
+Each output variable is named ``<measurement>_<statistic>``, eg. ``red_percentile_50``.
+"""
+from __future__ import absolute_import, division, print_function
+
+import datetime
+import logging
+import os
+from collections import OrderedDict
+from functools import partial
+
+import click
+import numpy
+from dateutil import tz
+from pathlib import Path
+
+import datacube
+from datacube.api import GridWorkflow, Tile
+from datacube.api.core import _chunk_slices
+from datacube.api.reducers import valid_data
+from datacube.helpers import ga_pq_fuser
+from datacube.model import Variable
+from datacube.storage import geotiff_writer, netcdf_writer
+from datacube.storage.masking import make_mask
+from datacube.storage.storage import create_netcdf_storage_unit, NETCDF_LOCK
+from datacube.ui import task_app
+
+_LOG = logging.getLogger(__name__)
+
+APP_NAME = 'datacube-stats'
+
+DEFAULT_CHUNKING = {'x': 200, 'y': 200, 'time': 16}
+DEFAULT_PERCENTILE_BINS = {'min': 0, 'max': 10000, 'bins': 200}
+
+
+class Statistic(object):
+    """
+    A per-pixel statistic over time, updated a time slice at a time.
+    """
+
+    def outputs(self, measurement):
+        """
+        Definitions of the output variables of a measurement: name, dtype, nodata and units
+
+        :param dict measurement: measurement the statistic is of
+        :rtype: list[dict]
+        """
+        raise NotImplementedError
+
+    def start(self, measurement, shape):
+        """
+        The starting state of the statistic, for a chunk of the given (y, x) shape
+        """
+        raise NotImplementedError
+
+    def update(self, state, data, valid):
+        """
+        Update the state with a time slice.
+
+        :param numpy.ndarray data: 2D time slice
+        :param numpy.ndarray valid: where the time slice has data, and passed the pixel quality mask
+        """
+        raise NotImplementedError
+
+    def finish(self, state):
+        """
+        :return: an array for each of the `outputs`
+        :rtype: list[numpy.ndarray]
+        """
+        raise NotImplementedError
+
+
+def _output(measurement, statistic, dtype=None, nodata=None, units=None):
+    output = dict(measurement, name='%s_%s' % (measurement['name'], statistic))
+    if dtype is not None:
+        output.update(dtype=dtype, nodata=nodata)
+    if units is not None:
+        output['units'] = units
+    return output
+
+
+class Count(Statistic):
+    """Number of valid observations"""
+
+    def outputs(self, measurement):
+        return [_output(measurement, 'count', dtype='int16', nodata=-1, units='1')]
+
+    def start(self, measurement, shape):
+        return numpy.zeros(shape, dtype='int16')
+
+    def update(self, state, data, valid):
+        state += valid
+
+    def finish(self, state):
+        return [state]
+
+
+class Extreme(Statistic):
+    """Minimum or maximum valid observation"""
+
+    def __init__(self, name, better):
+        """
+        :param str name: name of the statistic, eg. 'min'
+        :param better: ufunc of whether an observation replaces the current one, eg. `numpy.less`
+        """
+        self.name = name
+        self.better = better
+
+    def outputs(self, measurement):
+        return [_output(measurement, self.name)]
+
+    def start(self, measurement, shape):
+        return numpy.full(shape, measurement['nodata'], dtype=measurement['dtype']), numpy.zeros(shape, dtype=bool)
+
+    def update(self, state, data, valid):
+        current, has_data = state
+        replace = valid & (~has_data | self.better(data, current))
+        numpy.copyto(current, data, where=replace)
+        has_data |= valid
+
+    def finish(self, state):
+        return [state[0]]
+
+
+class Moments(Statistic):
+    """
+    Mean and/or standard deviation of the valid observations, by Welford's algorithm.
+    """
+
+    def __init__(self, mean=True, std=True):
+        self.mean = mean
+        self.std = std
+
+    def outputs(self, measurement):
+        names = [name for name, wanted in (('mean', self.mean), ('std', self.std)) if wanted]
+        return [_output(measurement, name, dtype='float32', nodata=float('nan')) for name in names]
+
+    def start(self, measurement, shape):
+        return numpy.zeros(shape, dtype='int32'), numpy.zeros(shape), numpy.zeros(shape)
+
+    def update(self, state, data, valid):
+        count, mean, sum_squares = state
+        count += valid
+        delta = numpy.subtract(data, mean, where=valid, out=numpy.zeros(mean.shape))
+        numpy.add(mean, delta / numpy.maximum(count, 1), out=mean, where=valid)
+        sum_squares += numpy.where(valid, delta * (data - mean), 0)
+
+    def finish(self, state):
+        count, mean, sum_squares = state
+        has_data = count > 0
+        result = []
+        if self.mean:
+            result.append(numpy.where(has_data, mean, numpy.nan).astype('float32'))
+        if self.std:
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                result.append(numpy.where(has_data, numpy.sqrt(sum_squares / count), numpy.nan).astype('float32'))
+        return result
+
+
+class Percentiles(Statistic):
+    """
+    Percentiles of the valid observations, estimated from a per-pixel histogram.
+
+    Percentiles follow :func:`numpy.percentile` (linear interpolation): the ``q``th percentile of ``n``
+    observations lies at rank ``q / 100 * (n - 1)`` of the sorted observations, interpolating between the
+    neighbouring ranks. Within the histogram, the observations in a bin are taken to be evenly spread over it,
+    and the estimates are clamped to the minimum and maximum of each pixel, so they are accurate to within a bin
+    width, and exact when all the observations are the same. Observations outside the range are counted in the
+    first or last bin.
+
+    Memory use is ``bins`` counts per pixel, whatever the number of observations.
+    """
+
+    def __init__(self, percentiles, value_range=(0, 10000), bins=200):
+        """
+        :param list[float] percentiles: percentiles to calculate, between 0 and 100
+        :param (float,float) value_range: (min, max) range of the histogram
+        :param int bins: number of histogram bins
+        """
+        self.percentiles = percentiles
+        self.value_range = value_range
+        self.bins = bins
+
+    def outputs(self, measurement):
+        return [_output(measurement, 'percentile_%s' % q, dtype='float32', nodata=float('nan'))
+                for q in self.percentiles]
+
+    def start(self, measurement, shape):
+        return (numpy.zeros(shape + (self.bins,), dtype='uint32'),
+                numpy.full(shape, numpy.inf),
+                numpy.full(shape, -numpy.inf))
+
+    def update(self, state, data, valid):
+        histogram, minimum, maximum = state
+        low, high = self.value_range
+        pixels = numpy.flatnonzero(valid)
+        bins = ((data.ravel()[pixels] - low) * (self.bins / (high - low))).astype('int64')
+        numpy.clip(bins, 0, self.bins - 1, out=bins)
+        histogram.reshape(-1, self.bins)[pixels, bins] += 1
+        numpy.minimum(minimum, data, out=minimum, where=valid)
+        numpy.maximum(maximum, data, out=maximum, where=valid)
+
+    def _value_at(self, state, cumulative, rank):
+        """
+        Estimate of the observation of each pixel at a (0-based, integer) rank: exact for the first and last
+        rank, and otherwise spreading the observations in a bin evenly over it
+        """
+        histogram, minimum, maximum = state
+        low, high = self.value_range
+        pixels = numpy.arange(histogram.shape[0])
+        bins = numpy.minimum((cumulative <= rank[:, None]).sum(axis=1), self.bins - 1)
+        in_bin = histogram[pixels, bins]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            position = (rank - (cumulative[pixels, bins] - in_bin) + 0.5) / in_bin
+            value = numpy.minimum(numpy.maximum(low + (bins + position) * ((high - low) / self.bins), minimum),
+                                  maximum)
+        value[rank == 0] = minimum[rank == 0]
+        last = rank == cumulative[:, -1] - 1
+        value[last] = maximum[last]
+        return value
+
+    def finish(self, state):
+        histogram, minimum, maximum = state
+        shape = minimum.shape
+        state = histogram.reshape(-1, self.bins), minimum.ravel(), maximum.ravel()
+        cumulative = numpy.cumsum(state[0], axis=1)
+        last = numpy.maximum(cumulative[:, -1].astype('int64') - 1, 0)
+
+        result = []
+        for q in self.percentiles:
+            rank = q / 100 * last
+            below = numpy.floor(rank)
+            above = numpy.minimum(below + 1, last)
+            value_below = self._value_at(state, cumulative, below)
+            value_above = self._value_at(state, cumulative, above)
+            with numpy.errstate(invalid='ignore'):
+                value = value_below + (rank - below) * (value_above - value_below)
+            value[cumulative[:, -1] == 0] = numpy.nan
+            result.append(value.reshape(shape).astype('float32'))
+        return result
+
+
+def make_statistics(names, percentile_bins=None):
+    """
+    The statistics for the names in an app config.
+
+    :param list[str] names: 'count', 'mean', 'std', 'min', 'max' or 'percentile_<q>' (eg. 'percentile_50')
+    :param dict percentile_bins: range and number of the bins used for percentiles: {min:, max:, bins:}
+    :rtype: list[Statistic]
+    """
+    percentile_bins = dict(DEFAULT_PERCENTILE_BINS, **(percentile_bins or {}))
+    percentiles = [float(name[len('percentile_'):]) for name in names if name.startswith('percentile_')]
+    percentiles = [int(q) if q.is_integer() else q for q in percentiles]
+    if any(not 0 <= q <= 100 for q in percentiles):
+        raise ValueError('Percentiles must be between 0 and 100: %s' % percentiles)
+
+    statistics = []
+    for name in names:
+        if name == 'count':
+            statistics.append(Count())
+        elif name == 'min':
+            statistics.append(Extreme('min', numpy.less))
+        elif name == 'max':
+            statistics.append(Extreme('max', numpy.greater))
+        elif name in ('mean', 'std'):
+            if not any(isinstance(statistic, Moments) for statistic in statistics):
+                statistics.append(Moments(mean='mean' in names, std='std' in names))
+        elif name.startswith('percentile_'):
+            if not any(isinstance(statistic, Percentiles) for statistic in statistics):
+                statistics.append(Percentiles(percentiles,
+                                              value_range=(percentile_bins['min'], percentile_bins['max']),
+                                              bins=percentile_bins['bins']))
+        else:
+            raise ValueError('Unknown statistic: %r' % name)
+    return statistics
+
+
+def get_filename(config, cell_index, tile):
+    file_path_template = str(Path(config['location'], config['file_path_template']))
+    times = tile.sources.time.values
+    return file_path_template.format(tile_index=cell_index,
+                                     start_time=numpy.datetime_as_string(times[0], unit='D').replace('-', ''),
+                                     end_time=numpy.datetime_as_string(times[-1], unit='D').replace('-', ''))
+
+
+def _select_times(tile, times):
+    return Tile(tile.sources.sel(time=times), tile.geobox)
+
+
+def make_stats_tasks(index, config, cell_index=None, cell_index_list=None, time=None, **kwargs):
+    source_type = config['source_type']
+    pq_type = config.get('pq_type')
+    query = dict(group_by='solar_day')
+    time = time or config.get('time')
+    if time is not None:
+        query['time'] = tuple(time)
+
+    gw = GridWorkflow(index=index, product=source_type)
+
+    for cell_index in cell_index_list or [cell_index]:
+        cells = gw.list_cells(product=source_type, cell_index=cell_index, **query)
+        pq_cells = gw.list_cells(product=pq_type, cell_index=cell_index, **query) if pq_type else {}
+        for cell_index_key, tile in cells.items():
+            pq_tile = None
+            if pq_type:
+                if cell_index_key not in pq_cells:
+                    _LOG.warning('No %s for cell %s, skipping', pq_type, cell_index_key)
+                    continue
+                pq_tile = pq_cells[cell_index_key]
+                times = numpy.intersect1d(tile.sources.time.values, pq_tile.sources.time.values)
+                if len(times) < tile.sources.time.size:
+                    _LOG.info('Skipping %d times of cell %s without %s',
+                              tile.sources.time.size - len(times), cell_index_key, pq_type)
+                if len(times) == 0:
+                    continue
+                tile, pq_tile = _select_times(tile, times), _select_times(pq_tile, times)
+
+            output_filename = get_filename(config, cell_index_key, tile)
+            _LOG.info('Statistics of cell %s: %d times. Output=%s', cell_index_key, tile.sources.time.size,
+                      output_filename)
+            yield dict(tile=tile,
+                       pq_tile=pq_tile,
+                       cell_index=cell_index_key,
+                       output_filename=output_filename)
+
+
+def make_stats_config(index, config, export_path=None, **query):
+    product = index.products.get_by_name(config['source_type'])
+    if product is None:
+        raise ValueError('Unknown product: %s' % config['source_type'])
+    if config.get('pq_type') and index.products.get_by_name(config['pq_type']) is None:
+        raise ValueError('Unknown product: %s' % config['pq_type'])
+
+    config['measurements'] = list(product.lookup_measurements(config.get('measurements')))
+    config['statistics'] = make_statistics(config['statistics'], config.get('percentile_bins'))
+    config['pq_flags'] = config.get('pq_flags', {'ga_good_pixel': True})
+
+    output_format = config.setdefault('output_format', 'NetCDF')
+    if output_format not in ('NetCDF', 'GeoTIFF'):
+        raise ValueError('Unknown output format: %s' % output_format)
+
+    if export_path is not None:
+        config['location'] = export_path
+
+    if not os.access(config['location'], os.W_OK):
+        _LOG.warning('Current user appears not have write access output location: %s', config['location'])
+    return config
+
+
+def get_history_attribute(config, task):
+    return '{dt} {user} {app} ({ver}) {args}  # {comment}'.format(
+        dt=datetime.datetime.now(tz.tzlocal()).isoformat(),
+        user=os.environ.get('USERNAME') or os.environ.get('USER'),
+        app=APP_NAME,
+        ver=datacube.__version__,
+        args=', '.join([config['app_config_file'], task['output_filename'], str(task['cell_index'])]),
+        comment='Per-pixel statistics over time'
+    )
+
+
+def compute_chunk(tile, pq_tile, measurements, statistics, pq_flags, chunk, time_chunk=1):
+    """
+    Calculate the statistics of a spatial chunk of a tile, loading a block of time slices at a time.
+
+    :param Tile tile: tile of the source product
+    :param Tile pq_tile: tile of pixel quality, with the same times, or None to not mask
+    :param list[dict] measurements: measurements to calculate the statistics of
+    :param list[Statistic] statistics:
+    :param dict pq_flags: flags of the pixels to keep, for :func:`datacube.storage.masking.make_mask`
+    :param tuple[slice] chunk: (y, x) slices of the chunk
+    :param int time_chunk: number of time slices to load at a time
+    :return: arrays of the output variables, by name
+    :rtype: dict[str, numpy.ndarray]
+    """
+    shape = tile.geobox[chunk].shape
+    states = [[statistic.start(measurement, shape) for statistic in statistics] for measurement in measurements]
+
+    for time_block in _chunk_slices((tile.sources.time.size,), (time_chunk,)):
+        block = time_block + chunk
+        data = GridWorkflow.load(tile[block], measurements=[measurement['name'] for measurement in measurements])
+        keep = None
+        if pq_tile is not None:
+            pq = GridWorkflow.load(pq_tile[block], fuse_func=ga_pq_fuser)
+            keep = make_mask(next(iter(pq.data_vars.values())), **pq_flags).values
+
+        for measurement, measurement_states in zip(measurements, states):
+            arrays = data[measurement['name']].values
+            valid = valid_data(arrays, measurement['nodata'])
+            if keep is not None:
+                valid &= keep
+            for time_index in range(arrays.shape[0]):
+                for statistic, state in zip(statistics, measurement_states):
+                    statistic.update(state, arrays[time_index], valid[time_index])
+
+    result = OrderedDict()
+    for measurement, measurement_states in zip(measurements, states):
+        for statistic, state in zip(statistics, measurement_states):
+            for output, array in zip(statistic.outputs(measurement), statistic.finish(state)):
+                result[output['name']] = array
+    return result
+
+
+class _NetCDFOutput(object):
+    """
+    A NetCDF file with a variable per output, written a chunk at a time.
+
+    (Tasks may be run by threads: the NetCDF library is only used while holding the :data:`NETCDF_LOCK`)
+    """
+
+    def __init__(self, filename, geobox, outputs, chunking, global_attributes):
+        variables = OrderedDict((name, Variable(numpy.dtype(output['dtype']), output['nodata'], geobox.dimensions,
+                                                output.get('units', '1')))
+                                for name, output in outputs.items())
+        chunksizes = [min(chunking[dim], size) for dim, size in zip(geobox.dimensions, geobox.shape)]
+        variable_params = dict((name, {'zlib': True, 'chunksizes': chunksizes}) for name in outputs)
+        self.filename = filename
+        with NETCDF_LOCK:
+            self._nco = create_netcdf_storage_unit(filename, geobox.crs, geobox.coordinates, variables,
+                                                   variable_params, global_attributes)
+
+    def write(self, name, data, chunk):
+        data = netcdf_writer.netcdfy_data(data)
+        with NETCDF_LOCK:
+            self._nco[name][chunk] = data
+
+    def close(self):
+        with NETCDF_LOCK:
+            self._nco.close()
+
+    def abort(self):
+        self.close()
+        if self.filename.exists():
+            self.filename.unlink()
+
+
+class _GeoTIFFOutput(object):
+    """A Cloud Optimised GeoTIFF per output, written a chunk at a time"""
+
+    def __init__(self, filename, geobox, outputs, chunking, global_attributes):
+        self._units = OrderedDict()
+        try:
+            for name, output in outputs.items():
+                self._units[name] = geotiff_writer.COGStorageUnit(
+                    filename.with_name(filename.stem + '_' + name + filename.suffix), geobox,
+                    count=1, dtype=output['dtype'], nodata=output['nodata'])
+                self._units[name].update_tags(**global_attributes)
+        except Exception:
+            self.abort()
+            raise
+
+    def write(self, name, data, chunk):
+        self._units[name].write(data, window=chunk)
+
+    def close(self):
+        for unit in self._units.values():
+            unit.close()
+
+    def abort(self):
+        for unit in self._units.values():
+            unit.abort()
+
+
+_OUTPUT_FORMATS = {
+    'NetCDF': _NetCDFOutput,
+    'GeoTIFF': _GeoTIFFOutput,
+}
+
+
+def do_stats_task(config, task):
+    tile = task['tile']
+    measurements = list(tile.product.lookup_measurements(config['measurements']).values())
+    statistics = config['statistics']
+    chunking = dict(DEFAULT_CHUNKING, **config.get('computation', {}).get('chunking', {}))
+
+    global_attributes = dict(config.get('global_attributes', {}))
+    global_attributes['history'] = get_history_attribute(config, task)
+
+    outputs = OrderedDict((output['name'], output)
+                          for measurement in measurements
+                          for statistic in statistics
+                          for output in statistic.outputs(measurement))
+
+    output_filename = Path(task['output_filename'])
+    output = _OUTPUT_FORMATS[config['output_format']](output_filename, tile.geobox, outputs, chunking,
+                                                      global_attributes)
+    try:
+        for chunk in _chunk_slices(tile.geobox.shape, [chunking[dim] for dim in tile.geobox.dimensions]):
+            _LOG.debug('Calculating chunk %s of %s', chunk, output_filename)
+            result = compute_chunk(tile, task['pq_tile'], measurements, statistics, config['pq_flags'], chunk,
+                                   chunking['time'])
+            for name, data in result.items():
+                output.write(name, data, chunk)
+        output.close()
+    except Exception:
+        # Don't leave incomplete files behind to block a re-run.
+        output.abort()
+        raise
+
+    return output_filename
+
+
+@click.command(name=APP_NAME)
+@datacube.ui.click.pass_index(app_name=APP_NAME)
+@datacube.ui.click.global_cli_options
+@task_app.cell_index_option
+@task_app.cell_index_list_option
+@click.option('--year', 'time', callback=task_app.validate_year,
+              help='Limit the process to a year, or an inclusive range of years (eg 1987-2017)')
+@click.option('--export-path', 'export_path',
+              help='Write the files to a location other than the one in the app config',
+              default=None,
+              type=click.Path(exists=True, writable=True, file_okay=False))
+@task_app.queue_size_option
+@task_app.task_app_options
+@task_app.task_app(make_config=make_stats_config, make_tasks=make_stats_tasks)
+def main(index, config, tasks, executor, queue_size, **kwargs):
+    """Calculate per-pixel statistics over time of each cell of a product."""
+    click.echo('Starting statistics utility...')
+
+    task_func = partial(do_stats_task, config)
+    task_app.run_tasks(tasks, executor, task_func, None, queue_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -176,6 +176,39 @@ def test_transactions(index, db, local_config, default_metadata_type):
     assert not index.datasets.has(_telemetry_uuid)
 
 
+def test_dataset_type_changes(index, db, local_config, default_metadata_type):
+    """
+    Each product has its own change counter: changing one product's datasets doesn't invalidate others' searches.
+
+    :type index: datacube.index._api.Index
+    :type db: datacube.index.postgres._connections.PostgresDb
+    """
+    dataset_type = index.products.add_document(_pseudo_telemetry_dataset_type)
+    other_type = index.products.add_document(dict(_pseudo_telemetry_dataset_type, name='ls8_other_telemetry'))
+    ids = [dataset_type.id, other_type.id]
+
+    with db.connect() as connection:
+        before = connection.get_dataset_type_changes(ids)
+    assert before == {dataset_type.id: 0, other_type.id: 0}
+
+    with db.begin() as transaction:
+        transaction.insert_dataset(_telemetry_dataset, _telemetry_uuid, dataset_type.id)
+        # Not advanced until committed.
+        with db.connect() as connection:
+            assert connection.get_dataset_type_changes(ids) == before
+
+    with db.connect() as connection:
+        after_insert = connection.get_dataset_type_changes(ids)
+    assert after_insert[dataset_type.id] > before[dataset_type.id]
+    assert after_insert[other_type.id] == before[other_type.id]
+
+    index.datasets.archive([_telemetry_uuid])
+    with db.connect() as connection:
+        after_archive = connection.get_dataset_type_changes(ids)
+    assert after_archive[dataset_type.id] > after_insert[dataset_type.id]
+    assert after_archive[other_type.id] == before[other_type.id]
+
+
 def test_get_missing_things(index):
     """
     The get(id) methods should return None if the object doesn't exist.
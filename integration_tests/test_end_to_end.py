@@ -119,6 +119,7 @@ def test_end_to_end(global_integration_cli_args, index, testdata_dir):
     check_analytics_ndvi_mask_median_expression(index)
     check_analytics_ndvi_mask_median_expression_storage_type(index)
     check_analytics_pixel_drill(index)
+    check_analytics_plan_execution(index)
 
 
 def run_click_command(command, args):
@@ -199,6 +200,11 @@ def check_open_with_dc(index):
     dataset_like = dc.load(product='ls5_nbar_albers', measurements=['blue'], like=dataset)
     assert (dataset.blue == dataset_like.blue).all()
 
+    float_dataset = dc.load(product='ls5_nbar_albers', measurements=['blue'], like=dataset,
+                            dtype='float32', nodata_to_nan=True)
+    assert float_dataset.blue.dtype == numpy.float32
+    assert float_dataset.blue.equals(dataset.blue.where(dataset.blue != dataset.blue.nodata).astype('float32'))
+
     solar_day_dataset = dc.load(product='ls5_nbar_albers',
                                 latitude=(-35, -36), longitude=(149, 150),
                                 measurements=['blue'], group_by='solar_day')
@@ -689,6 +695,44 @@ def check_analytics_ndvi_mask_median_expression_storage_type(index):
     assert e.cache['medianT']
 
 
+def check_analytics_plan_execution(index):
+    from datetime import datetime
+    import numpy as np
+    from datacube.analytics.analytics_engine import AnalyticsEngine
+    from datacube.execution.execution_engine import ExecutionEngine
+
+    a = AnalyticsEngine(index=index)
+
+    dimensions = {'x':    {'range': (149.07, 149.18)},
+                  'y':    {'range': (-35.32, -35.28)},
+                  'time': {'range': (datetime(1992, 1, 1), datetime(1992, 12, 31))}}
+
+    b40 = a.create_array('ls5_nbar_albers', ['nir'], dimensions, 'b40')
+    b30 = a.create_array('ls5_nbar_albers', ['red'], dimensions, 'b30')
+    ndvi = a.apply_expression([b40, b30], '((array1 - array2) / (array1 + array2))', 'ndvi')
+    median_t = a.apply_expression(ndvi, 'median(array1, 0)', 'medianT')
+
+    e = ExecutionEngine(index=index)
+    e.execute_plan(a.plan)
+
+    # Spill everything but the latest result
+    lean = ExecutionEngine(index=index, max_cache_bytes=1)
+    lean.execute_plan(a.plan, keep=['ndvi'])
+
+    assert sorted(lean.cache) == ['medianT', 'ndvi']
+    for name in ('ndvi', 'medianT'):
+        np.testing.assert_array_equal(lean.cache[name]['array_result'][name],
+                                      e.cache[name]['array_result'][name])
+
+    # Load lazily, and compute the whole plan at once
+    lazy = ExecutionEngine(index=index, dask_chunks={'x': 100, 'y': 100})
+    lazy.execute_plan(a.plan)
+
+    for name in ('ndvi', 'medianT'):
+        np.testing.assert_array_equal(lazy.cache[name]['array_result'][name],
+                                      e.cache[name]['array_result'][name])
+
+
 def check_analytics_pixel_drill(index):
     from datetime import datetime
     from datacube.analytics.analytics_engine import AnalyticsEngine
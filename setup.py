@@ -12,6 +12,7 @@ extras_require = {
     'analytics': ['scipy', 'pyparsing', 'numexpr'],
     'doc': ['Sphinx', 'setuptools'],
     'replicas': ['paramiko', 'sshtunnel', 'tqdm'],
+    'zarr': ['zarr', 'numcodecs'],
     'test': tests_require,
 }
 # An 'all' option, following ipython naming conventions.
@@ -90,6 +91,7 @@ setup(
             'datacube-stacker = datacube_apps.stacker:main',
             'datacube-fixer = datacube_apps.stacker:fixer_main',
             'datacube-ncml = datacube_apps.ncml:ncml_app',
+            'datacube-stats = datacube_apps.stats:main',
             'pixeldrill = datacube_apps.pixeldrill:main [interactive]',
             'movie_generator = datacube_apps.movie_generator:main',
             'datacube-simple-replica = datacube_apps.simple_replica:replicate'
@@ -60,7 +60,7 @@ def mock_get_descriptor(query_parameters):
     return descriptor
 
 
-def mock_get_data(query_parameters):
+def mock_get_data(query_parameters, dask_chunks=None):
     variables = query_parameters['variables']
     data = {
         'element_sizes': [numpy.timedelta64(921597444444444, 'ns'), 24.890829694323145, 24.94047619047619],
@@ -212,7 +212,9 @@ def mock_get_data(query_parameters):
     }
 
     data['arrays'] = {
-        name: xarray.DataArray(numpy.ones((2, 400, 400), dtype=numpy.int32))
+        name: xarray.DataArray(numpy.ones((2, 400, 400), dtype=numpy.int32), dims=data['dimensions'])
         for name in variables
         }
+    if dask_chunks is not None:
+        data['arrays'] = {name: array.chunk(dask_chunks) for name, array in data['arrays'].items()}
     return data
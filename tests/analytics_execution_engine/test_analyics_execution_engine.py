@@ -1,8 +1,11 @@
 from __future__ import absolute_import
 
 from datetime import datetime
+import copy
 import sys
+import threading
 
+import numpy
 import pytest
 from mock import MagicMock
 
@@ -258,3 +261,168 @@ def test_median_reduction_over_time_old_version(mock_api):
     median_t = a.apply_reduction(arrays, ['time'], 'median', 'medianT')
 
     result = e.execute_plan(a.plan)
+
+
+def _ndvi_plan(mock_api):
+    a = AnalyticsEngine(api=mock_api)
+
+    # Lake Burley Griffin
+    dimensions = {'longitude': {'range': (149.07, 149.18)},
+                  'latitude': {'range': (-35.32, -35.28)},
+                  'time': {'range': (datetime(1990, 1, 1), datetime(1990, 12, 31))}}
+
+    b40 = a.create_array(('LANDSAT_5', 'NBAR'), ['band_40'], dimensions, 'b40')
+    b30 = a.create_array(('LANDSAT_5', 'NBAR'), ['band_30'], dimensions, 'b30')
+    ndvi = a.apply_expression([b40, b30], '((array1 - array2) / (array1 + array2))', 'ndvi')
+    a.apply_expression(ndvi, '(ndvi*0.5)', 'adjusted_ndvi')
+    return a.plan
+
+
+def test_results_spilled_beyond_max_cache_bytes(mock_api, tmpdir):
+    result_bytes = 2 * 400 * 400 * 8
+    e = ExecutionEngine(api=mock_api, max_cache_bytes=result_bytes, spill_dir=str(tmpdir))
+
+    e.execute_plan(_ndvi_plan(mock_api))
+
+    assert sorted(e.cache) == ['adjusted_ndvi', 'b30', 'b40', 'ndvi']
+    assert e.cache.nbytes <= result_bytes
+    assert len(tmpdir.listdir()) == 3
+
+    # Loading a spilled result spills another in its place
+    b40 = e.cache['b40']['array_result']['band_40']
+    assert b40.shape == (2, 400, 400)
+    assert (b40 == 1).all()
+    assert e.cache.nbytes <= result_bytes
+    assert len(tmpdir.listdir()) == 3
+
+    assert (e.cache['adjusted_ndvi']['array_result']['adjusted_ndvi'] == 0).all()
+
+
+def test_deleting_spilled_result_removes_file(mock_api, tmpdir):
+    e = ExecutionEngine(api=mock_api, max_cache_bytes=2 * 400 * 400 * 8, spill_dir=str(tmpdir))
+
+    e.execute_plan(_ndvi_plan(mock_api))
+    assert len(tmpdir.listdir()) == 3
+
+    # The least recently used result is on disk
+    del e.cache['b40']
+    assert 'b40' not in e.cache
+    assert len(tmpdir.listdir()) == 2
+
+    for name in list(e.cache):
+        del e.cache[name]
+    assert len(e.cache) == 0
+    assert tmpdir.listdir() == []
+
+
+def test_intermediate_results_released(mock_api):
+    e = ExecutionEngine(api=mock_api)
+
+    e.execute_plan(_ndvi_plan(mock_api), keep=['b30'])
+
+    # Only the results kept and those no other task uses are left
+    assert sorted(e.cache) == ['adjusted_ndvi', 'b30']
+    assert (e.cache['adjusted_ndvi']['array_result']['adjusted_ndvi'] == 0).all()
+
+
+def test_all_results_kept_by_default(mock_api):
+    e = ExecutionEngine(api=mock_api)
+
+    e.execute_plan(_ndvi_plan(mock_api))
+
+    assert sorted(e.cache) == ['adjusted_ndvi', 'b30', 'b40', 'ndvi']
+
+
+def test_independent_tasks_run_concurrently(mock_api):
+    loading = []
+    all_loading = threading.Event()
+    lock = threading.Lock()
+
+    def get_data(query_parameters):
+        # Each load waits for the other, so they only both finish if they run at the same time
+        with lock:
+            loading.append(query_parameters['variables'])
+            if len(loading) == 2:
+                all_loading.set()
+        assert all_loading.wait(10)
+        return mock_get_data(query_parameters)
+
+    mock_api.get_data.side_effect = get_data
+    e = ExecutionEngine(api=mock_api, max_workers=2)
+
+    e.execute_plan(_ndvi_plan(mock_api))
+
+    assert sorted(loading) == [('band_30',), ('band_40',)]
+    assert (e.cache['adjusted_ndvi']['array_result']['adjusted_ndvi'] == 0).all()
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_tasks_run_after_their_inputs(mock_api, max_workers):
+    e = ExecutionEngine(api=mock_api, max_workers=max_workers)
+    run = []
+    execute_task = e.execute_task
+
+    def record(task):
+        execute_task(task)
+        run.append(next(iter(task.keys())))
+    e.execute_task = record
+
+    # Tasks are run once their inputs have, wherever they are in the plan
+    plan = _ndvi_plan(mock_api)
+    e.execute_plan([plan[3], plan[2], plan[0], plan[1]])
+
+    assert sorted(run) == ['adjusted_ndvi', 'b30', 'b40', 'ndvi']
+    assert run.index('ndvi') > run.index('b40')
+    assert run.index('ndvi') > run.index('b30')
+    assert run.index('adjusted_ndvi') > run.index('ndvi')
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_tasks_using_each_other(mock_api, max_workers):
+    e = ExecutionEngine(api=mock_api, max_workers=max_workers)
+
+    plan = copy.deepcopy(_ndvi_plan(mock_api))
+    ndvi = next(iter(plan[2].values()))
+    ndvi['array_input'] = ['adjusted_ndvi', 'b30']
+
+    with pytest.raises(ValueError, match='Tasks use each other: ndvi, adjusted_ndvi'):
+        e.execute_plan(plan)
+
+
+def test_lazy_results_equal_eager(mock_api):
+    def get_data(query_parameters, dask_chunks=None):
+        data = mock_get_data(query_parameters)
+        for offset, name in enumerate(sorted(data['arrays'])):
+            values = numpy.arange(2 * 400 * 400, dtype=numpy.int32).reshape(2, 400, 400) % 997 + offset
+            data['arrays'][name] = data['arrays'][name].copy(data=values)
+            if dask_chunks is not None:
+                data['arrays'][name] = data['arrays'][name].chunk(dask_chunks)
+        return data
+
+    mock_api.get_data.side_effect = get_data
+
+    a = AnalyticsEngine(api=mock_api)
+
+    # Lake Burley Griffin
+    dimensions = {'longitude': {'range': (149.07, 149.18)},
+                  'latitude': {'range': (-35.32, -35.28)},
+                  'time': {'range': (datetime(1990, 1, 1), datetime(1990, 12, 31))}}
+
+    arrays = a.create_array(('LANDSAT_5', 'NBAR'), ['band_40', 'band_30'], dimensions, 'get_data')
+    a.apply_bandmath(arrays, '((array1 - array2) / (array1 + array2))', 'bandmath_ndvi')
+    b40 = a.create_array(('LANDSAT_5', 'NBAR'), ['band_40'], dimensions, 'b40')
+    b30 = a.create_array(('LANDSAT_5', 'NBAR'), ['band_30'], dimensions, 'b30')
+    ndvi = a.apply_expression([b40, b30], '((array1 - array2) / (array1 + array2))', 'ndvi')
+    a.apply_reduction(ndvi, ['time'], 'median', 'median_t')
+
+    eager = ExecutionEngine(api=mock_api)
+    eager.execute_plan(a.plan)
+    lazy = ExecutionEngine(api=mock_api, dask_chunks={'time': 1, 'y': 200, 'x': 200}, max_workers=4)
+    lazy.execute_plan(a.plan)
+
+    assert sorted(lazy.cache) == sorted(eager.cache)
+    for name in eager.cache:
+        for array_name, expected in eager.cache[name]['array_result'].items():
+            result = lazy.cache[name]['array_result'][array_name]
+            assert not hasattr(result.data, 'dask')
+            numpy.testing.assert_allclose(result, expected, equal_nan=True)
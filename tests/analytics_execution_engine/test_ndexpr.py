@@ -212,3 +212,38 @@ def test_3():
 
     ne.test_1_level()
     ne.test_2_level()
+
+
+def test_compiled_expressions():
+    ne = NDexpr()
+    coords = {'y': np.arange(3), 'x': np.arange(4)}
+    b3 = xr.DataArray(np.random.rand(3, 4).astype('float32'), dims=('y', 'x'), coords=coords)
+    b4 = xr.DataArray(np.random.rand(3, 4).astype('float32'), dims=('y', 'x'), coords=coords)
+    arrays = {'b3': b3, 'b4': b4, 'mask': b3 > 0.5}
+
+    ndvi = ne.evaluate('(b4 - b3) / (b4 + b3)', local_dict=arrays)
+    assert ndvi.equals((b4 - b3) / (b4 + b3))
+    assert ndvi.dtype == np.float32
+    assert ne.evaluate('(b3 > 0.2) & (b4 < 0.7)', local_dict=arrays).equals((b3 > 0.2) & (b4 < 0.7))
+    assert ne.evaluate('b3 * 2 + mask', local_dict=arrays).equals((b3 * 2).where(b3 > 0.5))
+
+    # Parsed once
+    compiled = ne.compile('(b4 - b3) / (b4 + b3)')
+    assert ne.compile('(b4 - b3) / (b4 + b3)') is compiled
+    assert ne.evaluate('(b4 - b3) / (b4 + b3)', local_dict={'b3': b4, 'b4': b3}).equals((b3 - b4) / (b3 + b4))
+
+
+def test_dask_expressions():
+    ne = NDexpr()
+    coords = {'time': np.arange(4), 'y': np.arange(10), 'x': np.arange(12)}
+    b3 = xr.DataArray(np.random.rand(4, 10, 12), dims=('time', 'y', 'x'), coords=coords)
+    b4 = xr.DataArray(np.random.rand(4, 10, 12), dims=('time', 'y', 'x'), coords=coords)
+    pq = xr.DataArray(np.random.choice([32767, 16383, 1024], size=(4, 10, 12)), dims=('time', 'y', 'x'),
+                      coords=coords)
+    arrays = {'b3': b3, 'b4': b4, 'pq': pq}
+    lazy_arrays = {name: array.chunk({'time': 1, 'y': 5, 'x': 6}) for name, array in arrays.items()}
+
+    for expr in ['(b4 - b3) / (b4 + b3)', 'median((b4 - b3) / (b4 + b3), 0)', 'max(b3, 1, 2)', 'b3{pq}']:
+        lazy = ne.evaluate(expr, local_dict=lazy_arrays)
+        assert lazy.chunks is not None
+        assert lazy.compute().equals(ne.evaluate(expr, local_dict=arrays))
@@ -1,4 +1,13 @@
+from collections import OrderedDict
+import math
+import threading
+
+import mock
+import pytest
+
 from datacube.api.query import GroupBy
+from datacube.api import core
+from datacube.api.core import set_measurement_conversion
 
 from datacube import Datacube
 import datetime
@@ -50,3 +59,40 @@ def _group_datasets_by_date(datasets):
 
     group_by = GroupBy(dimension, group_func, units, sort_key)
     return Datacube.group_datasets(datasets, group_by)
+
+
+def test_measurement_conversion():
+    measurements = OrderedDict([
+        ('red', {'name': 'red', 'dtype': 'int16', 'nodata': -999, 'units': '1'}),
+        ('lst', {'name': 'lst', 'dtype': 'int32', 'nodata': 0, 'units': 'K', 'scale_factor': 0.02}),
+    ])
+
+    assert set_measurement_conversion(measurements) is measurements
+
+    converted = set_measurement_conversion(measurements, nodata_to_nan=True, scale_offset=True)
+    assert converted['red']['dtype'] == 'float32'
+    assert converted['lst']['dtype'] == 'float64'
+    assert all(math.isnan(measurement['nodata']) for measurement in converted.values())
+    assert converted['red']['scale_offset'] == (1, 0)
+    assert converted['lst']['scale_offset'] == (0.02, 0)
+    assert measurements['red']['dtype'] == 'int16'
+
+    converted = set_measurement_conversion(measurements, dtype='float32')
+    assert converted['lst']['dtype'] == 'float32'
+    assert converted['lst']['nodata'] == 0
+    assert 'scale_offset' not in converted['lst']
+
+    with pytest.raises(ValueError):
+        set_measurement_conversion(measurements, dtype='int32', nodata_to_nan=True)
+
+
+def test_fuse_lazy_holds_lock(monkeypatch):
+    lock = threading.Lock()
+    held = []
+    monkeypatch.setattr(core, '_fuse_measurement', lambda *args, **kwargs: held.append(lock.locked()))
+    geobox = mock.Mock(shape=(2, 3))
+    measurement = {'name': 'red', 'dtype': 'int16', 'nodata': -999}
+
+    assert core.fuse_lazy([], geobox, measurement, prepend_dims=1, lock=lock).shape == (1, 2, 3)
+    core.fuse_lazy([], geobox, measurement)
+    assert held == [True, False]
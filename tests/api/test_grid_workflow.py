@@ -172,3 +172,39 @@ def test_gridworkflow_with_time_depth():
         for year, year_cell in cell.split_by_time(freq='A'):
             for t in year_cell.sources.time.values:
                 assert str(t)[:4] == year
+
+
+def test_gridworkflow_recorded_cells():
+    """ Datasets of a cell are looked up directly when the index has recorded the cells of the product. """
+    from mock import MagicMock
+    import datetime
+
+    fakecrs = geometry.CRS('EPSG:4326')
+    gridspec = GridSpec(crs=fakecrs, tile_size=(100, 100), resolution=(-10, 10))
+
+    fakedataset = MagicMock()
+    fakedataset.extent = geometry.box(left=100, bottom=-100, right=200, top=-200, crs=fakecrs)
+    fakedataset.center_time = datetime.datetime(2001, 2, 15)
+
+    fakeindex = MagicMock()
+    fakeindex.datasets.get_field_names.return_value = ['time']  # permit query on time
+    fakeindex.products.get_by_name.return_value.grid_spec = GridSpec(crs=fakecrs, tile_size=(100, 100),
+                                                                     resolution=(-10, 10))
+    fakeindex.datasets.has_all_cells.return_value = True
+    fakeindex.datasets.search_by_cell.return_value = iter([fakedataset])
+
+    from datacube.api.grid_workflow import GridWorkflow
+    gw = GridWorkflow(fakeindex, gridspec)
+
+    cells = gw.list_cells(cell_index=(1, -2), product='fake_product_name')
+    assert list(cells.keys()) == [(1, -2)]
+    assert len(cells[1, -2].sources.values[0]) == 1
+    fakeindex.datasets.search_by_cell.assert_called_once_with((1, -2), product='fake_product_name')
+    assert not fakeindex.datasets.search_eager.called
+
+    # Without all cells recorded, we search.
+    fakeindex.datasets.has_all_cells.return_value = False
+    fakeindex.datasets.search_eager.return_value = [fakedataset]
+    gw = GridWorkflow(fakeindex, gridspec)
+    assert list(gw.list_cells(cell_index=(1, -2), product='fake_product_name').keys()) == [(1, -2)]
+    assert fakeindex.datasets.search_eager.called
@@ -1,9 +1,12 @@
 # coding=utf-8
+import numpy
 import yaml
+import xarray
 
 import pytest
 
 from datacube.storage.masking import list_flag_names, create_mask_value, describe_variable_flags
+from datacube.storage.masking import make_mask, make_any_mask, unpack_mask
 from datacube.storage.masking import mask_to_dict, mask_valid_data, valid_data_mask
 
 
@@ -55,6 +58,30 @@ def test_ga_good_pixel():
     assert create_mask_value(bits_def, ga_good_pixel=True) == (16383, 16383)
 
 
+@pytest.mark.parametrize('dtype', ['uint8', 'int16', 'uint16', 'int32'])
+def test_make_any_mask(dtype):
+    bits_def = SimpleVariableWithFlagsDef.flags_definition
+    values = numpy.random.randint(0, 1 << 8 if dtype == 'uint8' else 1 << 14, size=(3, 4, 10)).astype(dtype)
+    variable = xarray.DataArray(values, dims=('time', 'y', 'x'), attrs={'flags_definition': bits_def})
+
+    def expected(**flags):
+        mask, mask_value = create_mask_value(bits_def, **flags)
+        return variable & mask == mask_value
+
+    assert make_mask(variable, green_saturated=False, red_saturated=False).equals(
+        expected(green_saturated=False, red_saturated=False))
+
+    flag_sets = [dict(green_saturated=False, red_saturated=False), dict(nir_saturated=True)]
+    any_mask = expected(**flag_sets[0]) | expected(**flag_sets[1])
+    assert make_any_mask(variable, flag_sets).equals(any_mask)
+    assert make_any_mask(variable.chunk({'time': 1, 'x': 5}), flag_sets).compute().equals(any_mask)
+
+    packed = make_any_mask(variable.chunk({'time': 1, 'x': 5}), flag_sets, packed=True)
+    assert packed.dtype == numpy.uint8
+    assert packed.shape == (3, 4, 2)
+    assert unpack_mask(packed.compute(), variable).equals(any_mask)
+
+
 def test_describe_flags():
     simple_var = SimpleVariableWithFlagsDef()
     describe_variable_flags(simple_var)
@@ -0,0 +1,125 @@
+from __future__ import absolute_import, division
+
+import numpy
+import pytest
+import xarray
+from affine import Affine
+
+from datacube import Datacube
+from datacube.api import core
+from datacube.api.reducers import BestPixel, Median, get_reducer, valid_data
+from datacube.utils import geometry
+
+NODATA = -999
+MEASUREMENTS = [{'name': 'red', 'dtype': 'int16', 'nodata': NODATA, 'units': '1'},
+                {'name': 'nir', 'dtype': 'int16', 'nodata': NODATA, 'units': '1'}]
+
+
+def _cube(seed=0, shape=(6, 5, 7)):
+    rng = numpy.random.RandomState(seed)
+    cube = {}
+    for measurement in MEASUREMENTS:
+        data = rng.randint(0, 1000, size=shape).astype('int16')
+        data[rng.rand(*shape) < 0.3] = NODATA
+        cube[measurement['name']] = data
+    # A pixel with no valid observations
+    for data in cube.values():
+        data[:, 0, 0] = NODATA
+    return cube
+
+
+def _slices(cube):
+    for index in range(cube['red'].shape[0]):
+        yield dict((name, data[index].copy()) for name, data in cube.items())
+
+
+def _masked(data):
+    return numpy.ma.masked_equal(data, NODATA)
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('mean', lambda data: _masked(data).mean(axis=0).filled(numpy.nan)),
+    ('median', lambda data: numpy.ma.median(_masked(data), axis=0).filled(numpy.nan)),
+    ('min', lambda data: _masked(data).min(axis=0).filled(NODATA)),
+    ('max', lambda data: _masked(data).max(axis=0).filled(NODATA)),
+    ('count', lambda data: (data != NODATA).sum(axis=0)),
+])
+def test_reducers_match_numpy(name, expected):
+    cube = _cube()
+    reducer = get_reducer(name)
+    result = reducer.reduce(MEASUREMENTS, _slices(cube))
+
+    for measurement in MEASUREMENTS:
+        reduced = reducer.measurement(measurement)
+        assert result[measurement['name']].dtype == reduced['dtype']
+        numpy.testing.assert_allclose(result[measurement['name']], expected(cube[measurement['name']]))
+
+
+def test_first_and_last_valid():
+    cube = _cube()
+    first = get_reducer('first').reduce(MEASUREMENTS, _slices(cube))
+    last = get_reducer('last').reduce(MEASUREMENTS, _slices(cube))
+
+    for name, data in cube.items():
+        valid = data != NODATA
+        times = numpy.arange(data.shape[0])[:, None, None]
+        first_index = numpy.where(valid, times, data.shape[0]).min(axis=0)
+        last_index = numpy.where(valid, times, -1).max(axis=0)
+        expected_first = numpy.take_along_axis(data, numpy.clip(first_index, 0, data.shape[0] - 1)[None], 0)[0]
+        expected_last = numpy.take_along_axis(data, numpy.clip(last_index, 0, data.shape[0] - 1)[None], 0)[0]
+        numpy.testing.assert_array_equal(first[name], numpy.where(valid.any(axis=0), expected_first, NODATA))
+        numpy.testing.assert_array_equal(last[name], numpy.where(valid.any(axis=0), expected_last, NODATA))
+
+
+def test_best_pixel():
+    cube = _cube()
+    reducer = BestPixel(lambda data: (data['nir'] - data['red']) / (data['nir'] + data['red']))
+    result = reducer.reduce(MEASUREMENTS, _slices(cube))
+
+    red, nir = cube['red'].astype('float64'), cube['nir'].astype('float64')
+    valid = (cube['red'] != NODATA) & (cube['nir'] != NODATA)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        score = numpy.where(valid, (nir - red) / (nir + red), -numpy.inf)
+    best = score.argmax(axis=0)[None]
+    for name, data in cube.items():
+        expected = numpy.where(valid.any(axis=0), numpy.take_along_axis(data, best, 0)[0], NODATA)
+        numpy.testing.assert_array_equal(result[name], expected)
+
+
+def test_valid_data():
+    assert valid_data(numpy.array([1, NODATA]), NODATA).tolist() == [True, False]
+    assert valid_data(numpy.array([1., numpy.nan]), NODATA).tolist() == [True, False]
+    assert valid_data(numpy.array([1., numpy.nan]), numpy.nan).tolist() == [True, False]
+    assert valid_data(numpy.array([1, NODATA]), None).tolist() == [True, True]
+
+
+def test_unknown_reducer():
+    with pytest.raises(ValueError):
+        get_reducer('mode')
+
+
+def test_reduce_data_by_chunk(monkeypatch):
+    cube = _cube(shape=(6, 9, 11))
+    affine = Affine(25, 0, 1500000, 0, -25, -3900000)
+    geobox = geometry.GeoBox(11, 9, affine, geometry.CRS('EPSG:3577'))
+
+    def fake_fuse(dest, datasets, chunk_geobox, measurement, **kwargs):
+        col, row = (int(round(v)) for v in ~affine * (chunk_geobox.affine.c, chunk_geobox.affine.f))
+        index, = datasets
+        dest[:] = cube[measurement['name']][index, row:row + dest.shape[0], col:col + dest.shape[1]]
+
+    monkeypatch.setattr(core, '_fuse_measurement', fake_fuse)
+
+    groups = numpy.empty(6, dtype=object)
+    for index in range(6):
+        groups[index] = (index,)
+    sources = xarray.DataArray(groups, dims=['time'])
+
+    result = Datacube.reduce_data(sources, geobox, MEASUREMENTS, Median(chunk_shape=(4, 3)))
+
+    assert set(result.data_vars) == {'red', 'nir'}
+    assert result.red.dims == geobox.dimensions
+    for name, data in cube.items():
+        numpy.testing.assert_allclose(result[name].values,
+                                      numpy.ma.median(_masked(data), axis=0).filled(numpy.nan))
+        assert numpy.isnan(result[name].attrs['nodata'])
@@ -0,0 +1,58 @@
+# coding=utf-8
+"""
+Tests for the caches of search results.
+"""
+from __future__ import absolute_import
+
+import datetime
+import pickle
+
+from dateutil import tz
+
+from datacube.index._cache import search_cache_key, MemorySearchCache, DiskSearchCache
+from datacube.model import Range
+
+
+def test_search_cache_key():
+    time = datetime.datetime(2014, 1, 1, 10, tzinfo=tz.tzutc())
+    query = {'product': 'ls8_nbar', 'time': Range(time, time + datetime.timedelta(days=1))}
+    assert search_cache_key(query) == search_cache_key(dict(reversed(list(query.items()))))
+
+    local_time = time.astimezone(tz.tzoffset('AEST', 10 * 60 * 60))
+    assert search_cache_key({'time': Range(local_time, local_time)}) == search_cache_key({'time': Range(time, time)})
+
+    assert search_cache_key(query) != search_cache_key(dict(query, product='ls7_nbar'))
+    assert search_cache_key(query) != search_cache_key(dict(query, source_filter={'product': 'ls8_level1'}))
+
+
+def _check_lru_eviction(cache):
+    cache.put('a', (((1, 0),), ['a1', 'a2']))
+    cache.put('b', (((1, 0),), ['b1']))
+    assert cache.get('a') == (((1, 0),), ['a1', 'a2'])
+
+    # 'b' is the least recently used.
+    cache.put('c', (((2, 3),), ['c1']))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') == (((2, 3),), ['c1'])
+
+    # Too large for the cache: not stored.
+    cache.put('d', ((), ['d'] * 4))
+    assert cache.get('d') is None
+
+    cache.clear()
+    assert cache.get('a') is None
+
+
+def test_memory_cache():
+    _check_lru_eviction(MemorySearchCache(max_datasets=3))
+
+
+def test_disk_cache(tmpdir):
+    path = str(tmpdir.join('cache', 'search.db'))
+    _check_lru_eviction(DiskSearchCache(path, max_datasets=3))
+
+    cache = DiskSearchCache(path, max_datasets=3)
+    cache.put('a', ((), ['a1']))
+    # Shared with other instances (and processes)
+    assert pickle.loads(pickle.dumps(cache)).get('a') == ((), ['a1'])
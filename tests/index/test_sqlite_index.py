@@ -0,0 +1,350 @@
+# coding=utf-8
+"""
+Tests for the embedded sqlite index, run against a temporary database file.
+"""
+from __future__ import absolute_import
+
+import datetime
+from uuid import UUID
+
+import pytest
+from dateutil import tz
+
+from datacube.index._api import Index
+from datacube.index._cache import MemorySearchCache, DiskSearchCache
+from datacube.index.exceptions import IndexSetupError, UnsupportedOperationError
+from datacube.index.sqlite import SqliteDb
+from datacube.model import Dataset, Range
+
+_PRODUCT = {
+    'name': 'ls8_scenes',
+    'description': 'test',
+    'metadata_type': 'eo',
+    'metadata': {
+        'platform': {'code': 'LANDSAT_8'},
+        'product_type': 'scene',
+    },
+}
+
+_SOURCE_PRODUCT = {
+    'name': 'ls8_level1',
+    'description': 'test',
+    'metadata_type': 'eo',
+    'metadata': {
+        'platform': {'code': 'LANDSAT_8'},
+        'product_type': 'level1',
+    },
+}
+
+
+def _doc(id_, product_type, lon, lat, day, sources=None):
+    return {
+        'id': str(id_),
+        'product_type': product_type,
+        'platform': {'code': 'LANDSAT_8'},
+        'instrument': {'name': 'OLI_TIRS'},
+        'extent': {
+            'from_dt': datetime.datetime(2014, 1, day, 1).isoformat(),
+            'to_dt': datetime.datetime(2014, 1, day, 2).isoformat(),
+            'center_dt': datetime.datetime(2014, 1, day, 1, 30).isoformat(),
+            'coord': {
+                'ul': {'lat': lat + 1, 'lon': lon},
+                'ur': {'lat': lat + 1, 'lon': lon + 1},
+                'll': {'lat': lat, 'lon': lon},
+                'lr': {'lat': lat, 'lon': lon + 1},
+            }
+        },
+        'lineage': {'source_datasets': sources or {}},
+    }
+
+
+_L1_ID = UUID('4ec8fe97-e8b9-11e4-87ff-1040f381a756')
+_SCENE_IDS = [UUID('f2f12372-8366-11e5-817e-1040f381a75%d' % i) for i in range(3)]
+
+
+@pytest.fixture
+def index(tmpdir):
+    index = Index(SqliteDb.create(str(tmpdir.join('index.db')), validate=False))
+    assert index.init_db()
+    assert not index.init_db()
+
+    source_product = index.products.add_document(_SOURCE_PRODUCT)
+    product = index.products.add_document(_PRODUCT)
+
+    level1_doc = _doc(_L1_ID, 'level1', 116, -28, 1)
+    level1 = Dataset(source_product, level1_doc, uris=['file:///l1/agdc-metadata.yaml'], sources={})
+    index.datasets.add(level1)
+    for i, id_ in enumerate(_SCENE_IDS):
+        sources = {'level1': level1} if i == 0 else {}
+        doc = _doc(id_, 'scene', 116 + i * 10, -28, 1 + i, sources={k: v.metadata_doc for k, v in sources.items()})
+        index.datasets.add(Dataset(product, doc, uris=['file:///scenes/%d.yaml' % i], sources=sources))
+    return index
+
+
+def test_requires_init(tmpdir):
+    with pytest.raises(IndexSetupError):
+        SqliteDb.create(str(tmpdir.join('empty.db')))
+
+
+def test_get_dataset(index):
+    dataset = index.datasets.get(_SCENE_IDS[0])
+    assert dataset.id == _SCENE_IDS[0]
+    assert dataset.type.name == 'ls8_scenes'
+    assert dataset.uris == ['file:///scenes/0.yaml']
+    assert index.datasets.has(_SCENE_IDS[1])
+    assert not index.datasets.has(UUID('00000000-0000-0000-0000-000000000000'))
+
+    dataset = index.datasets.get(_SCENE_IDS[0], include_sources=True)
+    assert dataset.sources['level1'].id == _L1_ID
+    assert [d.id for d in index.datasets.get_derived(_L1_ID)] == [_SCENE_IDS[0]]
+
+
+def test_search_spatial_and_time(index):
+    def ids(**query):
+        return {d.id for d in index.datasets.search(product='ls8_scenes', **query)}
+
+    assert ids() == set(_SCENE_IDS)
+    assert ids(lon=Range(115, 120)) == {_SCENE_IDS[0]}
+    assert ids(lon=Range(115, 130), lat=Range(-27.5, -20)) == set(_SCENE_IDS[:2])
+    assert ids(lat=Range(0, 10)) == set()
+    assert ids(lon=126.5) == {_SCENE_IDS[1]}
+
+    jan_2 = datetime.datetime(2014, 1, 2, tzinfo=tz.tzutc())
+    assert ids(time=Range(jan_2, jan_2 + datetime.timedelta(days=1))) == {_SCENE_IDS[1]}
+    assert ids(time=Range(jan_2, jan_2 + datetime.timedelta(days=5)), lon=Range(130, 140)) == {_SCENE_IDS[2]}
+    assert ids(platform='LANDSAT_8', instrument='OLI_TIRS') == set(_SCENE_IDS)
+    assert ids(instrument='TM') == set()
+
+    assert index.datasets.count(product='ls8_scenes', lon=Range(115, 130)) == 2
+    assert {d.id for d in index.datasets.search(source_filter={'product': 'ls8_level1'})} == {_SCENE_IDS[0]}
+
+
+def test_search_returning(index):
+    results = list(index.datasets.search_returning(('id', 'uri', 'time'), product='ls8_scenes', lon=Range(115, 120)))
+    assert len(results) == 1
+    assert results[0].id == _SCENE_IDS[0]
+    assert results[0].uri == 'file:///scenes/0.yaml'
+    assert results[0].time.lower == datetime.datetime(2014, 1, 1, 1, tzinfo=tz.tzutc())
+
+    summaries = list(index.datasets.search_summaries(product='ls8_scenes'))
+    assert {s['platform'] for s in summaries} == {'LANDSAT_8'}
+
+
+def test_count_through_time(index):
+    counts = index.datasets.count_product_through_time(
+        '1 day',
+        product='ls8_scenes',
+        time=Range(datetime.datetime(2014, 1, 1, tzinfo=tz.tzutc()), datetime.datetime(2014, 1, 4, tzinfo=tz.tzutc()))
+    )
+    assert [count for _, count in counts] == [1, 1, 1]
+
+
+def test_archive_and_locations(index):
+    index.datasets.archive([_SCENE_IDS[1]])
+    assert index.datasets.count(product='ls8_scenes') == 2
+    index.datasets.restore([_SCENE_IDS[1]])
+    assert index.datasets.count(product='ls8_scenes') == 3
+
+    assert index.datasets.add_location(_SCENE_IDS[0], 'file:///new/0.yaml')
+    assert not index.datasets.add_location(_SCENE_IDS[0], 'file:///new/0.yaml')
+    assert index.datasets.get_locations(_SCENE_IDS[0]) == ['file:///new/0.yaml', 'file:///scenes/0.yaml']
+
+    assert index.datasets.archive_location(_SCENE_IDS[0], 'file:///new/0.yaml')
+    assert index.datasets.get_archived_locations(_SCENE_IDS[0]) == ['file:///new/0.yaml']
+    assert index.datasets.restore_location(_SCENE_IDS[0], 'file:///new/0.yaml')
+    assert index.datasets.remove_location(_SCENE_IDS[0], 'file:///new/0.yaml')
+    assert [d.id for d in index.datasets.get_datasets_for_location('file:///scenes/0.yaml')] == [_SCENE_IDS[0]]
+
+
+def test_transactions(index):
+    db = index.datasets._db
+    with pytest.raises(ValueError):
+        with db.begin() as transaction:
+            assert transaction.in_transaction
+            transaction.archive_dataset(_SCENE_IDS[2])
+            raise ValueError('rollback')
+    assert index.datasets.count(product='ls8_scenes') == 3
+
+    with db.begin() as transaction:
+        transaction.archive_dataset(_SCENE_IDS[2])
+        # Rolled back within the transaction: not committed on exit
+        transaction.rollback()
+        assert not transaction.in_transaction
+    assert index.datasets.count(product='ls8_scenes') == 3
+
+    with db.begin() as transaction:
+        transaction.archive_dataset(_SCENE_IDS[2])
+    with db.connect() as connection:
+        assert not connection.in_transaction
+    assert index.datasets.count(product='ls8_scenes') == 2
+
+
+def test_no_user_management(index):
+    assert list(index.users.list_users()) == []
+    with pytest.raises(UnsupportedOperationError):
+        index.users.create_user('foo', 'password', 'user')
+    with pytest.raises(UnsupportedOperationError):
+        index.users.grant_role('user', 'foo')
+
+
+def test_cached_search(index):
+    index.datasets.search_cache = MemorySearchCache()
+
+    searches = []
+    do_search = index.datasets._do_search_by_product
+
+    def counting_search(*args, **kwargs):
+        searches.append(args)
+        return do_search(*args, **kwargs)
+
+    index.datasets._do_search_by_product = counting_search
+
+    def ids(**query):
+        return {d.id for d in index.datasets.search_eager(product='ls8_scenes', **query)}
+
+    assert ids(lon=Range(115, 130)) == set(_SCENE_IDS[:2])
+    assert ids(lon=Range(115, 130)) == set(_SCENE_IDS[:2])
+    assert len(searches) == 1
+
+    # Cached datasets are complete, independent copies.
+    dataset = index.datasets.search_eager(product='ls8_scenes', lon=Range(115, 120))[0]
+    assert dataset.type.name == 'ls8_scenes'
+    assert dataset.uris == ['file:///scenes/0.yaml']
+    dataset.metadata_doc['id'] = 'changed'
+    assert index.datasets.search_eager(product='ls8_scenes', lon=Range(115, 120))[0].id == _SCENE_IDS[0]
+    assert len(searches) == 2
+
+    # Changes to the product's datasets invalidate its cached searches.
+    index.datasets.archive([_SCENE_IDS[1]])
+    assert ids(lon=Range(115, 130)) == {_SCENE_IDS[0]}
+    assert len(searches) == 3
+    index.datasets.restore([_SCENE_IDS[1]])
+    assert ids(lon=Range(115, 130)) == set(_SCENE_IDS[:2])
+    assert index.datasets.add_location(_SCENE_IDS[0], 'file:///new/0.yaml')
+    assert index.datasets.search_eager(product='ls8_scenes', lon=Range(115, 120))[0].uris[0] == 'file:///new/0.yaml'
+    assert len(searches) == 5
+
+    # ... but not those of other products.
+    assert {d.id for d in index.datasets.search_eager(product='ls8_level1')} == {_L1_ID}
+    index.datasets.archive([_SCENE_IDS[2]])
+    assert {d.id for d in index.datasets.search_eager(product='ls8_level1')} == {_L1_ID}
+    assert len(searches) == 6
+
+
+def test_cache_shared_by_indexes(index, tmpdir):
+    cache = DiskSearchCache(str(tmpdir.join('cache.db')))
+    index.datasets.search_cache = cache
+    assert len(index.datasets.search_eager(product='ls8_scenes')) == 3
+
+    # The same products (and change counters) in another index.
+    other = Index(SqliteDb.create(str(tmpdir.join('other.db')), validate=False), search_cache=cache)
+    other.init_db()
+    other.products.add_document(_SOURCE_PRODUCT)
+    other.products.add_document(_PRODUCT)
+    with index._db.connect() as connection:
+        changes = connection.get_dataset_type_changes([1, 2])
+    for id_, count in changes.items():
+        other._db._connection().execute('update dataset_type set dataset_changes = ? where id = ?', (count, id_))
+    with other._db.connect() as connection:
+        assert connection.get_dataset_type_changes([1, 2]) == changes
+    assert other.datasets.search_eager(product='ls8_scenes') == []
+
+
+def test_untracked_index_is_not_cached(index, monkeypatch):
+    from datacube.index.sqlite._api import SqliteDbAPI
+    monkeypatch.setattr(SqliteDbAPI, 'get_dataset_type_changes', lambda self, ids: None)
+    index.datasets.search_cache = MemorySearchCache()
+    assert len(index.datasets.search_eager(product='ls8_scenes')) == 3
+    assert index.datasets.search_cache is None
+
+
+_GRIDDED_PRODUCT = {
+    'name': 'ls8_tiles',
+    'description': 'test',
+    'metadata_type': 'eo',
+    'metadata': {
+        'platform': {'code': 'LANDSAT_8'},
+        'product_type': 'tile',
+    },
+    'storage': {
+        'crs': 'EPSG:4326',
+        'tile_size': {'longitude': 1, 'latitude': 1},
+        'resolution': {'longitude': 0.25, 'latitude': -0.25},
+    },
+}
+
+
+def _tile_doc(id_, lon, lat, day):
+    doc = _doc(id_, 'tile', lon, lat, day)
+    doc['grid_spatial'] = {
+        'projection': {
+            'spatial_reference': 'EPSG:4326',
+            'geo_ref_points': {
+                'ul': {'x': lon, 'y': lat + 1},
+                'ur': {'x': lon + 1, 'y': lat + 1},
+                'll': {'x': lon, 'y': lat},
+                'lr': {'x': lon + 1, 'y': lat},
+            }
+        }
+    }
+    return doc
+
+
+def test_dataset_cells(index):
+    product = index.products.add_document(_GRIDDED_PRODUCT)
+    tile_ids = [UUID('a6d3ab0a-8367-11e5-8b4b-1040f381a75%d' % i) for i in range(2)]
+    # One in a single cell, one across four cells.
+    index.datasets.add(Dataset(product, _tile_doc(tile_ids[0], 116, -28, 1), uris=['file:///tiles/0.nc'], sources={}))
+    index.datasets.add(Dataset(product, _tile_doc(tile_ids[1], 116.5, -28.5, 2), uris=['file:///tiles/1.nc'],
+                               sources={}))
+
+    def cell_ids(cell_index, **query):
+        return {d.id for d in index.datasets.search_by_cell(cell_index, product='ls8_tiles', **query)}
+
+    assert index.datasets.has_all_cells(product)
+    assert cell_ids((116, -28)) == set(tile_ids)
+    assert cell_ids((117, -29)) == {tile_ids[1]}
+    assert cell_ids((115, -28)) == set()
+
+    jan_2 = datetime.datetime(2014, 1, 2, tzinfo=tz.tzutc())
+    assert cell_ids((116, -28), time=Range(jan_2, jan_2 + datetime.timedelta(days=1))) == {tile_ids[1]}
+    index.datasets.archive([tile_ids[0]])
+    assert cell_ids((116, -28)) == {tile_ids[1]}
+    index.datasets.restore([tile_ids[0]])
+
+    # A dataset without an extent is in no cells, but its cells are still recorded.
+    no_extent_id = UUID('a6d3ab0a-8367-11e5-8b4b-1040f381a759')
+    index.datasets.add(Dataset(product, _doc(no_extent_id, 'tile', 116, -28, 3), uris=['file:///tiles/2.nc'],
+                               sources={}))
+    assert index.datasets.has_all_cells(product)
+
+    # Datasets indexed without their cells (eg. by older versions) are filled in.
+    index.datasets._db._connection().executescript('delete from dataset_cell; delete from dataset_cell_recorded;')
+    assert not index.datasets.has_all_cells(product)
+    assert cell_ids((116, -28)) == set()
+    assert index.datasets.add_missing_cells(product, batch_size=1) == 3
+    assert index.datasets.has_all_cells(product)
+    assert cell_ids((116, -28)) == set(tile_ids)
+    assert index.datasets.add_missing_cells(product) == 0
+
+    # Products without a grid have no cells.
+    assert not index.datasets.has_all_cells(index.products.get_by_name('ls8_scenes'))
+    with pytest.raises(ValueError):
+        index.datasets.add_missing_cells(index.products.get_by_name('ls8_scenes'))
+
+
+def test_without_cell_tables(tmpdir):
+    path = str(tmpdir.join('index.db'))
+    db = SqliteDb(path)
+    assert Index(db).init_db()
+    assert not db.init()
+
+    # A database without the cell tables can still be used, without cell lookups.
+    db._connection().executescript('drop table dataset_cell_recorded; drop table dataset_cell;')
+    index = Index(SqliteDb.create(path))
+    product = index.products.add_document(_GRIDDED_PRODUCT)
+    assert not index.datasets.has_all_cells(product)
+    with pytest.raises(IndexSetupError):
+        list(index.datasets.search_by_cell((116, -28)))
+    with pytest.raises(IndexSetupError):
+        index.datasets.add_missing_cells(product)
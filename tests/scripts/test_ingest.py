@@ -0,0 +1,139 @@
+# coding=utf-8
+"""
+Tests for the ingestion task processing.
+"""
+from __future__ import absolute_import
+
+import datetime
+from collections import namedtuple
+
+import numpy
+import pytest
+from dateutil import tz
+from pathlib import Path
+from psycopg2.extras import DateTimeTZRange
+
+from datacube.executor import SerialExecutor
+from datacube.scripts import ingest
+
+_TaskResult = namedtuple('_TaskResult', ['values'])
+_GeoBox = namedtuple('_GeoBox', ['dimensions', 'shape'])
+
+
+class _FlakyDatasets(object):
+    def __init__(self, failures):
+        self.failures = failures
+        self.added = []
+
+    def add(self, dataset, sources_policy=None):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('Connection lost')
+        self.added.append(dataset)
+
+
+class _FakeIndex(object):
+    def __init__(self, failures=0):
+        self.datasets = _FlakyDatasets(failures)
+
+
+def _fake_ingest_work(config, source_type, output_type, tile, tile_index):
+    if tile_index == 'bad':
+        raise ValueError('Task failed')
+    return _TaskResult(['%s-%s' % (tile_index, i) for i in range(tile)])
+
+
+def test_process_tasks_indexes_in_background(monkeypatch):
+    monkeypatch.setattr(ingest, 'ingest_work', _fake_ingest_work)
+    monkeypatch.setattr(ingest.time, 'sleep', lambda seconds: None)
+
+    index = _FakeIndex(failures=2)
+    tasks = [{'tile': 2, 'tile_index': 'a'}, {'tile': 1, 'tile_index': 'bad'}, {'tile': 1, 'tile_index': 'b'}]
+    successful, failed = ingest.process_tasks(index, {}, None, None, tasks, 2, SerialExecutor())
+
+    # Failed index batches were retried, without recomputing.
+    assert (successful, failed) == (3, 1)
+    assert sorted(index.datasets.added) == ['a-0', 'a-1', 'b-0']
+
+
+def test_index_backlog_gives_up():
+    index = _FakeIndex(failures=100)
+    backlog = ingest._IndexBacklog(index, max_retries=1, retry_delay=0)
+    backlog.add([_TaskResult(['a']), _TaskResult(['b'])])
+    assert backlog.close() == (0, 2)
+
+
+def test_get_blocks():
+    geobox = _GeoBox(dimensions=('y', 'x'), shape=(4000, 4000))
+    config = {'storage': {'chunking': {'time': 1, 'y': 200, 'x': 200}, 'block_size': {'y': 1000, 'x': 4000}}}
+    blocks = ingest.get_blocks(config, geobox)
+    assert len(blocks) == 4
+    assert blocks[0] == (slice(0, 1000), slice(0, 4000))
+    assert blocks[-1] == (slice(3000, 4000), slice(0, 4000))
+
+    # Rounded to whole chunks, and clipped to the tile.
+    config['storage']['block_size'] = {'y': 1500, 'x': 100}
+    blocks = ingest.get_blocks(config, geobox)
+    assert blocks[0] == (slice(0, 1400), slice(0, 200))
+    assert blocks[-1] == (slice(2800, 4000), slice(3800, 4000))
+    assert len(blocks) == 3 * 20
+
+
+def test_time_key_matches_tile_index():
+    utc_time = datetime.datetime(2014, 1, 1, 0, 30)
+    local_time = datetime.datetime(2014, 1, 1, 10, 30, tzinfo=tz.tzoffset('AEST', 10 * 60 * 60))
+    assert ingest._time_key(local_time) == ingest._time_key(utc_time)
+    # The same as GridWorkflow.tile_sources() tile times.
+    assert ingest._time_key(utc_time) == numpy.array([utc_time], dtype='datetime64[ns]')[0]
+
+
+def test_time_key_of_solar_days():
+    # With group_by='solar_day', tiles are labelled with a numpy.datetime64 day.
+    day = numpy.datetime64('2014-01-01', 'D')
+    # ... which is the time of their ingested datasets, as read back from the index.
+    ingested = datetime.datetime(2014, 1, 1, tzinfo=tz.tzutc())
+    assert ingest._time_key(day) == ingest._dataset_time_key(DateTimeTZRange(ingested, ingested, '[]'))
+    assert ingest._time_key(day) != ingest._time_key(numpy.datetime64('2014-01-02', 'D'))
+
+
+def test_storage_driver():
+    assert ingest.get_storage_driver({'storage': {}}).format == 'NetCDF'
+    assert ingest.get_storage_driver({'storage': {'driver': 'NetCDF CF'}}).format == 'NetCDF'
+    assert ingest.get_storage_driver({'storage': {'driver': 'GeoTIFF'}}).format == 'GeoTIFF'
+    assert ingest.get_storage_driver({'storage': {'driver': 'Zarr'}}).format == 'Zarr'
+    with pytest.raises(ValueError):
+        ingest.get_storage_driver({'storage': {'driver': 'Tape'}})
+
+
+def test_geotiff_bands():
+    config = {'storage': {'driver': 'GeoTIFF'}, 'measurements': [{'name': 'red'}, {'name': 'nir'}]}
+    file_path = Path('/data/tile_1_2_2014.tif')
+    assert ingest._geotiff_bands(config, file_path) == {
+        'red': {'path': 'tile_1_2_2014_red.tif', 'layer': 1},
+        'nir': {'path': 'tile_1_2_2014_nir.tif', 'layer': 1},
+    }
+
+    config['storage']['multiband'] = True
+    assert ingest._geotiff_bands(config, file_path) == {
+        'red': {'path': 'tile_1_2_2014.tif', 'layer': 1},
+        'nir': {'path': 'tile_1_2_2014.tif', 'layer': 2},
+    }
+
+
+def test_output_files():
+    config = {'storage': {'driver': 'GeoTIFF'}, 'measurements': [{'name': 'red'}, {'name': 'nir'}]}
+    file_path = Path('/data/tile_1_2_2014.tif')
+    assert ingest.get_output_files(config, file_path) == [Path('/data/tile_1_2_2014_nir.tif'),
+                                                          Path('/data/tile_1_2_2014_red.tif')]
+    config['storage']['multiband'] = True
+    assert ingest.get_output_files(config, file_path) == [file_path]
+    assert ingest.get_output_files({'storage': {}}, Path('/data/tile_1_2_2014.nc')) == [Path('/data/tile_1_2_2014.nc')]
+
+
+def test_geotiff_blockshape():
+    geobox = _GeoBox(dimensions=('y', 'x'), shape=(4000, 4000))
+    assert ingest._geotiff_blockshape({'storage': {}}, geobox) == (512, 512)
+    chunking = {'time': 1, 'y': 256, 'x': 1024}
+    assert ingest._geotiff_blockshape({'storage': {'chunking': chunking}}, geobox) == (256, 1024)
+    with pytest.raises(ValueError):
+        ingest._geotiff_blockshape({'storage': {'chunking': {'time': 1, 'y': 200, 'x': 200}}}, geobox)
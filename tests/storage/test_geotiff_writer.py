@@ -0,0 +1,56 @@
+# coding=utf-8
+"""
+Tests for writing Cloud Optimised GeoTIFFs.
+"""
+from __future__ import absolute_import
+
+from collections import namedtuple
+
+import numpy
+import pytest
+import rasterio
+from affine import Affine
+from pathlib import Path
+
+from datacube.storage.geotiff_writer import COGStorageUnit
+
+_CRS = namedtuple('_CRS', ['crs_str'])
+_GeoBox = namedtuple('_GeoBox', ['shape', 'affine', 'crs'])
+
+GEOBOX = _GeoBox(shape=(300, 200), affine=Affine(25.0, 0.0, 1500000.0, 0.0, -25.0, -3900000.0),
+                 crs=_CRS('EPSG:3577'))
+
+
+def test_write_cog(tmpdir):
+    filename = Path(str(tmpdir)) / 'tiles' / 'band.tif'
+    data = numpy.arange(300 * 200, dtype='int16').reshape(300, 200)
+
+    unit = COGStorageUnit(filename, GEOBOX, count=2, dtype='int16', nodata=-999, blockshape=(64, 128))
+    unit.write(data, band=1)
+    unit.write(data[:100], band=2, window=(slice(0, 100), slice(None)))
+    unit.write(data[100:], band=2, window=(slice(100, 300), slice(None)))
+    unit.update_tags(title='test')
+    unit.close(overview_levels=[2, 4, 512])
+
+    assert [path.name for path in filename.parent.iterdir()] == ['band.tif']
+    with rasterio.open(str(filename)) as src:
+        assert src.count == 2
+        assert src.nodata == -999
+        assert src.block_shapes == [(64, 128), (64, 128)]
+        assert src.compression.value.lower() == 'deflate'
+        assert src.overviews(1) == [2, 4]
+        assert src.tags()['title'] == 'test'
+        assert src.transform == GEOBOX.affine
+        numpy.testing.assert_array_equal(src.read(1), data)
+        numpy.testing.assert_array_equal(src.read(2), data)
+
+    with pytest.raises(RuntimeError):
+        COGStorageUnit(filename, GEOBOX, count=1, dtype='int16')
+
+
+def test_abort_cog(tmpdir):
+    filename = Path(str(tmpdir)) / 'band.tif'
+    unit = COGStorageUnit(filename, GEOBOX, count=1, dtype='uint8')
+    unit.write(numpy.ones(GEOBOX.shape, dtype='uint8'))
+    unit.abort()
+    assert list(filename.parent.iterdir()) == []
@@ -1,7 +1,9 @@
 from __future__ import absolute_import, division, print_function
 
+import threading
 from contextlib import contextmanager
 
+import dask.array
 import mock
 import netCDF4
 import numpy
@@ -12,9 +14,9 @@ from affine import Affine, identity
 
 import datacube
 from datacube.model import Dataset, DatasetType, MetadataType
-from datacube.storage.storage import NetCDFDataSource, OverrideBandDataSource
+from datacube.storage.storage import NetCDFDataSource, OverrideBandDataSource, align_to_chunking
 from datacube.storage.storage import write_dataset_to_netcdf, reproject_and_fuse, read_from_source, Resampling, \
-    DatasetSource
+    DatasetSource, NETCDF_LOCK, _library_lock
 from datacube.utils import geometry
 
 GEO_PROJ = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],' \
@@ -49,6 +51,42 @@ def test_write_dataset_to_netcdf(tmpnetcdf_filename):
         assert var.getncattr('abc') == 'xyz'
 
 
+def test_write_dask_dataset_to_netcdf(tmpnetcdf_filename):
+    affine = Affine.scale(0.1, 0.1) * Affine.translation(20, 30)
+    geobox = geometry.GeoBox(100, 100, affine, geometry.CRS(GEO_PROJ))
+    dataset = xarray.Dataset(attrs={'extent': geobox.extent, 'crs': geobox.crs})
+    for name, coord in geobox.coordinates.items():
+        dataset[name] = (name, coord.values, {'units': coord.units, 'crs': geobox.crs})
+
+    data = numpy.arange(10000, dtype='int16').reshape(geobox.shape)
+    # Blocks that don't line up with the NetCDF chunks
+    dataset['B10'] = (geobox.dimensions,
+                      dask.array.from_array(data, chunks=(30, 70)),
+                      {'nodata': 0, 'units': '1', 'crs': geobox.crs})
+
+    progress = []
+    write_dataset_to_netcdf(dataset, tmpnetcdf_filename,
+                            variable_params={'B10': {'chunksizes': (25, 25)}},
+                            progress=lambda written, total: progress.append((written, total)))
+
+    with netCDF4.Dataset(tmpnetcdf_filename) as nco:
+        nco.set_auto_mask(False)
+        var = nco.variables['B10']
+        assert var.chunking() == [25, 25]
+        assert (var[:] == data).all()
+
+    # Blocks of whole chunks: 25 rows by 50 columns
+    assert progress == [(i, 8) for i in range(1, 9)]
+
+
+def test_align_to_chunking():
+    data = dask.array.zeros((100, 100), chunks=(30, 70))
+    assert align_to_chunking(data, [25, 25]).chunks == ((25, 25, 25, 25), (50, 50))
+    # Already aligned, or not chunked.
+    assert align_to_chunking(data, [10, 35]).chunks == data.chunks
+    assert align_to_chunking(data, 'contiguous') is data
+
+
 def test_netcdf_source(tmpnetcdf_filename):
     affine = Affine.scale(0.1, 0.1) * Affine.translation(20, 30)
     geobox = geometry.GeoBox(110, 100, affine, geometry.CRS(GEO_PROJ))
@@ -102,6 +140,34 @@ def test_netcdf_source(tmpnetcdf_filename):
         assert (dest[10:60, 10:65] == dataset['B10'][1::2, 1::2]).all()
 
 
+def _held_by_another_thread(lock):
+    result = []
+
+    def try_acquire():
+        acquired = lock.acquire(False)
+        if acquired:
+            lock.release()
+        result.append(not acquired)
+
+    thread = threading.Thread(target=try_acquire)
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+@pytest.mark.parametrize('filename, locked', [
+    ('NETCDF:"/tmp/file.nc":blue', True),
+    ('netcdf:/tmp/file.nc:blue', True),
+    ('HDF4_EOS:EOS_GRID:"/tmp/file.hdf":grid:band1', True),
+    ('HDF5:"/tmp/file.h5"://band1', True),
+    ('/tmp/file.tif', False),
+])
+def test_library_lock(filename, locked):
+    with _library_lock(filename):
+        assert _held_by_another_thread(NETCDF_LOCK) == locked
+    assert not _held_by_another_thread(NETCDF_LOCK)
+
+
 def test_first_source_is_priority_in_reproject_and_fuse():
     crs = mock.MagicMock()
     shape = (2, 2)
@@ -404,6 +470,47 @@ def test_read_from_source():
     # TODO: crs change
 
 
+def test_read_from_source_with_scale_offset():
+    data_source = FakeDataSource()
+
+    @contextmanager
+    def fake_open():
+        yield data_source
+
+    source = mock.Mock()
+    source.open = fake_open
+
+    for dst_shape, dst_transform, resampling in [
+            (data_source.shape, data_source.transform, Resampling.nearest),
+            ((307, 299), data_source.transform * Affine.scale(2, 2), Resampling.cubic)]:
+        expected = numpy.empty(dst_shape, dtype='float32')
+        with datacube.set_options(reproject_threads=1):
+            read_from_source(source, expected, dst_transform=dst_transform, dst_nodata=float('nan'),
+                             dst_projection=data_source.crs, resampling=resampling)
+            result = numpy.empty(dst_shape, dtype='float32')
+            read_from_source(source, result, dst_transform=dst_transform, dst_nodata=float('nan'),
+                             dst_projection=data_source.crs, resampling=resampling, scale_offset=(0.5, 10))
+
+        assert numpy.isnan(expected).any()
+        assert numpy.allclose(result, expected * 0.5 + 10, equal_nan=True)
+
+
+def test_nan_nodata_is_fused():
+    crs = mock.MagicMock()
+    shape = (2, 2)
+
+    source1 = _mock_datasetsource([[1, 1], [-1, -1]], crs=crs, shape=shape)
+    source2 = _mock_datasetsource([[2, 2], [2, 2]], crs=crs, shape=shape)
+    for source in (source1, source2):
+        source.open.return_value.__enter__.return_value.nodata = -1
+
+    output_data = numpy.empty(shape, dtype='float32')
+    reproject_and_fuse([source1, source2], output_data, dst_transform=identity, dst_projection=crs,
+                       dst_nodata=numpy.float32('nan'), scale_offset=(2, 0))
+
+    assert (output_data == [[2, 2], [4, 4]]).all()
+
+
 def test_read_raster_with_custom_crs_and_transform(example_gdal_path):
     import numpy as np
 
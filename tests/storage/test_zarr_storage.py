@@ -0,0 +1,74 @@
+# coding=utf-8
+"""
+Tests for Zarr Storage Units.
+"""
+from __future__ import absolute_import
+
+import datetime
+from collections import namedtuple, OrderedDict
+
+import numpy
+import pytest
+from affine import Affine
+from pathlib import Path
+
+zarr = pytest.importorskip('zarr')
+
+from datacube.storage.zarr_storage import create_zarr_storage_unit, ZarrBandDataSource  # noqa: E402
+
+_CRS = namedtuple('_CRS', ['wkt'])
+_Coordinate = namedtuple('_Coordinate', ['values', 'units'])
+
+
+class _GeoBox(object):
+    dimensions = ('y', 'x')
+    shape = (300, 200)
+    affine = Affine(25.0, 0.0, 1500000.0, 0.0, -25.0, -3900000.0)
+    crs = _CRS('PROJCS["GDA94 / Australian Albers"]')
+
+    @property
+    def coordinates(self):
+        return OrderedDict([('y', _Coordinate(numpy.arange(300) * -25.0 - 3900012.5, 'metre')),
+                            ('x', _Coordinate(numpy.arange(200) * 25.0 + 1500012.5, 'metre'))])
+
+
+TIMES = [datetime.datetime(2014, 1, 1), datetime.datetime(2014, 2, 1)]
+DATA = numpy.arange(2 * 300 * 200).reshape(2, 300, 200).astype('int32')
+
+
+@pytest.fixture
+def storage_unit(tmpdir):
+    path = Path(str(tmpdir)) / 'tiles' / 'unit.zarr'
+    group = create_zarr_storage_unit(path, _GeoBox(), TIMES, [{'name': 'red', 'dtype': 'int32', 'nodata': -999}],
+                                     {'time': 1, 'y': 64, 'x': 64}, {'title': 'test'}, {'cname': 'zstd'})
+    # Chunk-aligned blocks, as written by separate workers.
+    group['red'][:, :128] = DATA[:, :128]
+    group['red'][:, 128:] = DATA[:, 128:]
+    return path
+
+
+def test_create_zarr_storage_unit(storage_unit):
+    group = zarr.open_group(str(storage_unit), mode='r')
+    assert group.attrs['title'] == 'test'
+    assert Affine(*group.attrs['transform']) == _GeoBox.affine
+    assert group['red'].chunks == (1, 64, 64)
+    assert group['red'].fill_value == -999
+    assert group['red'].attrs['_ARRAY_DIMENSIONS'] == ['time', 'y', 'x']
+    assert list(group['time'][:]) == [1388534400.0, 1391212800.0]
+    numpy.testing.assert_array_equal(group['red'][:], DATA)
+
+    with pytest.raises(RuntimeError):
+        create_zarr_storage_unit(storage_unit, _GeoBox(), TIMES, [], {})
+
+
+def test_zarr_band_read(storage_unit):
+    array = zarr.open_group(str(storage_unit), mode='r')['red']
+    band = ZarrBandDataSource(array, 1, nodata=-999, crs=None, transform=_GeoBox.affine)
+    assert band.shape == (300, 200)
+    assert band.dtype == numpy.dtype('int32')
+
+    numpy.testing.assert_array_equal(band.read(), DATA[1])
+    numpy.testing.assert_array_equal(band.read(((10, 60), (20, 80))), DATA[1, 10:60, 20:80])
+    # Decimated reads pick the same pixels as GDAL.
+    numpy.testing.assert_array_equal(band.read(((10, 110), (20, 140)), out_shape=(50, 60)),
+                                     DATA[1, 11:110:2, 21:140:2])
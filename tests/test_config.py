@@ -12,6 +12,8 @@ def test_find_defaults():
     config = LocalConfig.find(paths=[])
     assert config.db_hostname == ''
     assert config.db_database == 'datacube'
+    assert config.index_driver == 'postgres'
+    assert config.search_cache is None
 
 
 def test_find_config():
@@ -0,0 +1,117 @@
+# coding=utf-8
+"""
+Tests for the task executors.
+"""
+from __future__ import absolute_import
+
+import json
+import threading
+
+import pytest
+
+from datacube.executor import get_executor, SerialExecutor, InstrumentedExecutor, format_summary
+
+
+def _thread_name(value):
+    if value < 0:
+        raise ValueError('Negative value')
+    return value, threading.current_thread().name
+
+
+def test_serial_executor():
+    assert isinstance(get_executor(None, None), SerialExecutor)
+
+
+def test_thread_executor():
+    executor = get_executor(None, 2, use_threads=True)
+
+    futures = [executor.submit(_thread_name, value) for value in range(4)]
+    results = executor.results(futures)
+    assert [value for value, _ in results] == list(range(4))
+    assert threading.current_thread().name not in set(name for _, name in results)
+
+    futures = [executor.submit(_thread_name, -1), executor.submit(_thread_name, 1)]
+    completed, failed, pending = [], [], futures
+    while pending:
+        result, pending = executor.next_completed(pending, None)
+        ready, not_ok, _ = executor.get_ready([result])
+        completed += ready
+        failed += not_ok
+    assert [executor.result(future) for future in completed][0][0] == 1
+    with pytest.raises(ValueError):
+        executor.result(failed[0])
+
+
+@pytest.mark.parametrize('workers,use_threads', [(None, False), (2, True)])
+def test_completion_queue(workers, use_threads):
+    for executor in (get_executor(None, workers, use_threads=use_threads),
+                     InstrumentedExecutor(get_executor(None, workers, use_threads=use_threads))):
+        completions = executor.completion_queue()
+        assert not completions and completions.wait() == []
+
+        for value in range(5):
+            completions.add(executor.submit(_thread_name, value))
+        assert len(completions) == 5
+
+        results = []
+        while completions:
+            finished = completions.wait()
+            assert finished
+            results += [executor.result(future)[0] for future in finished]
+        assert sorted(results) == list(range(5))
+
+
+@pytest.mark.parametrize('workers,use_threads', [(None, False), (2, True)])
+def test_instrumented_executor(tmpdir, workers, use_threads):
+    trace_file = str(tmpdir.join('trace.jsonl'))
+    executor = InstrumentedExecutor(get_executor(None, workers, use_threads=use_threads), trace_file=trace_file)
+
+    futures = [executor.submit(_thread_name, value) for value in (0, 1, -1, 2)]
+    results, errors = [], []
+    while futures:
+        future, futures = executor.next_completed(futures, None)
+        try:
+            results.append(executor.result(future)[0])
+        except ValueError as err:
+            errors.append(err)
+        executor.release(future)
+    assert sorted(results) == [0, 1, 2]
+    assert len(errors) == 1
+
+    summary = executor.summary()
+    assert (summary['completed'], summary['failed'], summary['pending']) == (3, 1, 0)
+    assert summary['result_bytes'] > 0
+    p50, p95 = summary['running']
+    assert 0 <= p50 <= p95
+    assert 'p50' in format_summary(summary)
+
+    executor.close()
+    with open(trace_file) as trace:
+        records = [json.loads(line) for line in trace]
+    assert sorted(record['task'] for record in records) == [0, 1, 2, 3]
+    failed, = [record for record in records if record['failed']]
+    assert failed['task'] == 2 and 'Negative value' in failed['error']
+    for record in records:
+        assert record['submitted'] <= record['started'] <= record['finished'] <= record['collected']
+
+
+def test_instrumented_executor_gathers_results():
+    executor = InstrumentedExecutor(get_executor(None, None))
+    futures = executor.map(_thread_name, range(3))
+    completed, failed, pending = executor.get_ready(futures)
+    assert executor.results(completed)[0][0] == 0
+    assert not failed and len(pending) == 2
+    assert executor.summary()['completed'] == 1
+
+
+def test_instrumented_executor_records_every_result():
+    executor = InstrumentedExecutor(get_executor(None, None))
+    futures = executor.map(_thread_name, (0, -1, 1))
+    with pytest.raises(ValueError):
+        executor.results(futures)
+
+    summary = executor.summary()
+    assert (summary['completed'], summary['failed'], summary['pending']) == (2, 1, 0)
+    # Result sizes aren't measured without a trace file.
+    assert summary['result_bytes'] is None
+    assert 'n/a result bytes' in format_summary(summary)
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+Tests for the user helper functions.
+"""
+from __future__ import absolute_import
+
+import dask.array as da
+import numpy
+import pytest
+import rasterio
+import xarray
+
+import datacube.api.core  # noqa: F401  (adds the `affine` property to xarray objects)
+from datacube.helpers import write_geotiff
+from datacube.utils import geometry
+
+TIMES = numpy.array(['2014-01-01', '2014-02-01', '2014-03-01'], dtype='datetime64[ns]')
+RED = numpy.arange(3 * 300 * 200).reshape(3, 300, 200).astype('int16')
+
+
+@pytest.fixture
+def dataset():
+    return xarray.Dataset({'red': (('time', 'y', 'x'), da.from_array(RED, chunks=(1, 100, 70))),
+                           'nir': (('time', 'y', 'x'), (RED + 1).astype('uint8'))},
+                          coords={'time': TIMES,
+                                  'y': -3900012.5 - 25 * numpy.arange(300),
+                                  'x': 1500012.5 + 25 * numpy.arange(200)},
+                          attrs={'crs': geometry.CRS('EPSG:3577')})
+
+
+def test_write_geotiff_time_slices_as_bands(tmpdir, dataset):
+    filename = str(tmpdir.join('all.tif'))
+    write_geotiff(filename, dataset, overview_levels=[2, 4], profile_override={'photometric': None})
+
+    with rasterio.open(filename) as src:
+        assert src.count == 6
+        assert src.dtypes[0] == 'int16'
+        assert src.overviews(1) == [2, 4]
+        assert src.tags(4) == {'name': 'nir', 'time': '2014-02-01T00:00:00'}
+        numpy.testing.assert_array_equal(src.read(3), RED[1])
+        numpy.testing.assert_array_equal(src.read(2), (RED[0] + 1).astype('uint8'))
+
+
+def test_write_geotiff_time_slices_as_files(tmpdir, dataset):
+    write_geotiff(str(tmpdir.join('slice_{time:%Y%m%d}.tif')), dataset, time_slices='files',
+                  profile_override={'photometric': None})
+
+    assert sorted(path.basename for path in tmpdir.listdir()) == ['slice_20140101.tif', 'slice_20140201.tif',
+                                                                  'slice_20140301.tif']
+    with rasterio.open(str(tmpdir.join('slice_20140301.tif'))) as src:
+        assert src.count == 2
+        numpy.testing.assert_array_equal(src.read(1), RED[2])
+
+    with pytest.raises(ValueError):
+        write_geotiff(str(tmpdir.join('slice.tif')), dataset, time_slices='files')
+
+
+def test_write_geotiff_time_index(tmpdir, dataset):
+    filename = str(tmpdir.join('one.tif'))
+    write_geotiff(filename, dataset, time_index=1, profile_override={'photometric': None})
+
+    with rasterio.open(filename) as src:
+        assert src.count == 2
+        numpy.testing.assert_array_equal(src.read(1), RED[1])
+
+
+@pytest.mark.parametrize('select', [
+    lambda dataset: dict(dataset=dataset, time_index=1),
+    lambda dataset: dict(dataset=dataset.isel(time=slice(1, 2))),
+])
+def test_write_geotiff_single_time_slice_as_file(tmpdir, dataset, select):
+    write_geotiff(str(tmpdir.join('slice_{time:%Y%m%d}.tif')), time_slices='files',
+                  profile_override={'photometric': None}, **select(dataset))
+
+    assert [path.basename for path in tmpdir.listdir()] == ['slice_20140201.tif']
+    with rasterio.open(str(tmpdir.join('slice_20140201.tif'))) as src:
+        assert src.tags(1) == {'name': 'red', 'time': '2014-02-01T00:00:00'}
+        numpy.testing.assert_array_equal(src.read(1), RED[1])
+
+    with pytest.raises(ValueError):
+        write_geotiff(str(tmpdir.join('slice_{time:%Y%m%d}.tif')), dataset.isel(time=0), time_slices='files')
@@ -1,8 +1,11 @@
 # coding=utf-8
 
+import pickle
+
 import numpy
-from datacube.model import GridSpec
-from datacube.utils import geometry
+from datacube import model
+from datacube.model import GridSpec, MetadataType, DatasetType
+from datacube.utils import geometry, intersects
 
 
 def test_gridspec():
@@ -32,3 +35,54 @@ def test_gridspec_upperleft():
     cells = {index: geobox for index, geobox in list(gs.tiles(bbox))}
     assert set(cells.keys()) == {(30, 15)}  # WELD grid spec has 21 vertical cells -- 21 - 6 = 15
     assert cells[(30, 15)].extent.boundingbox == tile_bbox
+
+
+def test_gridspec_tile_indexes():
+    gs = GridSpec(crs=geometry.CRS('EPSG:4326'), tile_size=(1, 1), resolution=(-0.1, 0.1), origin=(10, 10))
+    polys = [
+        geometry.polygon([(10, 12.2), (10.8, 13), (13, 10.8), (12.2, 10), (10, 12.2)], crs=geometry.CRS('EPSG:4326')),
+        # A thin strip, crossing tiles without any corners inside.
+        geometry.polygon([(10.5, 10.1), (14.5, 10.2), (14.5, 10.3), (10.5, 10.2), (10.5, 10.1)],
+                         crs=geometry.CRS('EPSG:4326')),
+        # Exactly one tile: touching its neighbours.
+        geometry.box(11, 11, 12, 12, crs=geometry.CRS('EPSG:4326')),
+    ]
+
+    for tile_buffer in [(0, 0), (0.2, 0.2)]:
+        tile_indexes = gs.tile_indexes(polys, tile_buffer=tile_buffer)
+        for poly, indexes in zip(polys, tile_indexes):
+            # The same tiles, in the same order, as checking every tile exactly
+            assert indexes == [index for index, geobox in gs.tiles(poly.boundingbox.buffered(*tile_buffer))
+                               if intersects(geobox.buffered(*tile_buffer).extent, poly)]
+
+    assert gs.tile_indexes(polys)[2] == [(1, 1)]
+
+
+def _metadata_type(description):
+    return MetadataType({'name': 'eo', 'description': description, 'dataset': {'search_fields': {}}}, {}, id_=1)
+
+
+def _product(metadata_type, description='test'):
+    return DatasetType(metadata_type, {'name': 'ls8_scenes', 'description': description, 'metadata_type': 'eo',
+                                       'metadata': {}}, id_=2)
+
+
+def test_unpickled_types_are_shared_by_identity():
+    product = _product(_metadata_type('one'))
+    first, second = pickle.loads(pickle.dumps(product)), pickle.loads(pickle.dumps(product))
+    assert first is second
+    assert model.unpickled_type(model.pickled_type_key(product)) is first
+
+    # The same name and id, but a different definition or metadata type.
+    changed = pickle.loads(pickle.dumps(_product(_metadata_type('one'), description='changed')))
+    assert changed is not first
+    assert changed.definition['description'] == 'changed'
+    other_type = pickle.loads(pickle.dumps(_product(_metadata_type('two'))))
+    assert other_type is not first
+    assert other_type.metadata_type.description == 'two'
+
+
+def test_unpickled_types_are_bounded():
+    for i in range(model._UNPICKLED_TYPES_MAX + 10):
+        pickle.loads(pickle.dumps(_metadata_type('type %d' % i)))
+    assert len(model._UNPICKLED_TYPES) == model._UNPICKLED_TYPES_MAX
@@ -0,0 +1,130 @@
+from __future__ import absolute_import, division
+
+import numpy
+import pytest
+
+from datacube_apps.stats import Count, Extreme, Moments, Percentiles, make_statistics
+
+NODATA = -999
+MEASUREMENT = {'name': 'red', 'dtype': 'int16', 'nodata': NODATA, 'units': '1'}
+
+
+def _cube(seed=0, shape=(9, 5, 7)):
+    rng = numpy.random.RandomState(seed)
+    data = rng.randint(0, 10000, size=shape).astype('int16')
+    data[rng.rand(*shape) < 0.3] = NODATA
+    # A pixel with no valid observations, and one with a single observation
+    data[:, 0, 0] = NODATA
+    data[:, 0, 1] = NODATA
+    data[4, 0, 1] = 1234
+    return data
+
+
+def _compute(statistic, data):
+    state = statistic.start(MEASUREMENT, data.shape[1:])
+    for array in data:
+        statistic.update(state, array, array != NODATA)
+    return statistic.finish(state)
+
+
+def _masked(data):
+    return numpy.ma.masked_equal(data, NODATA)
+
+
+def _percentile(data, q):
+    masked = _masked(data)
+    result = numpy.full(data.shape[1:], numpy.nan)
+    for index in numpy.ndindex(*data.shape[1:]):
+        values = masked[(slice(None),) + index].compressed()
+        if values.size:
+            result[index] = numpy.percentile(values, q)
+    return result
+
+
+def test_count():
+    data = _cube()
+    count, = _compute(Count(), data)
+    numpy.testing.assert_array_equal(count, (data != NODATA).sum(axis=0))
+
+
+@pytest.mark.parametrize('name, better, expected', [
+    ('min', numpy.less, lambda data: _masked(data).min(axis=0).filled(NODATA)),
+    ('max', numpy.greater, lambda data: _masked(data).max(axis=0).filled(NODATA)),
+])
+def test_extreme(name, better, expected):
+    data = _cube()
+    statistic = Extreme(name, better)
+    result, = _compute(statistic, data)
+    assert [output['name'] for output in statistic.outputs(MEASUREMENT)] == ['red_' + name]
+    assert result.dtype == data.dtype
+    numpy.testing.assert_array_equal(result, expected(data))
+
+
+def test_moments():
+    data = _cube()
+    mean, std = _compute(Moments(), data)
+    numpy.testing.assert_allclose(mean, _masked(data).mean(axis=0).filled(numpy.nan), rtol=1e-6)
+    numpy.testing.assert_allclose(std, _masked(data).std(axis=0).filled(numpy.nan), rtol=1e-5)
+
+    std_only = Moments(mean=False)
+    assert [output['name'] for output in std_only.outputs(MEASUREMENT)] == ['red_std']
+    assert len(_compute(std_only, data)) == 1
+
+
+def test_percentiles_match_numpy():
+    data = _cube()
+    percentiles = [0, 10, 50, 90, 100]
+    statistic = Percentiles(percentiles, value_range=(0, 10000), bins=200)
+    results = _compute(statistic, data)
+
+    for q, result in zip(percentiles, results):
+        expected = _percentile(data, q)
+        # Accurate to within a bin width
+        numpy.testing.assert_allclose(result, expected, atol=10000 / 200)
+    # The extremes are exact
+    numpy.testing.assert_array_equal(results[0], _masked(data.astype(float)).min(axis=0).filled(numpy.nan))
+    numpy.testing.assert_array_equal(results[-1], _masked(data.astype(float)).max(axis=0).filled(numpy.nan))
+    assert numpy.isnan(results[2][0, 0])
+    assert results[2][0, 1] == 1234
+
+
+@pytest.mark.parametrize('values', [
+    [5000] * 5,
+    [100, 200, 300, 400, 500],
+    [-50, 20000, 3],
+])
+def test_percentiles_of_a_pixel(values):
+    percentiles = [0, 10, 50, 90, 100]
+    data = numpy.array(values, dtype='int16').reshape(-1, 1, 1)
+    results = _compute(Percentiles(percentiles, value_range=(0, 10000), bins=200), data)
+
+    expected = numpy.percentile(values, percentiles)
+    numpy.testing.assert_allclose([result[0, 0] for result in results], expected, atol=10000 / 200)
+    assert min(values) <= results[1][0, 0] <= results[-2][0, 0] <= max(values)
+    if len(set(values)) == 1:
+        assert [result[0, 0] for result in results] == values
+
+
+def test_make_statistics():
+    statistics = make_statistics(['count', 'mean', 'min', 'max', 'std', 'percentile_10', 'percentile_50.5'],
+                                 percentile_bins={'bins': 100})
+    assert [type(statistic) for statistic in statistics] == [Count, Moments, Extreme, Extreme, Percentiles]
+
+    outputs = [output['name'] for statistic in statistics for output in statistic.outputs(MEASUREMENT)]
+    assert outputs == ['red_count', 'red_mean', 'red_std', 'red_min', 'red_max',
+                       'red_percentile_10', 'red_percentile_50.5']
+
+    percentiles = statistics[-1]
+    assert percentiles.percentiles == [10, 50.5]
+    assert percentiles.value_range == (0, 10000)
+    assert percentiles.bins == 100
+
+
+@pytest.mark.parametrize('names', [
+    ['mode'],
+    ['percentile_101'],
+    ['percentile_x'],
+])
+def test_make_statistics_invalid(names):
+    with pytest.raises(ValueError):
+        make_statistics(names)
@@ -4,8 +4,12 @@ Module
 """
 from __future__ import absolute_import
 
+import click
+import pytest
+
 from datacube.ui.task_app import task_app, run_tasks
 import datacube.executor
+from datacube import model
 
 
 def make_test_config(index, config, **kwargs):
@@ -63,6 +67,18 @@ def test_task_app_with_task_file(tmpdir):
     my_test_app(index, input_tasks_file=str(taskfile), app_arg=True)
 
 
+def test_task_app_shard_needs_task_file(tmpdir):
+    index = 'Fake Index'
+
+    app_config = tmpdir.join("app_config.yaml")
+    app_config.write('name: Test Config\r\n'
+                     'description: This is my test app config file')
+
+    with pytest.raises(click.UsageError):
+        my_test_app(index, app_config=str(app_config), task_shard=(0, 2),
+                    app_arg=True, config_arg=True, task_arg=True)
+
+
 def test_task_app_with_no_tasks(tmpdir):
     index = 'Fake Index'
 
@@ -172,3 +188,81 @@ def test_run_tasks():
     run_tasks(tasks, executor, task_func, process_result_func)
 
     assert not tasks_to_do
+
+
+def _indexed_datasets(tmpdir, count=3):
+    from datacube.index._api import Index
+    from datacube.index.sqlite import SqliteDb
+    from datacube.model import Dataset
+
+    index = Index(SqliteDb.create(str(tmpdir.join('index.db')), validate=False))
+    index.init_db()
+    product = index.products.add_document({
+        'name': 'ls8_scenes',
+        'description': 'test',
+        'metadata_type': 'eo',
+        'metadata': {'platform': {'code': 'LANDSAT_8'}, 'product_type': 'scene'},
+    })
+    return [Dataset(product, {'id': '4ec8fe97-e8b9-11e4-87ff-1040f381a7%02d' % i,
+                              'platform': {'code': 'LANDSAT_8'}},
+                    uris=['file:///scenes/%d.yaml' % i])
+            for i in range(count)]
+
+
+def test_pickle_stream_refers_to_products(tmpdir):
+    from datacube.ui.task_app import pickle_stream, unpickle_stream
+
+    datasets = _indexed_datasets(tmpdir)
+    product = datasets[0].type
+
+    taskfile = str(tmpdir.join('tasks.bin'))
+    assert pickle_stream(({'dataset': dataset} for dataset in datasets), taskfile) == 3
+
+    tasks = list(unpickle_stream(taskfile))
+    assert [task['dataset'] for task in tasks] == datasets
+    unpickled_product = tasks[0]['dataset'].type
+    assert all(task['dataset'].type is unpickled_product for task in tasks)
+    assert unpickled_product.definition == product.definition
+    assert unpickled_product.metadata_type.dataset_fields.keys() == product.metadata_type.dataset_fields.keys()
+    assert tasks[1]['dataset'].metadata.platform == 'LANDSAT_8'
+
+
+def test_task_file_shards(tmpdir):
+    from datacube.ui.task_app import TaskFile, save_tasks, load_tasks
+
+    datasets = _indexed_datasets(tmpdir, count=10)
+    taskfile = str(tmpdir.join('tasks.bin'))
+    assert save_tasks({'name': 'config'}, ({'index': i, 'dataset': d} for i, d in enumerate(datasets)), taskfile) == 10
+
+    with TaskFile(taskfile) as task_file:
+        assert len(task_file) == 10
+        assert task_file.config == {'name': 'config'}
+        assert task_file[7]['index'] == 7
+        assert task_file[-1]['dataset'] == datasets[-1]
+        assert task_file[7]['dataset'].type.definition == datasets[0].type.definition
+        # Its products are its own: not forgotten with the process's cache of unpickled types.
+        model._UNPICKLED_TYPES.clear()
+        assert task_file[8]['dataset'].type is task_file[7]['dataset'].type
+        with pytest.raises(IndexError):
+            task_file[10]
+
+    shards = []
+    for shard in range(3):
+        config, tasks = load_tasks(taskfile, shard=shard, num_shards=3)
+        assert config == {'name': 'config'}
+        shards.append([task['index'] for task in tasks])
+    assert shards == [[0, 1, 2], [3, 4, 5], [6, 7, 8, 9]]
+
+    with pytest.raises(ValueError):
+        load_tasks(taskfile, shard=3, num_shards=3)
+
+
+def test_load_sequential_task_file(tmpdir):
+    from datacube.ui.task_app import pickle_stream, load_tasks
+
+    taskfile = str(tmpdir.join('tasks.bin'))
+    pickle_stream([{'name': 'config'}] + ['Task: %d' % i for i in range(5)], taskfile)
+
+    config, tasks = load_tasks(taskfile, shard=1, num_shards=2)
+    assert config == {'name': 'config'}
+    assert list(tasks) == ['Task: 1', 'Task: 3']